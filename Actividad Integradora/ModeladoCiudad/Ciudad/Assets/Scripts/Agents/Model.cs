@@ -22,6 +22,9 @@ public class Model: MonoBehaviour
     private float factor = 10f;
     public float pedestrianY = 8f, floorY = 2f;
     private float xd, yd, zd;
+    private string session;
+    // Frames binarios en vez de JSON, mas ligeros con miles de agentes
+    public bool binaryFrames = false;
     private void Awake()
     {
         cars = new Dictionary<int, GameObject>();
@@ -87,14 +90,14 @@ public class Model: MonoBehaviour
     private IEnumerator GetDataInit(Action<ModelData> callback)
     {
         string url = "http://127.0.0.1:5000/init/" + numberCars + "/" + numberPedestrians;
+        if (binaryFrames) url += "?format=binary";
         using (UnityWebRequest getRequest = UnityWebRequest.Get(url))
         {
             yield return getRequest.SendWebRequest();
 
             if (getRequest.result == UnityWebRequest.Result.Success) {
-                string response = getRequest.downloadHandler.text;
-                Debug.Log(response);
-                ModelData modelData = JsonUtility.FromJson<ModelData>(response);
+                ModelData modelData = ParseFrame(getRequest);
+                if (binaryFrames) modelData.session = getRequest.GetResponseHeader("X-Session");
                 callback?.Invoke(modelData);
             }
             else
@@ -109,16 +112,15 @@ public class Model: MonoBehaviour
     private IEnumerator GetData(Action<ModelData> callback)
     {
 
-        string url = "http://127.0.0.1:5000/data/" + 0;
+        string url = "http://127.0.0.1:5000/data/" + 0 + "?session=" + session;
+        if (binaryFrames) url += "&format=binary";
 
         using (UnityWebRequest getRequest = UnityWebRequest.Get(url))
         {
             yield return getRequest.SendWebRequest();
 
             if (getRequest.result == UnityWebRequest.Result.Success) {
-                string response = getRequest.downloadHandler.text;
-                Debug.Log(response);
-                ModelData modelData = JsonUtility.FromJson<ModelData>(response);
+                ModelData modelData = ParseFrame(getRequest);
                 callback?.Invoke(modelData);
             }
             else
@@ -130,10 +132,24 @@ public class Model: MonoBehaviour
 
         // llamada al servidor de todos los agentes
     }
+    private ModelData ParseFrame(UnityWebRequest getRequest)
+    {
+        // El servidor contesta JSON si no sabe dar el formato binario
+        string contentType = getRequest.GetResponseHeader("Content-Type");
+        if (contentType != null && contentType.StartsWith(FrameReader.MimeType))
+        {
+            return FrameReader.Read(getRequest.downloadHandler.data);
+        }
+        string response = getRequest.downloadHandler.text;
+        Debug.Log(response);
+        return JsonUtility.FromJson<ModelData>(response);
+    }
+
     private void InitializeModel()
     {
         StartCoroutine(GetDataInit((modelData) =>
         {
+            session = modelData.session;
             CreateAgents(modelData);
             Debug.Log("number of cars: " + cars.Count);
 
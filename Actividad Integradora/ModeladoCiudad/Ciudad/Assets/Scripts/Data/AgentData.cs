@@ -11,6 +11,9 @@ public class AgentData
     public int direction;
     public float x;
     public float y;
+    // Solo los metrobuses: pasajeros a bordo y cupo
+    public int passengers;
+    public int capacity;
 }
 
 
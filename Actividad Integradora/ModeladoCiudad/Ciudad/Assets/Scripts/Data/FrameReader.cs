@@ -0,0 +1,100 @@
+using System.Collections;
+using System.Collections.Generic;
+using UnityEngine;
+using System;
+using System.Text;
+
+// Lee los frames binarios del servidor (?format=binary), ver Wire.py.
+// Todo viene en little-endian: un header con el step y cuantos agentes hay
+// de cada tipo, luego columnas id/x/y/direction por tipo (los metrobuses
+// ademas con passengers/capacity), x/y/color de los semaforos y al final el
+// ridership.
+public static class FrameReader
+{
+    public const string MimeType = "application/x-trans-frame";
+    private const int HeaderSize = 28;
+
+    public static ModelData Read(byte[] data)
+    {
+        return Read(data, out int step, out byte[] lightColors);
+    }
+
+    public static ModelData Read(byte[] data, out int step, out byte[] lightColors)
+    {
+        if (data.Length < HeaderSize || Encoding.ASCII.GetString(data, 0, 4) != "TRF2")
+        {
+            throw new FormatException("Not a binary frame");
+        }
+        step = (int)ReadUInt32(data, 4);
+        int[] counts = new int[4];
+        for (int i = 0; i < 4; i++)
+        {
+            counts[i] = (int)ReadUInt32(data, 12 + 4 * i);
+        }
+
+        int offset = HeaderSize;
+        ModelData modelData = new ModelData();
+        modelData.gridSize = ((int)ReadUInt16(data, 8), (int)ReadUInt16(data, 10));
+        modelData.cars = ReadAgents(data, counts[0], ref offset);
+        modelData.metrobuses = ReadAgents(data, counts[1], ref offset);
+        ReadLoad(data, modelData.metrobuses, ref offset);
+        modelData.pedestrians = ReadAgents(data, counts[2], ref offset);
+
+        // Los semaforos van en el mismo orden que trafficlights en el JSON
+        int lights = counts[3];
+        offset += 4 * lights;
+        lightColors = new byte[lights];
+        Buffer.BlockCopy(data, offset, lightColors, 0, lights);
+        offset += lights;
+
+        modelData.ridership = new Ridership();
+        modelData.ridership.boarded = (int)ReadUInt32(data, offset);
+        modelData.ridership.alighted = (int)ReadUInt32(data, offset + 4);
+        modelData.ridership.waiting = (int)ReadUInt32(data, offset + 8);
+        modelData.ridership.riding = (int)ReadUInt32(data, offset + 12);
+        return modelData;
+    }
+
+    private static List<AgentData> ReadAgents(byte[] data, int count, ref int offset)
+    {
+        int ids = offset;
+        int xs = ids + 4 * count;
+        int ys = xs + 2 * count;
+        int directions = ys + 2 * count;
+        List<AgentData> agents = new List<AgentData>(count);
+        for (int i = 0; i < count; i++)
+        {
+            AgentData agent = new AgentData();
+            agent.id = (int)ReadUInt32(data, ids + 4 * i);
+            agent.x = (short)ReadUInt16(data, xs + 2 * i);
+            agent.y = (short)ReadUInt16(data, ys + 2 * i);
+            agent.direction = (sbyte)data[directions + i];
+            agents.Add(agent);
+        }
+        offset = directions + count;
+        return agents;
+    }
+
+    // Pasajeros a bordo y cupo de cada metrobus, despues de sus columnas
+    private static void ReadLoad(byte[] data, List<AgentData> buses, ref int offset)
+    {
+        int passengers = offset;
+        int capacity = passengers + 2 * buses.Count;
+        for (int i = 0; i < buses.Count; i++)
+        {
+            buses[i].passengers = ReadUInt16(data, passengers + 2 * i);
+            buses[i].capacity = ReadUInt16(data, capacity + 2 * i);
+        }
+        offset = capacity + 2 * buses.Count;
+    }
+
+    private static uint ReadUInt32(byte[] data, int offset)
+    {
+        return (uint)(data[offset] | data[offset + 1] << 8 | data[offset + 2] << 16 | data[offset + 3] << 24);
+    }
+
+    private static ushort ReadUInt16(byte[] data, int offset)
+    {
+        return (ushort)(data[offset] | data[offset + 1] << 8);
+    }
+}
@@ -7,7 +7,19 @@ using System;
 public class ModelData
 {
     public (int, int) gridSize;
+    public string session;
     public List<AgentData> cars;
     public List<AgentData> metrobuses;
     public List<AgentData> pedestrians;
+    public Ridership ridership;
+}
+
+// Pasajeros de los metrobuses en toda la corrida, ver BusStops.py
+[Serializable]
+public class Ridership
+{
+    public int boarded;
+    public int alighted;
+    public int waiting;
+    public int riding;
 }
@@ -0,0 +1,164 @@
+import heapq
+from time import perf_counter
+import numpy as np
+from mesa.time import BaseScheduler
+
+
+class ActivityScheduler(BaseScheduler):
+    # Steps agents in the order they were added, like StagedActivation, but
+    # only the awake ones. An agent can go to sleep until a given step of
+    # MapModel.step_count or until a cell is left by someone; removed agents
+    # cost nothing. The clock is the model's step_count, which MapModel.step
+    # increments before calling step(). With `rank` the agents are stepped
+    # by rank first and then in the order they were added.
+    def __init__(self, model, rank=None):
+        super().__init__(model)
+        self.rank = rank
+        self.order = {}
+        self.by_order = {}
+        self.count = 0
+        # Orders of the agents stepped next step, sorted
+        self.awake = []
+        self.added = []
+        # While stepping: heap of the orders still to step this step
+        self.queue = []
+        self.current = None
+        self.following = []
+        self.woken = []
+        # Sleeping agents: order -> token, the token tells stale alarms apart
+        self.sleeping = {}
+        self.tokens = 0
+        self.alarms = []
+        self.waiting = {}
+
+    def add(self, agent):
+        super().add(agent)
+        key = (self.rank(agent) if self.rank else 0, self.count)
+        self.count += 1
+        self.order[agent] = key
+        self.by_order[key] = agent
+        # Agents added while stepping start on the next step
+        self.added.append(key)
+
+    def remove(self, agent):
+        super().remove(agent)
+        key = self.order.pop(agent)
+        del self.by_order[key]
+        self.sleeping.pop(key, None)
+
+    @property
+    def active_count(self):
+        return len(self.by_order) - len(self.sleeping)
+
+    def put_to_sleep(self, agent):
+        key = self.order.get(agent)
+        if key is None:
+            return None
+        self.tokens += 1
+        self.sleeping[key] = self.tokens
+        return key, self.tokens
+
+    def sleep(self, agent, until):
+        # Skip the agent until step `until`
+        ticket = self.put_to_sleep(agent)
+        if ticket:
+            key, token = ticket
+            heapq.heappush(self.alarms, (until, key, token))
+
+    def wait_for(self, agent, cell):
+        # Skip the agent until another agent leaves `cell`
+        ticket = self.put_to_sleep(agent)
+        if ticket:
+            self.waiting.setdefault(cell, []).append(ticket)
+
+    def cell_freed(self, cell):
+        tickets = self.waiting.pop(cell, None)
+        if tickets:
+            for key, token in tickets:
+                self.wake(key, token)
+
+    def awaken(self, agent):
+        # Wakes a sleeping agent before its alarm or its cell, it steps next
+        key = self.order.get(agent)
+        if key in self.sleeping:
+            self.wake(key, self.sleeping[key])
+
+    def wake(self, key, token):
+        if self.sleeping.get(key) != token:
+            return
+        del self.sleeping[key]
+        if self.current is not None and key > self.current:
+            # Its turn in this step has not come yet
+            heapq.heappush(self.queue, key)
+        else:
+            self.woken.append(key)
+
+    def step(self):
+        now = self.model.step_count
+        self.queue = list(heapq.merge(self.awake, sorted(self.woken), sorted(self.added)))
+        self.woken = []
+        self.added = []
+        while self.alarms and self.alarms[0][0] <= now:
+            until, key, token = heapq.heappop(self.alarms)
+            if self.sleeping.get(key) == token:
+                del self.sleeping[key]
+                heapq.heappush(self.queue, key)
+        self.following = []
+        # Agents are timed one by one only with metrics on
+        metrics = getattr(self.model, "metrics", None)
+        while self.queue:
+            key = heapq.heappop(self.queue)
+            agent = self.by_order.get(key)
+            if agent is None or key in self.sleeping or key == self.current:
+                continue
+            self.current = key
+            if metrics:
+                start = perf_counter()
+                agent.step()
+                metrics.agent(agent, perf_counter() - start)
+            else:
+                agent.step()
+            if key in self.by_order and key not in self.sleeping:
+                self.following.append(key)
+        self.current = None
+        self.awake = self.following
+        self.steps += 1
+        self.time += 1
+
+    def checkpoint(self):
+        # Only between steps. Keys are (rank, count) rows; the heap of alarms
+        # is kept as it is so it pops in the same order after a restore.
+        def keys(rows, width=2):
+            return np.array(rows, dtype=np.int64).reshape(-1, width)
+
+        return {"count": self.count, "tokens": self.tokens, "steps": self.steps, "time": self.time,
+                "ids": [agent.unique_id for agent in self.by_order.values()],
+                "keys": keys(list(self.by_order)),
+                "awake": keys(self.awake), "added": keys(self.added), "woken": keys(self.woken),
+                "sleeping": keys([key + (token,) for key, token in self.sleeping.items()], 3),
+                "alarms": keys([(until,) + key + (token,) for until, key, token in self.alarms], 4),
+                "waiting": keys([cell + key + (token,) for cell, tickets in self.waiting.items()
+                                 for key, token in tickets], 5)}
+
+    def restore(self, state, agents):
+        # `agents` by unique_id, the schedule must be empty
+        def keys(rows):
+            return [tuple(int(value) for value in row) for row in rows]
+
+        for unique_id, key in zip(state["ids"], keys(state["keys"])):
+            agent = agents[unique_id]
+            super().add(agent)
+            self.order[agent] = key
+            self.by_order[key] = agent
+        self.count = state["count"]
+        self.tokens = state["tokens"]
+        self.steps = state["steps"]
+        self.time = state["time"]
+        self.awake = keys(state["awake"])
+        self.added = keys(state["added"])
+        self.woken = keys(state["woken"])
+        self.sleeping = {row[:2]: row[2] for row in keys(state["sleeping"])}
+        self.alarms = [(row[0], row[1:3], row[3]) for row in keys(state["alarms"])]
+        self.waiting = {}
+        for row in keys(state["waiting"]):
+            self.waiting.setdefault(row[:2], []).append((row[2:4], row[4]))
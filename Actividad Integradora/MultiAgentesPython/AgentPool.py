@@ -0,0 +1,24 @@
+class AgentPool:
+    # Arrived agents kept to be reused for new trips, so a long session does
+    # not keep building agents. A reused agent runs __init__ again with its
+    # new id, as if it were new.
+    def __init__(self):
+        self.free = {}
+        self.created = 0
+        self.reused = 0
+
+    def release(self, agent):
+        self.free.setdefault(type(agent), []).append(agent)
+
+    def acquire(self, cls, unique_id, model, *args):
+        free = self.free.get(cls)
+        if free:
+            agent = free.pop()
+            agent.__init__(unique_id, model, *args)
+            self.reused += 1
+            return agent
+        self.created += 1
+        return cls(unique_id, model, *args)
+
+    def __len__(self):
+        return sum(len(free) for free in self.free.values())
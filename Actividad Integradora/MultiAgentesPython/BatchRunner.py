@@ -0,0 +1,141 @@
+import argparse
+import csv
+import functools
+import itertools
+import json
+import multiprocessing
+import time
+from ModeloV1 import MapModel
+from Rerouter import REPLANS
+from Gridlock import POLICIES
+
+COLUMNS = ["engine", "number_cars", "number_pedestrians", "number_buses", "replans", "gridlock", "seed", "steps",
+           "init_seconds", "run_seconds", "steps_per_second",
+           "cars_arrived", "pedestrians_arrived", "mean_car_trip_steps",
+           "mean_pedestrian_trip_steps", "car_moves", "bus_moves", "pedestrian_moves", "gridlocks",
+           "bus_boardings"]
+
+
+def run(scenario, step_stats=False):
+    # One headless run: no Flask, no visualization, no snapshots. With
+    # step_stats the row has the Metrics record of every step in
+    # "step_records", main() takes it out before the row is written
+    engine, number_cars, number_pedestrians, number_buses, replans, gridlock, seed, steps = scenario
+    start = time.perf_counter()
+    model = MapModel(37, 37, number_cars, number_buses, number_pedestrians, seed=seed, engine=engine,
+                     metrics="steps" if step_stats else False, replans=replans, gridlock=gridlock)
+    init_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(steps):
+        model.step()
+    run_seconds = time.perf_counter() - start
+    arrivals = model.arrivals
+    row = {
+        "engine": engine,
+        "number_cars": number_cars,
+        "number_pedestrians": number_pedestrians,
+        "number_buses": number_buses,
+        "replans": replans,
+        "gridlock": gridlock,
+        "seed": seed,
+        "steps": steps,
+        "init_seconds": init_seconds,
+        "run_seconds": run_seconds,
+        "steps_per_second": steps / run_seconds if run_seconds else 0.0,
+        "cars_arrived": arrivals["cars"],
+        "pedestrians_arrived": arrivals["pedestrians"],
+        "mean_car_trip_steps": model.trip_steps["cars"] / arrivals["cars"] if arrivals["cars"] else None,
+        "mean_pedestrian_trip_steps":
+            model.trip_steps["pedestrians"] / arrivals["pedestrians"] if arrivals["pedestrians"] else None,
+        "car_moves": model.moves["cars"],
+        "bus_moves": model.moves["metrobuses"],
+        "pedestrian_moves": model.moves["pedestrians"],
+        "gridlocks": model.gridlock.found_count,
+        "bus_boardings": model.bus_stops.boarded,
+    }
+    if step_stats:
+        row["step_records"] = model.metrics.steps
+    return row
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    # Rows are written in small row groups so a crash keeps what finished
+    def __init__(self, path, batch=64):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [(name, pyarrow.string() if name in ("engine", "gridlock")
+              else pyarrow.float64() if "seconds" in name or "mean" in name or name == "steps_per_second"
+              else pyarrow.int64()) for name in COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.batch = batch
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless parameter sweep of MapModel")
+    parser.add_argument("--engine", nargs="+", default=["agents"], choices=["agents", "vector"])
+    parser.add_argument("--cars", type=int, nargs="+", default=[10])
+    parser.add_argument("--pedestrians", type=int, nargs="+", default=[10])
+    parser.add_argument("--buses", type=int, nargs="+", default=[8])
+    parser.add_argument("--replans", type=int, nargs="+", default=[REPLANS],
+                        help="detours for stuck cars per step, 0 = none")
+    parser.add_argument("--gridlock", nargs="+", default=["yield"], choices=POLICIES)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--out", default="results.csv", help="a .csv or .parquet file")
+    parser.add_argument("--step-stats", default=None,
+                        help="a .jsonl file with the phase times and counters of every step of every run")
+    args = parser.parse_args()
+
+    scenarios = list(itertools.product(args.engine, args.cars, args.pedestrians, args.buses, args.replans,
+                                       args.gridlock, args.seeds, [args.steps]))
+    sink = ParquetSink(args.out) if args.out.endswith(".parquet") else CsvSink(args.out)
+    stats = open(args.step_stats, "w") if args.step_stats else None
+    with multiprocessing.Pool(args.processes) as pool:
+        for done, row in enumerate(pool.imap_unordered(functools.partial(run, step_stats=bool(stats)), scenarios), 1):
+            if stats:
+                scenario = {name: row[name] for name in COLUMNS[:7]}
+                for record in row.pop("step_records"):
+                    stats.write(json.dumps(dict(scenario, **record)) + "\n")
+            sink.write(row)
+            print("%d/%d %s cars=%d pedestrians=%d buses=%d replans=%d gridlock=%s seed=%d %.1f steps/s" % (
+                done, len(scenarios), row["engine"], row["number_cars"], row["number_pedestrians"],
+                row["number_buses"], row["replans"], row["gridlock"], row["seed"], row["steps_per_second"]))
+    sink.close()
+    if stats:
+        stats.close()
+
+
+if __name__ == "__main__":
+    main()
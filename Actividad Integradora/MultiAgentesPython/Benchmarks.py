@@ -0,0 +1,182 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import mesa
+import numpy as np
+from ModeloV1 import MapModel
+from CityMap import CityMap, CITY, tile_city
+from Router import Router
+from WalkRouter import WalkRouter
+
+# Agents of every tier, half cars and half pedestrians
+TIERS = {"tiny": 10, "small": 100, "medium": 1000, "large": 10000}
+# Stock map and copies of it joined in a grid, see tile_city
+MAPS = {"stock": (1, 1), "2x2": (2, 2), "4x4": (4, 4)}
+GENERATED = os.path.join(os.path.dirname(CITY), "generated")
+# Timings this much slower than the baseline are regressions; sub-millisecond
+# ones move by 10% between runs on the same machine
+TOLERANCE = 0.25
+# Timings compared against the baseline, lower is better
+TIMINGS = ("init_seconds", "step_seconds", "step_p95_seconds", "route_seconds_per_agent",
+           "ubication_seconds", "delta_seconds", "data_round_trip_seconds")
+
+
+def map_path(name):
+    # Tiled maps are written once next to the stock one, their compiled
+    # cache is then reused like the one of any map
+    columns, rows = MAPS[name]
+    if (columns, rows) == (1, 1):
+        return CITY
+    path = os.path.join(GENERATED, "city-%s.json" % name)
+    if not os.path.exists(path):
+        os.makedirs(GENERATED, exist_ok=True)
+        with open(CITY) as file:
+            document = tile_city(json.load(file), columns, rows)
+        with open(path, "w") as file:
+            json.dump(document, file)
+    return path
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def bench_model(city, agents, engine, seed, steps, repeat):
+    template = CityMap.template(city)
+    cars, pedestrians = agents // 2, agents - agents // 2
+
+    def build():
+        return MapModel(template.width, template.height, cars, len(template.bus_starts), pedestrians, seed=seed, engine=engine,
+                        city=city)
+
+    # The first build also loads the map, it is left out
+    build()
+    init = min(timed(build)[0] for i in range(repeat))
+    model = build()
+
+    # Routing without the routes other models already read from the tables
+    router = Router(model, model.parking_lots)
+    router.load(template.next_hop)
+    walk_router = WalkRouter(model, model.directions)
+    walk_router.load(template.segment, template.crossing, template.crossings, dict(template.walk_trees))
+    route = timed(lambda: [router.get_route(car.position, car.destiny) for car in model.cars.values()]
+                  + [walk_router.get_route(p.position, p.destiny) for p in model.pedestrians.values()])[0]
+
+    model.ubication(visible_only=True)
+    step_times = []
+    ubication_times = []
+    delta_times = []
+    snapshot_bytes = 0
+    for i in range(steps):
+        step_times.append(timed(model.step)[0])
+        seconds, data = timed(lambda: model.ubication(visible_only=True))
+        ubication_times.append(seconds)
+        delta_times.append(timed(model.delta)[0])
+        snapshot_bytes += len(json.dumps(data, separators=(",", ":")))
+    return {
+        "init_seconds": init,
+        "step_seconds": statistics.mean(step_times),
+        "step_p95_seconds": float(np.percentile(step_times, 95)),
+        "route_seconds_per_agent": route / max(1, len(model.cars) + len(model.pedestrians)),
+        "ubication_seconds": statistics.mean(ubication_times),
+        "delta_seconds": statistics.mean(delta_times),
+        "snapshot_bytes": snapshot_bytes // steps,
+        "arrivals": dict(model.arrivals),
+    }
+
+
+def bench_data(agents, engine, steps):
+    # /data through Flask and a session worker, as the Unity client sees it.
+    # The server only runs the stock map.
+    import app
+    client = app.app.test_client()
+    cars, pedestrians = agents // 2, agents - agents // 2
+    session = client.get("/init/%d/%d?engine=%s" % (cars, pedestrians, engine)).get_json()["session"]
+    times = [timed(lambda: client.get("/data/0?session=" + session))[0] for i in range(steps)]
+    client.delete("/session/" + session)
+    return {"data_round_trip_seconds": statistics.mean(times)}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__, "mesa": mesa.__version__,
+            "machine": platform.machine(), "processor": platform.processor(), "commit": commit,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Timings of the scenarios both runs have, as new / baseline
+    before = {result["scenario"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = before.get(result["scenario"])
+        if old is None:
+            continue
+        for name in TIMINGS:
+            if name in result and old.get(name):
+                ratio = result[name] / old[name]
+                flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+                print("%-28s %-26s %10.3g -> %10.3g  x%.2f%s" % (result["scenario"], name, old[name],
+                                                                 result[name], ratio, flag))
+                if flag:
+                    regressions.append((result["scenario"], name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of MapModel with fixed seeds")
+    parser.add_argument("--tiers", nargs="+", default=["tiny", "small", "medium"], choices=list(TIERS))
+    parser.add_argument("--maps", nargs="+", default=["stock", "2x2"], choices=list(MAPS))
+    parser.add_argument("--engine", nargs="+", default=["agents", "vector"], choices=["agents", "vector"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3, help="builds timed, the fastest counts")
+    parser.add_argument("--no-data", action="store_true", help="skip the /data round trip")
+    parser.add_argument("--out", default="benchmarks.json")
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = []
+    for map_name in args.maps:
+        city = map_path(map_name)
+        for tier in args.tiers:
+            for engine in args.engine:
+                agents = TIERS[tier]
+                scenario = "%s/%s/%s" % (map_name, tier, engine)
+                gc.collect()
+                result = {"scenario": scenario, "map": map_name, "tier": tier, "agents": agents,
+                          "engine": engine, "seed": args.seed, "steps": args.steps}
+                result.update(bench_model(city, agents, engine, args.seed, args.steps, args.repeat))
+                if map_name == "stock" and not args.no_data:
+                    result.update(bench_data(agents, engine, args.steps))
+                results.append(result)
+                print("%-24s init %.4fs  step %.5fs  route %.2gs/agent  ubication %.5fs" % (
+                    scenario, result["init_seconds"], result["step_seconds"], result["route_seconds_per_agent"],
+                    result["ubication_seconds"]))
+
+    with open(args.out, "w") as file:
+        json.dump({"environment": environment(), "results": results}, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("%d timings slower than the baseline by more than %d%%" % (len(regressions),
+                                                                            args.tolerance * 100))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
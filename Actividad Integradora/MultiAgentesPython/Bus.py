@@ -1,19 +1,28 @@
 from mesa import Agent 
-from BusStop import BusStop
-from StreetBus import StreetBus
-from TrafficLight import TrafficLight
-from Crosswalk import Crosswalk
+from Terrain import STREETBUS, CROSSWALK
+from Occupancy import BUS
+from BusLine import DWELL, MAX_HOLD
+from BusStops import CAPACITY
 
 class Bus(Agent):
     def __init__(self, unique_id, model,position):
         super().__init__(unique_id, model)
         self.pos = None
+        self.show = True
         self.wait = 0
+        # Steps left at the stop and steps held there for the headway
         self.wait4passengers = 0
+        self.held = 0
+        # Place on the BusLine, set by BusLine.add and BusLine.link
+        self.loop = None
+        self.offset = None
+        self.ahead = None
+        self.behind = None
+        # Pedestrians on board by the stop they get off at, see BusStops
+        self.capacity = CAPACITY
+        self.passengers = 0
+        self.riders = {}
         self.direccion = self.get_initial_position(position)
-        
-    def wait4passengers(self):
-        ...
     
     def get_initial_position(self, position):
         x, y = position
@@ -22,35 +31,24 @@ class Bus(Agent):
         possible_steps.append((x, y-1))
         possible_steps.append((x+1, y))    
         possible_steps.append((x-1, y))
+        terrain = self.model.terrain
         for step in possible_steps:
-            cell = self.model.grid.get_cell_list_contents(step)
-            for value in cell:
-                if type(value) is StreetBus:
-                    return value.direccion
+            if terrain.contains(step) and terrain.has(step, STREETBUS):
+                return int(terrain.bus_direction[step])
                 
-    def check_traffic_ligh(self, cell):
-        trafficLight = None
-        car = None
-        crosswalk = None
-        busstop = None
-        for value in cell:
-            if type(value) is TrafficLight:
-                trafficLight = value
-            elif type(value) is Bus:
-                car = value
-            elif type(value) is Crosswalk:
-                crosswalk = value
-            elif type(value) is BusStop:
-                busstop = value
-            # elif type(value) is Crosswalk and :
-            #     return True
-        if trafficLight:
-            if trafficLight.color == 1 or trafficLight.color == 2:
-                return False
-            else:
-                return True
-        elif car:
+    def check_traffic_ligh(self, pos):
+        terrain = self.model.terrain
+        light = terrain.light[pos]
+        trafficLight = self.model.traffic_lights[light] if light >= 0 else None
+        crosswalk = terrain.has(pos, CROSSWALK)
+        if self.model.metrics:
+            self.model.metrics.count("cell_lookups")
+        if trafficLight and (trafficLight.color == 1 or trafficLight.color == 2):
             return False
+        elif self.model.occupancy.vehicle_blocked(BUS, pos, self.model.step_count):
+            return False
+        elif trafficLight:
+            return True
         elif crosswalk:
             if self.wait < 6:
                 self.wait += 1
@@ -58,43 +56,31 @@ class Bus(Agent):
             else:
                 self.wait = 0
                 return True
-        # elif busstop:
-        #     if self.wait4passengers < 10:
-        #         self.wait4passengers += 1
-        #         return False
-        #     else:
-        #         self.wait4passengers = 0
-        #         return True
         else:
             return True
             
         
     def move(self):
-        cell = self.model.grid.get_cell_list_contents(self.pos)
-        
-        for value in cell:
-            if type(value) is StreetBus:
-                diretion = value.direccion
-                if diretion == 0 and self.pos[1]+1 != 36:
-                    next_cell = self.model.grid.get_cell_list_contents((self.pos[0], self.pos[1] + 1))
-                    if self.check_traffic_ligh(next_cell):
-                        self.model.grid.move_agent(self, (self.pos[0], self.pos[1] + 1))
-                elif diretion == 1 and self.pos[1]-1 != 0:
-                    next_cell = self.model.grid.get_cell_list_contents((self.pos[0], self.pos[1] - 1))
-                    if self.check_traffic_ligh(next_cell):
-                        self.model.grid.move_agent(self, (self.pos[0], self.pos[1] - 1))
-                elif diretion == 2 and self.pos[0]+1 != 36:
-                    next_cell = self.model.grid.get_cell_list_contents((self.pos[0] + 1, self.pos[1]))
-                    if self.check_traffic_ligh(next_cell):
-                        self.model.grid.move_agent(self, (self.pos[0] + 1, self.pos[1]))
-                elif diretion == 3 and self.pos[0]-1 != 0:
-                    next_cell = self.model.grid.get_cell_list_contents((self.pos[0] - 1, self.pos[1]))
-                    if self.check_traffic_ligh(next_cell):
-                        self.model.grid.move_agent(self, (self.pos[0] - 1, self.pos[1]))
-                else:
-                    print("Error")
-            
-        ...
+        line = self.model.bus_line
+        if line.at_stop(self):
+            self.model.bus_stops.exchange(self)
+        if self.wait4passengers > 0:
+            self.wait4passengers -= 1
+            return
+        # Headway control: a bus too close to the one ahead waits at the stop
+        # for the gaps to even out
+        if line.at_stop(self) and self.held < MAX_HOLD and line.bunched(self):
+            self.held += 1
+            return
+        next_pos = line.next_cell(self)
+        if self.check_traffic_ligh(next_pos):
+            self.model.move_agent(self, next_pos)
+            line.advance(self)
+            self.held = 0
+            if line.at_stop(self):
+                self.wait4passengers = DWELL
+        elif self.model.metrics:
+            self.model.metrics.count("blocked_moves")
         
     def step(self) -> None:
         self.move()
@@ -0,0 +1,104 @@
+import numpy as np
+from Terrain import BUSSTOP
+
+# Steps a bus stays at a stop
+DWELL = 3
+# Most steps a bus waits at a stop on top of DWELL to even out the gaps
+MAX_HOLD = 10
+# Moves along bus_direction, 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda
+STEPS = {0: (0, 1), 1: (0, -1), 2: (1, 0), 3: (-1, 0)}
+
+
+def trace_loops(terrain, starts):
+    # The metrobus lanes as loops of Terrain.index cells in driving order,
+    # found by following bus_direction from every start. None if a lane from
+    # a start doesn't come back to it.
+    loops = []
+    on_loop = set()
+    for start in starts:
+        start = tuple(start)
+        if terrain.index(start) in on_loop:
+            continue
+        loop = []
+        cell = start
+        while True:
+            loop.append(terrain.index(cell))
+            dx, dy = STEPS.get(int(terrain.bus_direction[cell]), (0, 0))
+            cell = (cell[0] + dx, cell[1] + dy)
+            if (dx, dy) == (0, 0) or not terrain.contains(cell) or cell == start:
+                break
+            if len(loop) > terrain.width * terrain.height:
+                return None
+        if cell != start:
+            return None
+        loops.append(loop)
+        on_loop.update(loop)
+    return loops
+
+
+class BusLine:
+    # The buses of a model on the loops of its map. A bus is a loop and an
+    # offset along it, so its next cell is the next entry of the loop. Buses
+    # can't pass each other, the order along a loop never changes and every
+    # bus knows the one ahead and behind, so the gaps that headway control
+    # needs are a subtraction.
+    def __init__(self, city, terrain):
+        self.terrain = terrain
+        ends = np.cumsum(city.bus_loops)
+        self.loops = np.split(np.asarray(city.bus_ring), ends[:-1]) if len(ends) else []
+        self.loop_of = np.full(terrain.width * terrain.height, -1, dtype=np.int32)
+        self.offset_of = np.full(terrain.width * terrain.height, -1, dtype=np.int32)
+        for i, loop in enumerate(self.loops):
+            self.loop_of[loop] = i
+            self.offset_of[loop] = np.arange(len(loop))
+        self.fleets = [[] for loop in self.loops]
+        # Changes with every bus added
+        self.version = 0
+
+    def starts(self, number, bus_starts):
+        # Cells of `number` new buses: the starts of the map when there is
+        # one bus for each, otherwise evenly spread over all the loops
+        if number == len(bus_starts):
+            return list(bus_starts)
+        total = sum(len(loop) for loop in self.loops)
+        if number > total:
+            raise ValueError("%d buses don't fit in %d metrobus cells" % (number, total))
+        ring = np.concatenate(self.loops) if self.loops else np.zeros(0, dtype=np.int32)
+        first = int(np.flatnonzero(ring == self.terrain.index(bus_starts[0]))[0]) if bus_starts else 0
+        return [self.terrain.cell(int(ring[(first + i * total // number) % total])) for i in range(number)]
+
+    def add(self, bus):
+        index = self.terrain.index(bus.pos)
+        bus.loop = int(self.loop_of[index])
+        bus.offset = int(self.offset_of[index])
+        if bus.loop < 0:
+            raise ValueError("Bus %s at %s is not on a metrobus loop" % (bus.unique_id, bus.pos))
+        self.fleets[bus.loop].append(bus)
+        self.version += 1
+
+    def link(self):
+        # Once every bus is added
+        for fleet in self.fleets:
+            fleet.sort(key=lambda bus: bus.offset)
+            for i, bus in enumerate(fleet):
+                bus.ahead = fleet[(i + 1) % len(fleet)]
+                bus.behind = fleet[i - 1]
+
+    def next_cell(self, bus):
+        loop = self.loops[bus.loop]
+        return self.terrain.cell(int(loop[(bus.offset + 1) % len(loop)]))
+
+    def advance(self, bus):
+        bus.offset = (bus.offset + 1) % len(self.loops[bus.loop])
+
+    def at_stop(self, bus):
+        return bool(self.terrain.kind.ravel()[self.loops[bus.loop][bus.offset]] & BUSSTOP)
+
+    def gap(self, bus, other):
+        # Cells from `bus` forward to `other`, a whole loop to itself
+        length = len(self.loops[bus.loop])
+        return (other.offset - bus.offset) % length or length
+
+    def bunched(self, bus):
+        # Closer to the bus ahead than the one behind is to it
+        return self.gap(bus, bus.ahead) < self.gap(bus.behind, bus)
@@ -0,0 +1,149 @@
+from collections import deque
+import numpy as np
+from Terrain import BUSSTOP, WALKABLE
+from BusLine import DWELL
+from Pedestrians import PACE
+
+# Pedestrians a bus carries at once
+CAPACITY = 40
+
+
+class BusStops:
+    # Passengers of the metrobus. A stop is a BUSSTOP cell of a bus loop and
+    # its platform the sidewalk next to it, where pedestrians wait in the
+    # queue of the stop, first come first served. A bus keeps its riders by
+    # the stop they get off at, so at a stop it only touches the ones that
+    # get off and the ones that get on. Waiting and riding pedestrians are
+    # out of the schedule and the grid: they cost nothing until their bus
+    # comes.
+    def __init__(self, model):
+        self.model = model
+        terrain = model.terrain
+        line = model.bus_line
+        # Stop of every Terrain.index cell of the loops, -1 = none
+        self.stop_of = np.full(terrain.width * terrain.height, -1, dtype=np.int32)
+        self.cells = []
+        self.platforms = []
+        for cell in model.city.stops:
+            index = terrain.index(cell)
+            platform = self.platform(cell)
+            if line.loop_of[index] < 0 or platform is None:
+                continue
+            self.stop_of[index] = len(self.cells)
+            self.cells.append(index)
+            self.platforms.append(platform)
+        self.queues = [deque() for cell in self.cells]
+        # Stops of every loop in driving order
+        self.on_loop = [sorted((stop for stop, cell in enumerate(self.cells) if line.loop_of[cell] == loop),
+                               key=lambda stop: line.offset_of[self.cells[stop]])
+                        for loop in range(len(line.loops))]
+        # (board, alight) or None of every trip, see leg(), for the sidewalks
+        # and buses there were when they were found
+        self.legs = {}
+        self.version = None
+        self.boarded = 0
+        self.alighted = 0
+        self.waiting = 0
+        # Last step the counters changed, for the Recorder
+        self.changed = -1
+
+    def platform(self, cell):
+        # Walkable cell next to a stop, a BUSSTOP one if there is any
+        terrain = self.model.terrain
+        x, y = cell
+        steps = [step for step in ((x, y+1), (x, y-1), (x+1, y), (x-1, y))
+                 if terrain.contains(step) and terrain.has(step, WALKABLE)]
+        stops = [step for step in steps if terrain.has(step, BUSSTOP)]
+        return (stops or steps or [None])[0]
+
+    def distance(self, origin, cell):
+        # Walking cells from origin to cell, None if it can't be reached
+        route = self.model.walk_router.get_route(origin, cell)
+        return len(route) - 1 if route[0] == self.model.terrain.index(origin) else None
+
+    def leg(self, origin, destiny):
+        # (board, alight) stops of the fastest trip with a bus in it, None
+        # when walking all the way is faster. Walks are PACE steps per cell,
+        # both ways the same; the bus ride is waiting half the time between
+        # buses, one step per cell and DWELL at every stop on the way.
+        line = self.model.bus_line
+        version = (self.model.walk_router.version, line.version)
+        if self.version != version:
+            self.legs = {}
+            self.version = version
+        key = (origin, destiny)
+        if key in self.legs:
+            return self.legs[key]
+        direct = self.distance(origin, destiny)
+        best = float("inf") if direct is None else direct * PACE
+        found = None
+        for loop, stops in enumerate(self.on_loop):
+            buses = len(line.fleets[loop])
+            if not buses or len(stops) < 2:
+                continue
+            length = len(line.loops[loop])
+            wait = (length + DWELL * len(stops)) / (2 * buses)
+            to = [self.distance(origin, self.platforms[stop]) for stop in stops]
+            away = [self.distance(destiny, self.platforms[stop]) for stop in stops]
+            for i, board in enumerate(stops):
+                # A walk of no cells has a one cell route, a pedestrian can't
+                # start or end on the platform
+                if not to[i]:
+                    continue
+                for j, alight in enumerate(stops):
+                    if i == j or not away[j]:
+                        continue
+                    cells = (line.offset_of[self.cells[alight]] - line.offset_of[self.cells[board]]) % length
+                    cost = (to[i] + away[j]) * PACE + wait + cells + DWELL * ((j - i) % len(stops))
+                    if cost < best:
+                        best = cost
+                        found = (board, alight)
+        self.legs[key] = found
+        return found
+
+    def join(self, pedestrian):
+        # A pedestrian at the platform of its first stop
+        self.model.retire(pedestrian)
+        self.queues[pedestrian.leg[0]].append(pedestrian)
+        self.waiting += 1
+        self.changed = self.model.step_count
+
+    def exchange(self, bus):
+        # Riders for the stop of the bus get off, then the queue gets on
+        stop = int(self.stop_of[self.model.bus_line.loops[bus.loop][bus.offset]])
+        if stop < 0:
+            return
+        model = self.model
+        riders = bus.riders.pop(stop, ())
+        platform = self.platforms[stop]
+        for pedestrian in riders:
+            # The rest of the trip is a walk from the platform
+            pedestrian.show = True
+            pedestrian.position = platform
+            pedestrian.leg = None
+            model.place(pedestrian, platform)
+            pedestrian.get_path()
+        bus.passengers -= len(riders)
+        queue = self.queues[stop]
+        boarded = 0
+        while queue and bus.passengers < bus.capacity:
+            pedestrian = queue.popleft()
+            # Gone from the frames until it gets off
+            pedestrian.show = False
+            model.despawned.append(pedestrian)
+            bus.riders.setdefault(pedestrian.leg[1], []).append(pedestrian)
+            bus.passengers += 1
+            boarded += 1
+        if riders or boarded:
+            self.alighted += len(riders)
+            self.boarded += boarded
+            self.waiting -= boarded
+            self.changed = model.step_count
+            model.mark_dirty(bus)
+            if model.metrics:
+                model.metrics.count("alightings", len(riders))
+                model.metrics.count("boardings", boarded)
+
+    def ridership(self):
+        return {"boarded": self.boarded, "alighted": self.alighted, "waiting": self.waiting,
+                "riding": self.boarded - self.alighted}
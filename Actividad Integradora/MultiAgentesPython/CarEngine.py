@@ -0,0 +1,259 @@
+from mesa import Agent
+import numpy as np
+from Terrain import STREET, PARKING
+
+
+class CarEngine(Agent):
+    # Moves every car of the model at once. Positions, route cursors and wait
+    # counters live in arrays, the Car agents are only updated when they move
+    # or turn so the snapshots keep working. It is scheduled where the cars
+    # would be (after the buses, before the pedestrians) and gives the same
+    # result as stepping the cars one by one in id order.
+    def __init__(self, model):
+        super().__init__("cars", model)
+        self.agents = []
+        self.routes = {}
+        self.built = 0
+        height = model.terrain.kind.shape[1]
+        self.height = height
+        self.cells = np.zeros(0, dtype=np.int32)
+        # Cells of self.cells after the last repack and of the shared routes
+        # added since, the rest are detours
+        self.packed = 0
+        # unique_id of every car, for the binary frames
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.cursor = np.zeros(0, dtype=np.int32)
+        self.end = np.zeros(0, dtype=np.int32)
+        self.position = np.zeros(0, dtype=np.int32)
+        self.origin = np.zeros(0, dtype=np.int32)
+        self.direction = np.zeros(0, dtype=np.int8)
+        self.show = np.zeros(0, dtype=bool)
+        self.wait = np.zeros(0, dtype=np.int32)
+        # Flat views of the Occupancy layers, MapModel.add_agent already
+        # counts every car added
+        self.cars = model.occupancy.cars.ravel()
+
+    def flat(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def add(self, car):
+        # Cars must be added in id order, the array index is the priority
+        self.agents.append(car)
+
+    def route(self, car):
+        # Offset and length of the route in self.cells, shared by every car
+        # with the same origin and destination
+        key = (car.position, car.destiny)
+        if key not in self.routes:
+            route = np.frombuffer(self.model.router.get_route(car.position, car.destiny), dtype=np.intc)
+            self.routes[key] = (len(self.cells), len(route))
+            self.cells = np.concatenate((self.cells, route.astype(np.int32)))
+            self.packed += len(route)
+        return self.routes[key]
+
+    def compact(self):
+        # Drops the cars that arrived, the rest keep their order. With a
+        # Demand the arrived ones come back as new cars at the end.
+        keep = np.flatnonzero(self.show)
+        self.agents = [self.agents[i] for i in keep] + self.agents[self.built:]
+        for name in ("ids", "cursor", "end", "origin", "position", "direction", "show", "wait"):
+            setattr(self, name, getattr(self, name)[keep])
+        self.built = len(keep)
+
+    def build(self):
+        if len(self.show) - np.count_nonzero(self.show) > max(64, len(self.show) // 2):
+            self.compact()
+        new = self.agents[self.built:]
+        cursor = []
+        end = []
+        for car in new:
+            start, length = self.route(car)
+            # Same as Vehicle.move dropping the first cell when it is the origin
+            if self.cells[start] == self.flat(car.position):
+                cursor.append(start + 1)
+            else:
+                cursor.append(start)
+            end.append(start + length)
+        self.ids = np.concatenate((self.ids, np.array([car.unique_id for car in new], dtype=np.int32)))
+        self.cursor = np.concatenate((self.cursor, np.array(cursor, dtype=np.int32)))
+        self.end = np.concatenate((self.end, np.array(end, dtype=np.int32)))
+        origin = np.array([self.flat(car.position) for car in new], dtype=np.int32)
+        self.origin = np.concatenate((self.origin, origin))
+        self.position = np.concatenate((self.position, np.array([self.flat(car.pos) for car in new], dtype=np.int32)))
+        direction = [-1 if car.direccion is None else car.direccion for car in new]
+        self.direction = np.concatenate((self.direction, np.array(direction, dtype=np.int8)))
+        self.show = np.concatenate((self.show, np.array([car.show for car in new], dtype=bool)))
+        self.wait = np.concatenate((self.wait, np.zeros(len(new), dtype=np.int32)))
+        self.built = len(self.agents)
+
+    def checkpoint(self):
+        # Arrived cars already given back to the pool are None, only their
+        # arrived slot is left
+        state = {name: getattr(self, name) for name in ("cells", "cursor", "end", "position", "origin",
+                                                      "direction", "show", "wait")}
+        state["ids"] = [car.unique_id if self.model.registry(car).get(car.unique_id) is car else None
+                        for car in self.agents]
+        state["built"] = self.built
+        state["routes"] = np.array([origin + destiny + offset for (origin, destiny), offset in self.routes.items()],
+                                   dtype=np.int64).reshape(-1, 6)
+        return state
+
+    def restore(self, state, cars):
+        for name in ("cells", "cursor", "end", "position", "origin", "direction", "show", "wait"):
+            setattr(self, name, np.array(state[name]))
+        self.agents = [None if unique_id is None else cars[unique_id] for unique_id in state["ids"]]
+        self.ids = np.array([-1 if unique_id is None else unique_id for unique_id in state["ids"]], dtype=np.int32)
+        self.built = state["built"]
+        self.routes = {((ox, oy), (dx, dy)): (offset, length)
+                       for ox, oy, dx, dy, offset, length in state["routes"].tolist()}
+        self.packed = len(self.cells)
+        self.cars[:] = 0
+        np.add.at(self.cars, self.position[self.show], 1)
+
+    def remaining(self, i):
+        # Where car i is and the rest of its route, from the next cell
+        return int(self.position[i]), self.cells[self.cursor[i]:self.end[i]].tolist()
+
+    def set_route(self, i, route):
+        # A route of its own for car i, starting where it is, like a detour
+        # of the Rerouter. It goes at the end of the shared cells, which are
+        # packed again once most of them are old detours.
+        if len(self.cells) > 2 * self.packed + 4096:
+            self.repack()
+        start = len(self.cells)
+        self.cells = np.concatenate((self.cells, np.asarray(route, dtype=np.int32)))
+        self.cursor[i] = start + 1
+        self.end[i] = start + len(route)
+        self.wait[i] = 0
+
+    def repack(self):
+        # Keeps the shared routes and what is left of the routes of the cars
+        # on the road, every route is found by where it ends
+        segments = {start + length: start for start, length in self.routes.values()}
+        for i in np.flatnonzero(self.show).tolist():
+            end = int(self.end[i])
+            segments[end] = min(segments.get(end, end), int(self.cursor[i]))
+        moved = {}
+        parts = []
+        size = 0
+        for end, start in segments.items():
+            moved[end] = size - start
+            parts.append(self.cells[start:end])
+            size += end - start
+        self.cells = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+        self.routes = {key: (start + moved[start + length], length) for key, (start, length) in self.routes.items()}
+        shown = np.flatnonzero(self.show)
+        shift = np.array([moved[end] for end in self.end[shown].tolist()], dtype=np.int32)
+        self.cursor[shown] += shift
+        self.end[shown] += shift
+        self.packed = len(self.cells)
+
+    def teleport(self, i):
+        # Car i arrives at its destination from wherever it is
+        car = self.agents[i]
+        self.cars[self.position[i]] -= 1
+        self.position[i] = self.flat(car.destiny)
+        self.cursor[i] = self.end[i]
+        self.show[i] = False
+        car.pos = car.destiny
+        self.model.mark_dirty(car)
+        self.model.despawn(car)
+
+    def get_direction(self, origin, target):
+        # Vectorized Vehicle.get_direction
+        dx = target // self.height - origin // self.height
+        dy = target % self.height - origin % self.height
+        return np.where(dx > 0, 2, np.where(dx < 0, 3, np.where(dy > 0, 0, 1))).astype(np.int8)
+
+    def step(self):
+        if self.built != len(self.agents):
+            self.build()
+        model = self.model
+        number = len(self.agents)
+        arrived = np.flatnonzero(self.show & (self.cursor == self.end))
+        going = np.flatnonzero(self.show & (self.cursor != self.end))
+
+        target = self.cells[self.cursor[going]]
+        kind = model.terrain.kind.ravel()[target]
+        light = model.terrain.light.ravel()[target]
+
+        street = (kind & STREET) != 0
+        direction = self.get_direction(self.origin[going], target)
+        turned = street & (direction != self.direction[going])
+        self.direction[going[turned]] = direction[turned]
+
+        colors = model.signals.colors
+        lit = light >= 0
+        green = lit & (colors[light] == 0)
+        parking = (kind & PARKING) != 0
+        occupancy = model.occupancy
+        claimed = occupancy.claimed.ravel()
+        step = model.step_count
+        # Pedestrians step after the cars and the buses before them, both are
+        # where the cars see them. A bus that moved this step claimed its cell.
+        free = ((~lit | green) & (occupancy.buses.ravel()[target] == 0)
+                & (occupancy.pedestrians.ravel()[target] == 0) & (claimed[target] != step))
+
+        # A car sees the cars with a higher id where they started the step and
+        # the ones with a lower id where they ended it. Cars stack in parking,
+        # so a free parking is always entered. Into a street a car can't go
+        # when a car behind it in id order is there, otherwise it depends on
+        # the cars before it.
+        order = np.arange(number)
+        cells = len(self.cars)
+        last = np.full(cells, -1)
+        np.maximum.at(last, self.position[self.show], order[self.show])
+        later = last[target] > going
+        moved = free & parking
+        unsure = np.flatnonzero(free & ~parking & ~later)
+        # Only the lowest id can get in: it either moves or something with an
+        # even lower id ended there, both block the rest
+        lowest = np.full(cells, number)
+        np.minimum.at(lowest, target[unsure], going[unsure])
+        unsure = unsure[lowest[target[unsure]] == going[unsure]]
+
+        # The rest move if no lower id car ends in their target. Car i only
+        # depends on cars < i, so iterating until nothing changes gives the
+        # same result as moving them one at a time.
+        final = self.position.copy()
+        final[going[moved]] = target[moved]
+        ids = going[unsure]
+        fixed_ids = self.show.copy()
+        fixed_ids[ids] = False
+        fixed = np.full(cells, number)
+        np.minimum.at(fixed, final[fixed_ids], order[fixed_ids])
+        into = target[unsure]
+        stay = self.position[ids]
+        decision = ~(fixed[into] < ids)
+        while True:
+            first = fixed.copy()
+            np.minimum.at(first, np.where(decision, into, stay), ids)
+            again = ~(first[into] < ids)
+            if np.array_equal(again, decision):
+                break
+            decision = again
+        moved[unsure] = decision
+
+        movers = going[moved]
+        np.subtract.at(self.cars, self.position[movers], 1)
+        np.add.at(self.cars, target[moved], 1)
+        claimed[target[moved & ~parking]] = step
+        self.position[movers] = target[moved]
+        self.cursor[movers] += 1
+        self.wait[going] += 1
+        self.wait[movers] = 0
+        model.moves["cars"] += len(movers)
+        if model.metrics:
+            model.metrics.count("blocked_moves", len(going) - len(movers))
+
+        # Only the cars that changed go back to their agents
+        for i in going[turned]:
+            self.agents[i].direccion = int(self.direction[i])
+        for i in np.union1d(movers, going[turned]):
+            car = self.agents[i]
+            car.pos = divmod(int(self.position[i]), self.height)
+            model.mark_dirty(car)
+        np.subtract.at(self.cars, self.position[arrived], 1)
+        for i in arrived:
+            self.show[i] = False
+            model.despawn(self.agents[i])
@@ -0,0 +1,294 @@
+import io
+import json
+import os
+import re
+from array import array
+import numpy as np
+from ModeloV1 import MapModel, LAYERS
+from Car import Car
+from Bus import Bus
+from Pedestrians import Pedestrians
+from CityMap import CityMap, CityMapError, CITY
+from Demand import Demand, TripStream
+
+# Bump when the layout changes, older checkpoints are then refused
+FORMAT = 5
+MAGIC = "trans-project checkpoint"
+# Maps a checkpoint can name without `city`: a file right in maps/, as the
+# checkpoint may come from a client
+MAP_NAME = re.compile(r"[A-Za-z0-9_-]+\.json")
+
+# Columns saved for every agent type, -1 stands for None
+COLUMNS = {
+    "cars": ("id", "x", "y", "position_x", "position_y", "destiny_x", "destiny_y", "direccion", "cursor",
+             "wait", "slept", "show", "start_step"),
+    "metrobuses": ("id", "x", "y", "direccion", "wait", "wait4passengers", "held", "show", "start_step"),
+    "pedestrians": ("id", "x", "y", "position_x", "position_y", "destiny_x", "destiny_y", "cursor",
+                    "pasito_a_pasito", "board", "alight", "show", "start_step"),
+}
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+# A checkpoint is an .npz file: the arrays of the agents, the scheduler, the
+# signals, Gridlock and the car engine, plus a "meta" entry with everything
+# else as JSON. It has no pickles, so it can be loaded on another machine as
+# long as it has the same map file. Take it between steps.
+
+def save(model):
+    arrays = {}
+    meta = {"magic": MAGIC, "format": FORMAT, "step_count": model.step_count,
+            "current_id": model.current_id, "running": model.running,
+            "engine": "vector" if model.car_engine else "agents",
+            "number_cars": model.number_cars, "number_buses": model.number_buses,
+            "number_pedestrians": model.number_p,
+            "replans": model.rerouter.budget if model.rerouter else 0,
+            "reroute_last": model.rerouter.last if model.rerouter else -1,
+            "gridlock": model.gridlock.policy,
+            "ridership": model.bus_stops.ridership(),
+            "moves": model.moves, "arrivals": model.arrivals, "trip_steps": model.trip_steps,
+            "pool": {"created": model.pool.created, "reused": model.pool.reused}}
+
+    city = model.city
+    maps = os.path.dirname(CITY)
+    path = os.path.relpath(city.path, maps) if os.path.dirname(city.path) == maps else city.path
+    meta["city"] = {"name": city.name, "path": path, "key": city.key}
+    # Terrain arrays a model changed are saved, the rest come from the map
+    meta["terrain"] = [name for name in ("kind", "direction", "bus_direction", "light")
+                       if getattr(model.terrain, name).flags.writeable]
+    for name in meta["terrain"]:
+        arrays["terrain/" + name] = getattr(model.terrain, name)
+
+    version, internal, gauss = model.random.getstate()
+    meta["random"] = {"version": version, "gauss": gauss,
+                      "seed": model._seed if isinstance(model._seed, (int, str, type(None))) else None}
+    arrays["random"] = np.array(internal, dtype=np.uint32)
+
+    for key, registry in (("cars", model.cars), ("metrobuses", model.buses), ("pedestrians", model.pedestrians)):
+        rows = [agent_row(key, agent) for agent in registry.values()]
+        arrays["agents/" + key] = np.array(rows, dtype=np.int64).reshape(-1, len(COLUMNS[key]))
+    # Cars that took a detour follow a route of their own. The engine keeps
+    # those with its cells.
+    detours = [] if model.car_engine else [car for car in model.cars.values()
+                                           if car.route is not model.router.get_route(car.position, car.destiny)]
+    arrays["detours/ids"] = np.array([(car.unique_id, len(car.route)) for car in detours],
+                                     dtype=np.int64).reshape(-1, 2)
+    arrays["detours/cells"] = np.array([cell for car in detours for cell in car.route], dtype=np.int32)
+    # Pedestrians waiting at every stop and riding every bus, in order
+    stops = model.bus_stops
+    arrays["stops/queues"] = np.array([(stop, pedestrian.unique_id) for stop, queue in enumerate(stops.queues)
+                                       for pedestrian in queue], dtype=np.int64).reshape(-1, 2)
+    arrays["stops/riders"] = np.array([(bus.unique_id, pedestrian.unique_id) for bus in model.buses.values()
+                                       for riders in bus.riders.values() for pedestrian in riders],
+                                      dtype=np.int64).reshape(-1, 2)
+
+    meta["schedule"] = split(model.schedule.checkpoint(), "schedule/", arrays)
+    meta["signals"] = split(model.signals.checkpoint(), "signals/", arrays)
+    meta["gridlocks"] = split(model.gridlock.checkpoint(), "gridlock/", arrays)
+    if model.car_engine:
+        meta["car_engine"] = split(model.car_engine.checkpoint(), "car_engine/", arrays)
+
+    if model.demand:
+        meta["demand"] = demand_config(model.demand)
+        meta["trips"] = model.trips.checkpoint() if model.trips else None
+        meta["next_trip"] = model.next_trip
+
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def load(data, city=None, metrics=False):
+    # A new MapModel in the state of the checkpoint `data`. The map is found
+    # by its path in the checkpoint unless `city` is given, and must be the
+    # same file it was taken with. Metrics are not saved, `metrics` turns
+    # them on in the new model.
+    try:
+        archive = np.load(io.BytesIO(data), allow_pickle=False)
+        arrays = {name: archive[name] for name in archive.files}
+        meta = json.loads(arrays.pop("meta").tobytes())
+    except (ValueError, OSError, KeyError) as e:
+        raise CheckpointError("Not a checkpoint: %s" % e)
+    if meta.get("magic") != MAGIC:
+        raise CheckpointError("Not a checkpoint")
+    if meta.get("format") != FORMAT:
+        raise CheckpointError("Checkpoint format %r, this version reads %d" % (meta.get("format"), FORMAT))
+    try:
+        return build(meta, arrays, city, metrics)
+    except KeyError as e:
+        raise CheckpointError("Checkpoint without %s" % e)
+    except CityMapError as e:
+        raise CheckpointError(str(e))
+
+
+def build(meta, arrays, city, metrics):
+    # The model of a checkpoint that passed the checks of load()
+    if city is None:
+        city = map_path(meta["city"]["path"])
+    if not os.path.exists(city):
+        raise CheckpointError("Map %s of the checkpoint not found" % meta["city"]["path"])
+    template = CityMap.template(city)
+    if template.key != meta["city"]["key"]:
+        raise CheckpointError("Map %s changed since the checkpoint was taken" % meta["city"]["path"])
+
+    demand = load_demand(meta["demand"]) if "demand" in meta else None
+    model = MapModel(template.width, template.height, meta["number_cars"], meta["number_buses"],
+                     meta["number_pedestrians"], seed=meta["random"]["seed"], engine=meta["engine"],
+                     demand=demand, city=city, populate=False, metrics=metrics, replans=meta["replans"],
+                     gridlock=meta["gridlock"])
+    for name in meta["terrain"]:
+        setattr(model.terrain, name, arrays["terrain/" + name])
+    if meta["terrain"]:
+        model.router.invalidate()
+        model.walk_router.invalidate()
+
+    model.random.setstate((meta["random"]["version"], tuple(arrays["random"].tolist()), meta["random"]["gauss"]))
+    model.step_count = meta["step_count"]
+    model.current_id = meta["current_id"]
+    model.running = meta["running"]
+    model.moves = meta["moves"]
+    model.arrivals = meta["arrivals"]
+    model.trip_steps = meta["trip_steps"]
+    model.pool.created = meta["pool"]["created"]
+    model.pool.reused = meta["pool"]["reused"]
+
+    scheduled = set(meta["schedule"]["ids"])
+    agents = {}
+    for key, cls, registry in (("metrobuses", Bus, model.buses), ("cars", Car, model.cars),
+                               ("pedestrians", Pedestrians, model.pedestrians)):
+        for row in arrays["agents/" + key].tolist():
+            agent = agent_from_row(model, key, cls, dict(zip(COLUMNS[key], row)))
+            registry[agent.unique_id] = agent
+            agents[agent.unique_id] = agent
+            if agent.unique_id in scheduled:
+                model.occupancy.add(LAYERS[cls], agent.pos)
+                model.grid.place_agent(agent, agent.pos)
+    for bus in model.buses.values():
+        model.bus_line.add(bus)
+    model.bus_line.link()
+    stops = model.bus_stops
+    for stop, unique_id in arrays["stops/queues"].tolist():
+        stops.queues[stop].append(model.pedestrians[unique_id])
+    for unique_id, rider in arrays["stops/riders"].tolist():
+        bus, pedestrian = model.buses[unique_id], model.pedestrians[rider]
+        bus.riders.setdefault(pedestrian.leg[1], []).append(pedestrian)
+        bus.passengers += 1
+    stops.boarded = meta["ridership"]["boarded"]
+    stops.alighted = meta["ridership"]["alighted"]
+    stops.waiting = meta["ridership"]["waiting"]
+    offset = 0
+    for unique_id, length in arrays["detours/ids"].tolist():
+        model.cars[unique_id].route = array("i", arrays["detours/cells"][offset:offset + length].tolist())
+        offset += length
+    if model.rerouter:
+        model.rerouter.last = meta["reroute_last"]
+    if model.car_engine:
+        agents[model.car_engine.unique_id] = model.car_engine
+        model.car_engine.restore(join(meta["car_engine"], "car_engine/", arrays), model.cars)
+    model.schedule.restore(join(meta["schedule"], "schedule/", arrays), agents)
+    model.signals.restore(join(meta["signals"], "signals/", arrays))
+    model.gridlock.restore(join(meta["gridlocks"], "gridlock/", arrays))
+
+    if demand:
+        if meta["trips"] is not None:
+            model.trips = TripStream.restore(demand, model, meta["trips"])
+        trip = meta["next_trip"]
+        model.next_trip = trip and (trip[0], trip[1], tuple(trip[2]), tuple(trip[3]))
+
+    # The first snapshot and delta after a restore have everything
+    for agent in list(agents.values()) + model.traffic_lights:
+        if agent is not model.car_engine:
+            model.mark_dirty(agent)
+    return model
+
+
+def map_path(name):
+    if not isinstance(name, str) or not MAP_NAME.fullmatch(name):
+        raise CheckpointError("Map %r of the checkpoint is not the name of a map in maps/" % (name,))
+    return os.path.join(os.path.dirname(CITY), name)
+
+
+def agent_row(key, agent):
+    def none(value):
+        return -1 if value is None else value
+
+    if key == "metrobuses":
+        return (agent.unique_id, agent.pos[0], agent.pos[1], none(agent.direccion), agent.wait,
+                agent.wait4passengers, agent.held, agent.show, agent.start_step)
+    row = (agent.unique_id, agent.pos[0], agent.pos[1], agent.position[0], agent.position[1],
+           agent.destiny[0], agent.destiny[1])
+    if key == "cars":
+        return row + (none(agent.direccion), agent.cursor, agent.wait, none(agent.slept), agent.show,
+                      agent.start_step)
+    leg = agent.leg or (-1, -1)
+    return row + (agent.cursor, agent.pasito_a_pasito, leg[0], leg[1], agent.show, agent.start_step)
+
+
+def agent_from_row(model, key, cls, row):
+    def none(value):
+        return None if value == -1 else value
+
+    pos = (row["x"], row["y"])
+    if key == "metrobuses":
+        agent = cls(row["id"], model, pos)
+        agent.direccion = none(row["direccion"])
+        agent.wait = row["wait"]
+        agent.wait4passengers = row["wait4passengers"]
+        agent.held = row["held"]
+    else:
+        agent = cls(row["id"], model, (row["position_x"], row["position_y"]), (row["destiny_x"], row["destiny_y"]))
+        if key == "pedestrians":
+            agent.leg = None if row["board"] == -1 else (row["board"], row["alight"])
+        agent.get_path()
+        agent.cursor = row["cursor"]
+        if key == "cars":
+            agent.direccion = none(row["direccion"])
+            agent.wait = row["wait"]
+            agent.slept = none(row["slept"])
+            if agent.wait:
+                model.blocked_cars.add(agent)
+        else:
+            agent.pasito_a_pasito = row["pasito_a_pasito"]
+    agent.pos = pos
+    agent.show = bool(row["show"])
+    agent.start_step = row["start_step"]
+    return agent
+
+
+def split(state, prefix, arrays):
+    # Arrays of a state go to the archive, the rest stays in meta
+    meta = {}
+    for name, value in state.items():
+        if isinstance(value, np.ndarray):
+            arrays[prefix + name] = value
+        else:
+            meta[name] = value
+    return meta
+
+
+def join(meta, prefix, arrays):
+    state = dict(meta)
+    for name, value in arrays.items():
+        if name.startswith(prefix):
+            state[name[len(prefix):]] = value
+    return state
+
+
+def demand_config(demand):
+    def table(kind):
+        return [list(origin) + list(destiny) + [weight] for (origin, destiny), weight in demand.tables[kind].items()]
+
+    return {"car_rate": demand.rates["cars"], "pedestrian_rate": demand.rates["pedestrians"],
+            "profile": demand.profile, "day": demand.day,
+            "car_table": table("cars"), "pedestrian_table": table("pedestrians")}
+
+
+def load_demand(config):
+    def table(rows):
+        return {((ox, oy), (dx, dy)): weight for ox, oy, dx, dy, weight in rows}
+
+    return Demand(config["car_rate"], config["pedestrian_rate"], config["profile"], config["day"],
+                  table(config["car_table"]), table(config["pedestrian_table"]))
@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+import numpy as np
+from Terrain import Terrain, BUILDING, PARKING, SIDEWALK, STREET, CROSSWALK, STREETBUS, BUSSTOP
+from Router import Router
+from WalkRouter import WalkRouter
+from BusLine import trace_loops
+
+# The stock city, the one the Unity scene is built for
+CITY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps", "city.json")
+# Bump when the layout of the cache changes, old entries are then ignored
+CACHE_FORMAT = 2
+# Maps loaded by this process, by path, shared by all its models
+TEMPLATES = {}
+
+TILES = {"building": BUILDING, "parking": PARKING, "sidewalk": SIDEWALK, "street": STREET,
+         "crosswalk": CROSSWALK, "streetbus": STREETBUS, "busstop": BUSSTOP}
+# 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda | 4 = any
+ARROWS = {".": -1, "^": 0, "v": 1, ">": 2, "<": 3, "*": 4}
+ARRAYS = ("kind", "direction", "bus_direction", "light", "next_hop", "walk_parents", "segment", "crossing",
+          "bus_ring")
+
+
+class CityMapError(ValueError):
+    pass
+
+
+class CityMap:
+    # A city read from a JSON map file. The file has tile layers, one string
+    # per row with the northmost row (y = height - 1) first:
+    #   kind           legend characters, each one a list of TILES
+    #   direction      street direction, one of ARROWS
+    #   bus_direction  metrobus lane direction, one of ARROWS
+    # plus the signal plans and groups, bus stops, parking lots, pedestrian
+    # entrances and bus starts as [x, y] cells. The metrobus lanes from the
+    # bus starts are compiled into loops, see BusLine. The compiled arrays and the
+    # routing tables are cached next to the file, keyed by its hash, and
+    # loaded memory-mapped read-only, so every model (and every worker
+    # process) reading the same map shares the same pages.
+    def __init__(self, meta, arrays, path=None, key=None):
+        self.path = path
+        # Hash of the file, the same map has the same key on every machine
+        self.key = key
+        self.name = meta["name"]
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.cycle = meta["cycle"]
+        self.signals = meta["signals"]
+        self.stops = tuple(tuple(cell) for cell in meta["stops"])
+        self.parking_lots = tuple(tuple(cell) for cell in meta["parking_lots"])
+        self.entrances = tuple(tuple(cell) for cell in meta["entrances"])
+        self.bus_starts = tuple(tuple(cell) for cell in meta["bus_starts"])
+        # Lengths of the metrobus loops, one after the other in bus_ring
+        self.bus_loops = meta["bus_loops"]
+        self.crossings = meta["crossings"]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        # Routes found by any model on the unchanged map, shared like the
+        # tables they come from
+        self.routes = {}
+        self.walk_trees = dict(zip(self.entrances, self.walk_parents))
+        self.walk_routes = {}
+
+    @classmethod
+    def template(cls, path=CITY):
+        # The map of `path` loaded once per process; loaded again only if the
+        # file changes
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        template = TEMPLATES.get(path)
+        if template is None or template[0] != version:
+            template = version, cls.load(path)
+            TEMPLATES[path] = template
+        return template[1]
+
+    @classmethod
+    def load(cls, path=CITY, cache_dir=None):
+        with open(path, "rb") as file:
+            data = file.read()
+        key = hashlib.sha1(b"%d:" % CACHE_FORMAT + data).hexdigest()
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+        folder = os.path.join(cache_dir, key)
+        if not os.path.isdir(folder):
+            try:
+                document = json.loads(data)
+            except ValueError as e:
+                raise CityMapError("%s: %s" % (path, e))
+            meta, arrays = compile_city(document, path)
+            save(folder, meta, arrays)
+        with open(os.path.join(folder, "meta.json")) as file:
+            meta = json.load(file)
+        # Plain ndarray views of the maps: indexing a np.memmap goes through
+        # Python code, too slow for the cell lookups of every step
+        arrays = {name: np.asarray(np.load(os.path.join(folder, name + ".npy"), mmap_mode="r")) for name in ARRAYS}
+        return cls(meta, arrays, os.path.abspath(path), key)
+
+
+def save(folder, meta, arrays):
+    # Written to a temporary folder and renamed, so a half written cache is
+    # never read and two processes compiling the same map don't collide
+    os.makedirs(os.path.dirname(folder), exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=os.path.dirname(folder))
+    with open(os.path.join(temporary, "meta.json"), "w") as file:
+        json.dump(meta, file)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, name + ".npy"), array)
+    try:
+        os.rename(temporary, folder)
+    except OSError:
+        shutil.rmtree(temporary)
+        if not os.path.isdir(folder):
+            raise
+
+
+def compile_city(document, path="map"):
+    def fail(message):
+        raise CityMapError("%s: %s" % (path, message))
+
+    for field in ("width", "height", "legend", "layers", "cycle", "plans", "signals",
+                  "stops", "parking_lots", "entrances", "bus_starts"):
+        if field not in document:
+            fail("missing %r" % field)
+    width, height = document["width"], document["height"]
+    if not (isinstance(width, int) and isinstance(height, int) and width > 0 and height > 0):
+        fail("width and height must be positive integers")
+
+    legend = {}
+    for char, names in document["legend"].items():
+        if len(char) != 1 or char in ARROWS:
+            fail("legend key %r must be one character, not one of %s" % (char, "".join(ARROWS)))
+        for name in names:
+            if name not in TILES:
+                fail("unknown tile %r in legend %r" % (name, char))
+        legend[char] = sum(TILES[name] for name in set(names))
+
+    def layer(name, codes, dtype, default):
+        rows = document["layers"].get(name)
+        array = np.full((width, height), default, dtype=dtype)
+        if rows is None:
+            return array
+        if len(rows) != height:
+            fail("layer %r has %d rows, expected %d" % (name, len(rows), height))
+        for number, row in enumerate(rows):
+            y = height - 1 - number
+            if len(row) != width:
+                fail("layer %r row %d has %d cells, expected %d" % (name, number, len(row), width))
+            for x, char in enumerate(row):
+                if char not in codes:
+                    fail("layer %r row %d: unknown character %r" % (name, number, char))
+                array[x, y] = codes[char]
+        return array
+
+    if "kind" not in document["layers"]:
+        fail("missing layer 'kind'")
+    terrain = Terrain(width, height)
+    terrain.kind = layer("kind", legend, np.uint8, 0)
+    terrain.direction = layer("direction", ARROWS, np.int8, -1)
+    terrain.bus_direction = layer("bus_direction", ARROWS, np.int8, -1)
+
+    def cells(field, mask=None, what=None):
+        result = []
+        for cell in document[field]:
+            if len(cell) != 2 or not terrain.contains(tuple(cell)):
+                fail("%s: %r is not a cell of the map" % (field, cell))
+            if mask is not None and not terrain.has(tuple(cell), mask):
+                fail("%s: %r is not %s" % (field, cell, what))
+            result.append(list(cell))
+        return result
+
+    cycle = document["cycle"]
+    if not isinstance(cycle, int) or cycle <= 0:
+        fail("cycle must be a positive integer")
+    for name, plan in document["plans"].items():
+        if not plan:
+            fail("plan %r has no phases" % name)
+        for start, color in plan:
+            if not 0 <= start < cycle or color not in (0, 1, 2):
+                fail("plan %r: phase %r must start inside the cycle with color 0, 1 or 2" % (name, [start, color]))
+
+    signals = []
+    names = set()
+    for signal in document["signals"]:
+        if signal.get("name") in names:
+            fail("signal %r defined twice" % signal.get("name"))
+        names.add(signal.get("name"))
+        if signal.get("plan") not in document["plans"]:
+            fail("signal %r uses unknown plan %r" % (signal.get("name"), signal.get("plan")))
+        group = []
+        for cell in signal.get("cells", []):
+            if len(cell) != 2 or not terrain.contains(tuple(cell)):
+                fail("signal %r: %r is not a cell of the map" % (signal["name"], cell))
+            if terrain.light[tuple(cell)] >= 0:
+                fail("signal %r: cell %r already has a light" % (signal["name"], cell))
+            terrain.light[tuple(cell)] = sum(len(s["cells"]) for s in signals) + len(group)
+            group.append(list(cell))
+        signals.append({"name": signal["name"], "plan": document["plans"][signal["plan"]],
+                        "offset": signal.get("offset", 0), "cells": group})
+
+    stops = cells("stops")
+    for cell in stops:
+        terrain.add(tuple(cell), BUSSTOP)
+    parking_lots = cells("parking_lots", PARKING, "a parking")
+    entrances = cells("entrances")
+    bus_starts = cells("bus_starts", STREETBUS, "a metrobus lane")
+    loops = trace_loops(terrain, bus_starts)
+    if loops is None:
+        fail("the metrobus lane of a bus start doesn't loop back to it")
+
+    # Routing tables, the same ones the routers would build on first use
+    world = SimpleNamespace(terrain=terrain)
+    router = Router(world, [tuple(cell) for cell in parking_lots])
+    router.build()
+    walk_router = WalkRouter(world, [tuple(cell) for cell in entrances])
+    walk_router.build()
+    walk_parents = np.array([walk_router.tree(tuple(cell)) for cell in entrances],
+                            dtype=np.int32).reshape(len(entrances), width * height)
+
+    meta = {"name": document.get("name", os.path.splitext(os.path.basename(path))[0]),
+            "width": width, "height": height, "cycle": cycle, "signals": signals,
+            "stops": stops, "parking_lots": parking_lots, "entrances": entrances,
+            "bus_starts": bus_starts, "bus_loops": [len(loop) for loop in loops],
+            "crossings": [{"lights": sorted(c["lights"]), "segments": sorted(c["segments"])}
+                          for c in walk_router.crossings]}
+    arrays = {"kind": terrain.kind, "direction": terrain.direction,
+              "bus_direction": terrain.bus_direction, "light": terrain.light,
+              "next_hop": router.next_hop, "walk_parents": walk_parents,
+              "segment": walk_router.segment, "crossing": walk_router.crossing,
+              "bus_ring": np.array([cell for loop in loops for cell in loop], dtype=np.int32)}
+    return meta, arrays
+
+
+def tile_city(document, columns, rows):
+    # A map of columns x rows copies of `document`, for benchmarks. The copies
+    # are joined through the outer ring of streets: its two lanes on every
+    # side are carried across the metrobus loop and the sidewalk of both
+    # copies, with crosswalks where they cut the sidewalk. Made for maps laid
+    # out like the stock city, with the ring two cells in from the border.
+    width, height = document["width"], document["height"]
+    legend = dict(document["legend"])
+    # Street on top of a metrobus lane, where a joining lane crosses the loop
+    legend["j"] = ["street", "streetbus"]
+    big_width, big_height = width * columns, height * rows
+    # Every copy is the same, rows of copies are simply stacked
+    layers = {name: [list(row * columns) for j in range(rows) for row in layer]
+              for name, layer in document["layers"].items()}
+
+    def cut(x, y, arrow):
+        row = big_height - 1 - y
+        tiles = set(legend[layers["kind"][row][x]])
+        layers["kind"][row][x] = "j" if "streetbus" in tiles else "#" if "sidewalk" in tiles else layers["kind"][row][x]
+        layers["direction"][row][x] = arrow
+
+    for j in range(rows):
+        for i in range(columns):
+            left, bottom = i * width, j * height
+            if i + 1 < columns:
+                # Eastbound at the bottom of the ring, westbound at the top
+                for x in range(left + width - 2, left + width + 2):
+                    for y in (2, 3):
+                        cut(x, bottom + y, ">")
+                    for y in (height - 4, height - 3):
+                        cut(x, bottom + y, "<")
+            if j + 1 < rows:
+                # Southbound on the left of the ring, northbound on the right
+                for y in range(bottom + height - 2, bottom + height + 2):
+                    for x in (2, 3):
+                        cut(left + x, y, "v")
+                    for x in (width - 4, width - 3):
+                        cut(left + x, y, "^")
+
+    def moved(cells, i, j):
+        return [[x + i * width, y + j * height] for x, y in cells]
+
+    copies = [(i, j) for j in range(rows) for i in range(columns)]
+    tiled = dict(document)
+    tiled.update({
+        "name": "%s %dx%d" % (document.get("name", "map"), columns, rows),
+        "width": big_width, "height": big_height, "legend": legend,
+        "layers": {name: ["".join(row) for row in layer] for name, layer in layers.items()},
+        "signals": [dict(signal, name="%s@%d,%d" % (signal["name"], i, j), cells=moved(signal["cells"], i, j))
+                    for i, j in copies for signal in document["signals"]],
+    })
+    for field in ("stops", "parking_lots", "entrances", "bus_starts"):
+        tiled[field] = [cell for i, j in copies for cell in moved(document[field], i, j)]
+    return tiled
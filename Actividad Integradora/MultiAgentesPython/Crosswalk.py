@@ -1,6 +0,0 @@
-from mesa import Agent
-class Crosswalk(Agent):
-    # Class that models the building
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        self.direccion = 4
\ No newline at end of file
@@ -0,0 +1,95 @@
+import itertools
+
+# Steps of one simulated day and the share of the mean rate of every hour
+DAY = 2400
+PROFILE = (0.2, 0.1, 0.1, 0.1, 0.2, 0.5, 1.0, 1.6, 1.4, 0.9, 0.8, 0.9,
+           1.0, 0.9, 0.8, 0.9, 1.2, 1.6, 1.4, 0.9, 0.7, 0.5, 0.4, 0.3)
+KINDS = ("cars", "pedestrians")
+# Most trips per step of each kind a client can ask for: at the peak of
+# PROFILE the streets of the city are full long before that
+MAX_DEMAND = 10.0
+
+
+class Demand:
+    # Trips that appear while the model runs. Every kind of agent has a mean
+    # rate of trips per step that follows PROFILE over the day, and a table of
+    # weights by (origin, destiny); pairs not in the table weigh 1, so with no
+    # table every trip between two different places is equally likely.
+    def __init__(self, car_rate=0.0, pedestrian_rate=0.0, profile=PROFILE, day=DAY,
+                 car_table=None, pedestrian_table=None):
+        self.rates = {"cars": car_rate, "pedestrians": pedestrian_rate}
+        self.tables = {"cars": car_table or {}, "pedestrians": pedestrian_table or {}}
+        self.profile = tuple(profile)
+        self.day = day
+
+    def rate(self, kind, time):
+        hour = int(time % self.day * len(self.profile) // self.day)
+        return self.rates[kind] * self.profile[hour]
+
+    def pairs(self, kind, places):
+        pairs = [(origin, destiny) for origin in places for destiny in places if origin != destiny]
+        weights = [self.tables[kind].get(pair, 1.0) for pair in pairs]
+        return pairs, list(itertools.accumulate(weights))
+
+    def trips(self, model):
+        # Lazy stream of (step, kind, origin, destiny) for the model, in order
+        return TripStream(self, model)
+
+
+class TripStream:
+    # The trips of every kind merged in step order. Arrivals are Poisson
+    # with a rate that changes over the day, by thinning: candidates come at
+    # the highest rate and each one is kept with probability rate(t) /
+    # highest rate. The clock and the next trip of every kind are all the
+    # state there is, so a checkpoint can save and restore them.
+    def __init__(self, demand, model, clock=None, pending=None, refill=None):
+        self.demand = demand
+        self.random = model.random
+        places = {"cars": model.parking_lots, "pedestrians": model.directions}
+        self.pairs = {kind: demand.pairs(kind, places[kind]) for kind in KINDS}
+        self.clock = clock or {kind: model.step_count for kind in KINDS}
+        self.pending = pending
+        # Kind whose next trip is drawn on the next call, like heapq.merge
+        self.refill = refill
+
+    def arrival(self, kind):
+        demand = self.demand
+        highest = demand.rates[kind] * max(demand.profile)
+        if highest <= 0:
+            return None
+        pairs, cum_weights = self.pairs[kind]
+        while True:
+            self.clock[kind] += self.random.expovariate(highest)
+            time = self.clock[kind]
+            if self.random.random() * highest <= demand.rate(kind, time):
+                origin, destiny = self.random.choices(pairs, cum_weights=cum_weights)[0]
+                return int(time) + 1, kind, origin, destiny
+
+    def checkpoint(self):
+        return {"clock": self.clock, "pending": self.pending, "refill": self.refill}
+
+    @classmethod
+    def restore(cls, demand, model, state):
+        def trip(row):
+            return row and (row[0], row[1], tuple(row[2]), tuple(row[3]))
+
+        pending = state["pending"]
+        if pending is not None:
+            pending = {kind: trip(row) for kind, row in pending.items()}
+        return cls(demand, model, dict(state["clock"]), pending, state["refill"])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pending is None:
+            self.pending = {kind: self.arrival(kind) for kind in KINDS}
+        if self.refill:
+            self.pending[self.refill] = self.arrival(self.refill)
+            self.refill = None
+        trips = [trip for trip in self.pending.values() if trip]
+        if not trips:
+            raise StopIteration
+        trip = min(trips)
+        self.refill = trip[1]
+        return trip
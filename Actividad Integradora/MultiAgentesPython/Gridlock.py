@@ -0,0 +1,150 @@
+from array import array
+from collections import deque
+import numpy as np
+from Terrain import PARKING
+from Rerouter import Rerouter, remaining, set_route
+
+# What is done with a gridlock found:
+#   off       nothing is looked for
+#   detect    only the event and the metrics
+#   yield     one car of the cycle takes a free cell next to it, if there is
+#             one, and a new route from there
+#   reroute   every car of the cycle looks for a detour that leaves it
+#   teleport  one car of the cycle arrives at its destination right away
+POLICIES = ("off", "detect", "yield", "reroute", "teleport")
+# Events kept for /session/<session>/gridlocks
+EVENTS = 256
+
+
+class Gridlock:
+    # Cars that wait for each other in a cycle never move again. Every step
+    # after the cars moved the blocked ones form a wait-for graph: a car
+    # waits for the car in the street cell ahead of it (into a parking cars
+    # don't wait for cars). Every car has at most one cell ahead, so a cycle
+    # is found by walking from a car until the walk ends or comes back. A new
+    # cycle has a car that got blocked in this step, the last one to close
+    # it, so only the walks from those are taken.
+    def __init__(self, model, policy="yield"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown gridlock policy %r" % policy)
+        self.model = model
+        self.policy = policy
+        self.events = deque(maxlen=EVENTS)
+        # The reroute policy searches even with rerouting off
+        self.rerouter = None
+        # Cells of the cycles found that nobody left yet, reported once
+        self.known = set()
+        # Every cycle found, the events only keep the latest
+        self.found_count = 0
+
+    def step(self, blocked):
+        # `blocked` is stuck_cars of the step, see MapModel.step
+        if not blocked:
+            return
+        terrain = self.model.terrain
+        ahead = {}
+        cars = {}
+        newly = set()
+        for unique_id, car, steps in blocked:
+            position, route = remaining(self.model, car)
+            cars[position] = (unique_id, car)
+            if not terrain.kind[terrain.cell(route[0])] & PARKING:
+                ahead[position] = route[0]
+            if steps == 1:
+                newly.add(position)
+        occupied = self.model.occupancy.cars.ravel()
+        self.known = {cycle for cycle in self.known if occupied[list(cycle)].all()}
+        seen = set()
+        for position in sorted(newly):
+            walk = {}
+            cell = position
+            while cell in ahead and cell not in seen:
+                seen.add(cell)
+                walk[cell] = len(walk)
+                cell = ahead[cell]
+            # Back on its own walk: a cycle, new if a car in it just got
+            # blocked. Ending on an earlier walk, that one saw it already. A
+            # car of a cycle still in place gets blocked again after a detour
+            # that didn't help, then it is only resolved again.
+            if cell in walk:
+                cycle = list(walk)[walk[cell]:]
+                if not newly.intersection(cycle):
+                    continue
+                members = sorted((cars[cell] for cell in cycle), key=lambda member: member[0])
+                if frozenset(cycle) in self.known:
+                    self.resolve(members)
+                else:
+                    self.known.add(frozenset(cycle))
+                    self.found(members, cycle)
+
+    def found(self, members, cells):
+        # `members` (id, car) by id, `cells` in the order they wait
+        model = self.model
+        resolved = self.resolve(members)
+        self.found_count += 1
+        self.events.append({"step": model.step_count, "cars": [unique_id for unique_id, car in members],
+                            "cells": [list(model.terrain.cell(cell)) for cell in cells],
+                            "policy": self.policy, "resolved": resolved})
+        if model.metrics:
+            model.metrics.count("gridlocks")
+            model.metrics.count("gridlocked_cars", len(members))
+
+    def resolve(self, members):
+        if self.policy == "yield":
+            return any(self.sidestep(car) for unique_id, car in members)
+        elif self.policy == "reroute":
+            if self.rerouter is None:
+                self.rerouter = self.model.rerouter or Rerouter(self.model)
+            resolved = False
+            for unique_id, car in members:
+                position, route = remaining(self.model, car)
+                detour = self.rerouter.detour(position, route, float("inf"))
+                if detour is not None:
+                    set_route(self.model, car, detour)
+                    resolved = True
+            return resolved
+        elif self.policy == "teleport":
+            unique_id, car = members[0]
+            if self.model.car_engine:
+                self.model.car_engine.teleport(car)
+            else:
+                self.model.teleport(car)
+            return True
+        return False
+
+    def checkpoint(self):
+        # The cycles still known, as their cells one after the other
+        known = [sorted(cycle) for cycle in self.known]
+        return {"known_cells": np.array([cell for cycle in known for cell in cycle], dtype=np.int64),
+                "known_lengths": np.array([len(cycle) for cycle in known], dtype=np.int64),
+                "events": list(self.events), "found_count": self.found_count}
+
+    def restore(self, state):
+        cells = state["known_cells"].tolist()
+        self.known = set()
+        start = 0
+        for length in state["known_lengths"].tolist():
+            self.known.add(frozenset(cells[start:start + length]))
+            start += length
+        self.events = deque(state["events"], maxlen=EVENTS)
+        self.found_count = state["found_count"]
+
+    def sidestep(self, car):
+        # Next cell other than the one ahead that is free now and from where
+        # the destination can still be reached
+        model = self.model
+        terrain = model.terrain
+        occupancy = model.occupancy
+        router = model.router
+        position, route = remaining(model, car)
+        destiny = model.car_engine.agents[car].destiny if model.car_engine else car.destiny
+        for step in router.get_successors(terrain.cell(position)):
+            cell = terrain.index(step)
+            if cell == route[0] or occupancy.pedestrians[step] or occupancy.buses[step]:
+                continue
+            if occupancy.cars[step] and not terrain.kind[step] & PARKING:
+                continue
+            if router.reachable(step, destiny):
+                set_route(model, car, array("i", [position]) + array("i", router.get_route(step, destiny)))
+                return True
+        return False
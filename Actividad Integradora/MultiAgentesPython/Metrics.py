@@ -0,0 +1,119 @@
+from time import perf_counter
+from Car import Car
+from Bus import Bus
+from Pedestrians import Pedestrians
+from CarEngine import CarEngine
+
+# Timed phases. signals, spawn, schedule, reroute, gridlock and record add up
+# to MapModel.step; cars, metrobuses and pedestrians split schedule by the
+# agent stepped; ubication and delta build the frames, get_path is the
+# route of a new agent and jsonify the encoding of a response in the server
+PHASES = ("signals", "spawn", "schedule", "reroute", "gridlock", "record", "cars", "metrobuses", "pedestrians",
+          "ubication", "delta", "get_path", "jsonify")
+# Counters and their # HELP line on /metrics. A blocked Car sleeps until
+# it can go on, the CarEngine counts its blocked cars every step. A
+# cell_lookup is one agent checking the cell it moves to next; the
+# CarEngine checks its cars as arrays and counts none
+HELP = {"bfs_nodes": "Cells taken from a BFS queue by the routers and the Rerouter",
+        "cell_lookups": "Next cells checked by the agents before a move: Terrain kind and light, then Occupancy",
+        "blocked_moves": "Steps an agent wanted to move and could not",
+        "snapshot_bytes": "Bytes of the frames sent to clients",
+        "detours": "New routes the Rerouter gave to stuck cars",
+        "gridlocks": "Cycles of cars waiting for each other found by Gridlock",
+        "gridlocked_cars": "Cars in the gridlocks",
+        "boardings": "Pedestrians that got on a metrobus",
+        "alightings": "Pedestrians that got off a metrobus"}
+COUNTERS = tuple(HELP)
+# What the server itself times and counts, all of /metrics when the models
+# have no Metrics
+SERVER_PHASES = ("jsonify",)
+SERVER_COUNTERS = ("snapshot_bytes",)
+AGENTS = {Car: "cars", CarEngine: "cars", Bus: "metrobuses", Pedestrians: "pedestrians"}
+
+
+class Metrics:
+    # Timers and counters of a model, or of the server for jsonify. A model
+    # without them has metrics = None and every hook is behind a check of
+    # it, so they cost nothing when disabled. With keep_steps every step
+    # leaves a record of its own times and counts in `steps`.
+    def __init__(self, keep_steps=False):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.steps = [] if keep_steps else None
+        self.previous = None
+        self.last = 0.0
+
+    def time(self, phase, seconds):
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+
+    def start(self):
+        self.last = perf_counter()
+
+    def lap(self, phase):
+        # Times `phase` from the last start or lap
+        now = perf_counter()
+        self.seconds[phase] += now - self.last
+        self.calls[phase] += 1
+        self.last = now
+
+    def agent(self, agent, seconds):
+        phase = AGENTS[type(agent)]
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def end_step(self, step):
+        if self.steps is None:
+            return
+        totals = (dict(self.seconds), dict(self.calls), dict(self.counters))
+        previous = self.previous or (dict.fromkeys(PHASES, 0.0), dict.fromkeys(PHASES, 0),
+                                     dict.fromkeys(COUNTERS, 0))
+        record = {"step": step}
+        for phase in PHASES:
+            if totals[1][phase] != previous[1][phase]:
+                record[phase + "_seconds"] = totals[0][phase] - previous[0][phase]
+        for name in COUNTERS:
+            record[name] = totals[2][name] - previous[2][name]
+        self.steps.append(record)
+        self.previous = totals
+
+    def add(self, other):
+        # Adds the totals of another Metrics, like the ones of a closed session
+        for phase in PHASES:
+            self.seconds[phase] += other.seconds[phase]
+            self.calls[phase] += other.calls[phase]
+        for name in COUNTERS:
+            self.counters[name] += other.counters[name]
+
+    def totals(self):
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+
+def total(metrics):
+    result = Metrics()
+    for other in metrics:
+        result.add(other)
+    return result
+
+
+def prometheus(metrics, gauges=None, prefix="trans", phases=PHASES, counters=COUNTERS):
+    # Text exposition format of Prometheus, for GET /metrics
+    lines = ["# HELP %s_phase_seconds_total Time spent in each phase" % prefix,
+             "# TYPE %s_phase_seconds_total counter" % prefix]
+    lines += ['%s_phase_seconds_total{phase="%s"} %.9g' % (prefix, phase, metrics.seconds[phase]) for phase in phases]
+    lines += ["# HELP %s_phase_calls_total Times each phase ran" % prefix,
+              "# TYPE %s_phase_calls_total counter" % prefix]
+    lines += ['%s_phase_calls_total{phase="%s"} %d' % (prefix, phase, metrics.calls[phase]) for phase in phases]
+    for name in counters:
+        lines += ["# HELP %s_%s_total %s" % (prefix, name, HELP[name]),
+                  "# TYPE %s_%s_total counter" % (prefix, name),
+                  "%s_%s_total %d" % (prefix, name, metrics.counters[name])]
+    # gauges: name -> (help, value)
+    for name, (text, value) in (gauges or {}).items():
+        lines += ["# HELP %s_%s %s" % (prefix, name, text), "# TYPE %s_%s gauge" % (prefix, name),
+                  "%s_%s %s" % (prefix, name, value)]
+    return "\n".join(lines) + "\n"
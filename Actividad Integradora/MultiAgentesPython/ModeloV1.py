@@ -1,458 +1,398 @@
-from mesa import Agent, Model
-from mesa.time import StagedActivation
+from mesa import Model
+from ActivityScheduler import ActivityScheduler
 from mesa.space import MultiGrid
-from random import randint
 from Car import Car
-from Parking import Parking
-from Street import Street
 from TrafficLight import TrafficLight
-from Building import Building
-from Sidewalk import Sidewalk
-from Crosswalk import Crosswalk
-from StreetBus import StreetBus
-from BusStop import BusStop
 from Bus import Bus
 from Pedestrians import Pedestrians
+from Router import Router
+from Rerouter import Rerouter, REPLANS, stuck_cars
+from Gridlock import Gridlock
+from BusLine import BusLine
+from BusStops import BusStops
+from WalkRouter import WalkRouter
+from SignalController import SignalController
+from CityMap import CityMap, CityMapError, CITY
+from AgentPool import AgentPool
+from CarEngine import CarEngine
+from Metrics import Metrics
+from Occupancy import Occupancy, CAR, BUS, PEDESTRIAN
+from time import perf_counter
+from Terrain import Terrain
+import random
+
+
+# Occupancy layer of every mobile agent type
+LAYERS = {Car: CAR, Bus: BUS, Pedestrians: PEDESTRIAN}
 
 
 class MapModel(Model):
-    def __init__(self, width, height, number_cars, number_buses, number_pedestrians):
+    def __init__(self, width, height, number_cars, number_buses, number_pedestrians, seed=None, engine="agents",
+                 demand=None, city=None, populate=True, metrics=False, replans=REPLANS, gridlock="yield"):
+        # Model.__new__ of mesa 0.9 puts the RNG on the class, shared by every
+        # model of the process: each one gets its own
+        self._seed = seed
+        self.random = random.Random(seed)
+        # Phase timers and counters, None when off. metrics="steps" also keeps
+        # a record of every step in metrics.steps
+        self.metrics = Metrics(keep_steps=metrics == "steps") if metrics else None
+        # The streets, lights and stops come from a map file, loaded once per
+        # process and shared by its models
+        self.city = CityMap.template(city or CITY)
+        if (width, height) != (self.city.width, self.city.height):
+            raise CityMapError("%s is %dx%d, not %dx%d" % (self.city.name, self.city.width, self.city.height,
+                                                          width, height))
         self.grid = MultiGrid(width, height, True)
+        self.terrain = Terrain(width, height)
+        # gridSize of the frames: the last column and row, as the client
+        # has always read it
+        self.grid_size = (width - 1, height - 1)
+        self.traffic_lights = []
+        self.signals = SignalController(self, self.city.cycle)
+        # Agents per cell and class, every blocking check reads it
+        self.occupancy = Occupancy(self.terrain)
+        # "agents" steps every car through the schedule, "vector" moves all
+        # of them at once in a CarEngine
+        if engine not in ("agents", "vector"):
+            raise ValueError("Unknown engine %r" % engine)
+        self.car_engine = CarEngine(self) if engine == "vector" else None
+        # With a Demand new trips keep coming while the model runs, and the
+        # agents that arrive are reused for them
+        self.demand = demand
+        self.trips = None
+        self.next_trip = None
+        self.pool = AgentPool()
+        # A Recorder appends every step to disk when set
+        self.recorder = None
+        # Mobile agents by type and the agents that changed in the current step
+        self.cars = {}
+        self.buses = {}
+        self.pedestrians = {}
+        self.dirty = set()
+        self.stale = set()
+        self.entries = {}
+        self.despawned = []
+        # Cars of the agents engine whose last try to move failed, kept by
+        # Vehicle.move, so stuck_cars doesn't look at every car
+        self.blocked_cars = set()
+        self.step_count = 0
+        # Totals for headless runs, by snapshot key
+        self.moves = {"cars": 0, "metrobuses": 0, "pedestrians": 0}
+        self.arrivals = {"cars": 0, "metrobuses": 0, "pedestrians": 0}
+        self.trip_steps = {"cars": 0, "metrobuses": 0, "pedestrians": 0}
         self.number_cars = number_cars
         self.number_p = number_pedestrians 
         self.number_buses = number_buses
-        self.schedule = StagedActivation(self)
+        # Buses, then cars, then pedestrians, also for the ones spawned later
+        self.schedule = ActivityScheduler(self, rank=self.activation_rank)
         self.running = True
-        self.steps = 0
         self.current_id = 0
-        size = 1
-        self.parking_lots = [(7, 7), (5, 13), (7, 16), (6, 24), (14, 25), (7, 30), (12, 31), (14, 5), (
-            16, 9), (15, 16), (13, 14), (25, 5), (30, 8), (30, 13), (28, 16), (25, 25), (31, 30)]
-
-        
-        self.borrar = [(7,8), (4,13), (7,17), (6,23), (14,26), (7,29), (12,32), (14,4), (17,9), (15,17), (12,14), (25,4), (29,8), (30,12), (28,17), (26,25), (32,30)]
-        
-        self.directions = [(6,8), (4,14), (8,17), (7,23), (15,26),(8,29), (13,32), (15,4),(17,10),(14,17),(12,13),( 26,5),(30,9),(32,13),(29,17),(26,26),(32,31)]
-        
-            
-        self.lol1 = [[(4*size, 9*size), (4*size, 10*size)], [(4*size, 22*size), (4*size, 21*size)], [(25*size, 3*size), (25*size, 2*size), (25, 1)],
-                     [(32*size, 10*size), (32*size, 11*size)
-                      ], [(17*size, 27*size), (17*size, 28*size)],
-                     [(26*size, 27*size), (26*size, 28*size)
-                      ], [(23*size, 33*size), (23*size, 34*size), (23, 35)],
-                     [(4*size, 33*size), (4*size, 34*size), (4, 35)], [(12*size, 3*size), (12*size, 2*size), (12, 1)]]
-
-        self.lol2 = [[(1, 11), (2*size, 11*size), (3*size, 11*size)], [(1, 23), (2*size, 23*size), (3*size, 23*size)],
-                     [(18*size, 29*size), (19*size, 29*size)
-                      ], [(27*size, 29*size), (28*size, 29*size)],
-                     [(27*size, 4*size), (28*size, 4*size)
-                      ], [(33*size, 9*size), (34*size, 9*size), (35, 9)],
-                     [(33*size, 23*size), (34*size, 23*size), (35, 23)]]
-
-        self.crosswalk_list = [(1, 23), (2, 23), (3, 23), (1, 11), (2, 11), (3, 11), (4, 35), (4, 34), (
-            4, 33), (4, 28), (4, 27), (4, 22), (4, 21), (4, 19), (4, 18), (4, 10), (4, 9), (4, 3), (4, 2), (
-            4, 1), (10, 17), (11, 17), (10, 8), (11, 8), (12, 1), (12, 2), (12, 3), (17, 35), (17, 34), (17, 33), (17, 28), (
-            17, 27), (17, 22), (17, 21), (17, 19), (17, 18), (17, 3), (17, 2), (17, 1), (18, 29), (19, 29), (21, 29), (22, 29), (18, 17), (
-            19, 17), (21, 17), (22, 17), (18, 4), (19, 4), (21, 4), (22, 4), (23, 35), (23, 34), (23, 33), (26, 28), (26, 27), (26, 3), (26, 2), (
-            26, 1), (27, 29), (28, 29), (27, 23), (28, 23), (27, 4), (28, 4), (32, 28), (32, 27), (32, 22), (32, 21), (32, 19), (32, 18), (32, 11), (
-            32, 10), (33, 9), (34, 9), (35, 9), (33, 23), (34, 23), (35, 23)]
-
-        self.lst_buses = [(1, 23), (1, 11), (12, 1), (25, 1),
-                          (35, 9), (35, 23), (23, 35), (4, 35)]
-        # 1
-        self.create_building(
-            (5*size, 5*size), (8*size, 7*size), [(7*size, 7*size)])
-        self.create_sidewalk((4*size, 4*size), (9*size, 8*size))
-        # 2
-        self.create_building((5*size, 12*size), (8*size, 16*size),
-                             [(5*size, 13*size), (7*size, 16*size)])
-        self.create_sidewalk((4*size, 11*size), (9*size, 17*size))
-        # 3
-        self.create_building((5*size, 24*size), (16*size, 25*size),
-                             [(6*size, 24*size), (14*size, 25*size)])
-        self.create_sidewalk((4*size, 23*size), (17*size, 26*size))
-        # 4
-        self.create_building((5*size, 30*size), (16*size, 31*size),
-                             [(7*size, 30*size), (12*size, 31*size)])
-        self.create_sidewalk((4*size, 29*size), (17*size, 32*size))
-        # 5
-        self.create_building((13*size, 5*size), (16*size, 16*size), [
-                            (14*size, 5*size), (16*size, 9*size), (15*size, 16*size), (13*size, 14*size)])
-        self.create_sidewalk((12*size, 4*size), (17*size, 17*size))
-        # 6
-        self.create_building(
-            (24*size, 5*size), (25*size, 8*size), [(25*size, 5*size)])
-        self.create_sidewalk((23*size, 4*size), (26*size, 9*size))
-        # 7
-        self.create_building(
-            (30*size, 5*size), (31*size, 8*size), [(30*size, 8*size)])
-        self.create_sidewalk((29*size, 4*size), (32*size, 9*size))
-        # 8
-        self.create_building((24*size, 13*size), (31*size, 16*size),
-                             [(30*size, 13*size), (28*size, 16*size)])
-        self.create_sidewalk((23*size, 12*size), (32*size, 17*size))
-        # 9
-        self.create_building((24*size, 24*size),
-                             (25*size, 25*size), [(25*size, 25*size)])
-        self.create_sidewalk((23*size, 23*size), (26*size, 26*size))
-        # 10
-        self.create_building((24*size, 30*size), (25*size, 31*size), [])
-        self.create_sidewalk((23*size, 29*size), (26*size, 32*size))
-        # 11
-        self.create_building((30*size, 30*size),
-                             (31*size, 31*size), [(31*size, 30*size)])
-        self.create_sidewalk((29*size, 29*size), (32*size, 32*size))
-        # 12
-        self.create_building((30*size, 24*size),
-                             (31*size, 25*size), [])
-        self.create_sidewalk((29*size, 23*size), (32*size, 26*size))
-
-        # Glorieta
-        self.create_building((19*size, 19*size), (21*size, 21*size), [])
-
-        # Camellon
-        self.create_sidewalk((20*size, 4*size), (20*size, 17*size))
-        self.create_sidewalk((4*size, 20*size), (17*size, 20*size))
-        self.create_sidewalk((20*size, 23*size), (20*size, 32*size))
-        self.create_sidewalk((23*size, 20*size), (32*size, 20*size))
-        # # Semaforos
-        self.create_traffic(self.lol1)
-        self.create_traffic(self.lol2)
-
-        # # Cruces peatonales
-        self.create_crosswalk(self.crosswalk_list)
-    # Calle
-        # Bordes
-        #   cafe          gris        rojo            magenta
-        # 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda
-        self.create_street((4, 2), (32, 3), 2)
-        self.create_sidewalk((0, 0), (36, 0))
-        self.create_street((33, 2), (34, 34), 0)
-        self.create_sidewalk((36, 1), (36, 36))
-        self.create_street((4, 33), (32, 34), 3)
-        self.create_sidewalk((0, 36), (35, 36))
-        self.create_street((2, 2), (3, 34), 1)
-        self.create_sidewalk((0, 1), (0, 35))
-
-        # Dentro
-        self.create_street((4, 18), (17, 19), 2)
-        self.create_street((10, 4), (11, 17), 1)
-        self.create_street((4, 9), (9, 10), 3)
-        self.create_street((4, 21), (17, 22), 3)
-        self.create_street((4, 27), (17, 28), 2)
-        self.create_street((18, 4), (19, 17), 1)
-        self.create_street((21, 4), (22, 17), 0)
-        self.create_street((23, 10), (32, 11), 2)
-        self.create_street((27, 4), (28, 9), 1)
-        self.create_street((23, 18), (32, 19), 2)
-        self.create_street((23, 21), (32, 22), 3)
-        self.create_street((27, 23), (28, 32), 1)
-
-        self.create_street((23, 27), (26, 28), 2)
-        self.create_street((21, 23), (22, 32), 0)
-
-        self.create_street((18, 23), (19, 32), 1)
-        self.create_street((29, 27), (32, 28), 3)
-
-    # #     #Glorieta
-        self.create_street((18, 22), (22, 22), 3)
-        self.create_street((18, 18), (22, 18), 2)
-        self.create_street((18, 19), (18, 21), 1)
-        self.create_street((22, 19), (22, 21), 0)
-
-    # #     #MetroBus
-        self.create_streetbus((1, 1), (1, 35), 1)
-        self.create_streetbus((1, 1), (35, 1), 2)
-        self.create_streetbus((35, 1), (35, 35), 0)
-        self.create_streetbus((1, 35), (35, 35), 3)
-        self.bustops = [(0, 24), (1, 24), (0, 12), (1, 12), (11, 0), (11, 1),
-                        (24, 0), (24, 1), (36, 8), (35, 8), (36, 22), (35, 22), (24, 36),
-                        (24, 35), (5, 36), (5, 35)]
-        self.create_busstop(self.bustops)
-
-        self.spls = [(7, 8), (4, 13), (7, 17), (6, 23), (14, 26), (7, 29), (12, 32), (14, 4), (17, 9), (15, 17),
-                     (12, 14), (25, 4), (29, 8), (30, 12), (28, 17), (26, 25), (32, 30)]
-
-        self.create_pkl(self.spls)
-        self.create_crosswalk(self.crosswalk_list)
-    
-
-        self.create_buses(self.lst_buses)
-        self.create_cars_in_lots()
-        
-        for i in self.borrar:
-            aiuda = True
-            cell_content2 = self.grid.get_cell_list_contents(i)
-            for value in cell_content2:
-                if type(value) is Sidewalk:
-                    aiuda = False
-                    
-                if aiuda == False:
-                    self.grid.remove_agent(value)
-                    calle = Street(i, self)
-                    cross = Crosswalk(i, self)
-                    calle.direccion = 4
-                    self.grid.place_agent(calle, i)
-                    self.grid.place_agent(cross, i)
-                    
-        self.create_p()
-        self.ubication((0, 0), (36, 36))
-                    
-
-
-        #     self.grid.place_agent(calle, i)
-
-
+        self.parking_lots = self.city.parking_lots
+        self.router = Router(self, self.parking_lots)
+        # Detours for stuck cars, at most `replans` a step, None when 0
+        self.rerouter = Rerouter(self, replans) if replans else None
+        # Cycles of cars waiting for each other and what is done with them,
+        # see Gridlock.POLICIES
+        self.gridlock = Gridlock(self, gridlock)
+        self.directions = self.city.entrances
+        self.walk_router = WalkRouter(self, self.directions)
+        self.lst_buses = self.city.bus_starts
+        self.bustops = self.city.stops
+        self.bus_line = BusLine(self.city, self.terrain)
+        self.load_city()
+        # Queues of the stops and the legs by bus of the pedestrians
+        self.bus_stops = BusStops(self)
+        # Without populate the model has no agents yet, Checkpoint.load adds them
+        if populate:
+            self.create_buses()
+            self.create_cars_in_lots()
+            self.create_p()
+        if self.metrics:
+            # Step 0: building the model, the routes of the first agents
+            self.metrics.end_step(self.step_count)
+
+    def load_city(self):
+        city = self.city
+        # Only the agents and the signal state are this model's own; the
+        # terrain is copied on its first change, and a router rebuilds its
+        # own tables once invalidated
+        self.terrain.kind = city.kind
+        self.terrain.direction = city.direction
+        self.terrain.bus_direction = city.bus_direction
+        self.terrain.light = city.light
+        self.router.load(city.next_hop, city.routes)
+        self.walk_router.load(city.segment, city.crossing, city.crossings, city.walk_trees, city.walk_routes)
+        # One signal group per intersection, all its lights change together
+        for signal in city.signals:
+            cells = [tuple(cell) for cell in signal["cells"]]
+            lights = []
+            for cell in cells:
+                traffic = TrafficLight(cells, self)
+                traffic.pos = cell
+                self.traffic_lights.append(traffic)
+                self.mark_dirty(traffic)
+                lights.append(traffic)
+            self.signals.add_group(signal["name"], lights, signal["plan"], signal["offset"])
+
+    def refresh_entries(self):
+        for agent in self.stale:
+            self.entries[agent] = self.agent_entry(agent)
+        self.stale = set()
+
+    def ubication(self, visible_only=False):
+        # Snapshot of the mobile agents and traffic lights. Only the entries
+        # of agents that changed since the last snapshot are rebuilt.
+        if self.metrics:
+            start = perf_counter()
+        self.refresh_entries()
+        dict = {}
+        dict["gridSize"] = self.grid_size
+        dict["step"] = self.step_count
+        for key, registry in (("cars", self.cars), ("metrobuses", self.buses),
+                              ("pedestrians", self.pedestrians)):
+            dict[key] = [self.entries[value] for value in registry.values()
+                         if value.show or not visible_only]
+        dict["trafficlights"] = [self.entries[value] for value in self.traffic_lights]
+        dict["ridership"] = self.bus_stops.ridership()
+        if self.metrics:
+            self.metrics.time("ubication", perf_counter() - start)
+        return dict
 
-    def ubication(self, cell, last_cell):
+    def delta(self):
+        # Only what changed in the last step: agents that moved, turned or
+        # changed color, plus the ids of the agents that disappeared
+        if self.metrics:
+            start = perf_counter()
+        self.refresh_entries()
         dict = {}
-        dict["gridSize"] = (36, 36)
+        dict["step"] = self.step_count
         dict["cars"] = []
         dict["metrobuses"] = []
         dict["pedestrians"] = []
         dict["trafficlights"] = []
-        actual_cell = (0, 0)
-        initial_x, initial_y = actual_cell
-
-        while actual_cell != last_cell:
-            actual_cell = cell
-            x, y = cell
-            last_x, last_y = last_cell
-            if (y <= last_y and x <= last_x):
-                cell_content = self.grid.get_cell_list_contents((x, y))
-                for value in cell_content:
-                    dic = {}
-                    if type(value) is Car:
-                        dic["direction"] = value.direccion
-                        dic["id"] = value.unique_id
-                        dic["x"] = x
-                        dic["y"] = y
-                        dict["cars"].append(dic)
-                    elif type(value) is Bus:
-                        dic["direction"] = value.direccion
-                        dic["id"] =  value.unique_id
-                        dic["x"] = x
-                        dic["y"] = y
-                        dict["metrobuses"].append(dic)
-                    elif type(value) is TrafficLight:
-                        dic["id"] = value.unique_id
-                        dic["x"] = x
-                        dic["y"] = y
-                        dic["color"] = value.color
-                        dict["trafficlights"].append(dic)
-                    elif type(value) is Pedestrians:
-                        # dic["direction"] = value.direccion
-                        dic["id"] = value.unique_id
-                        dic["x"] = x
-                        dic["y"] = y
-                        dict["pedestrians"].append(dic)
-                        
-
-                cell = (x, y + 1)
-            else:
-                cell = (x + 1, initial_y)
-        #print(dict)
+        dict["despawned"] = {"cars": [], "metrobuses": [], "pedestrians": []}
+        for agent in self.dirty:
+            if getattr(agent, "show", True):
+                dict[self.snapshot_key(agent)].append(self.entries[agent])
+        for agent in self.despawned:
+            dict["despawned"][self.snapshot_key(agent)].append(agent.unique_id)
+        if self.metrics:
+            self.metrics.time("delta", perf_counter() - start)
         return dict
 
-    def create_busstop(self, spls):
-        for i in spls:
-            busstop = BusStop(i, self)
-            self.grid.place_agent(busstop, (i))
-
-    def create_pkl(self, spls):
-        for i in spls:
-            calle = Street(i, self)
-            calle.direccion = 4
-            self.grid.place_agent(calle, (i))
+    def activation_rank(self, agent):
+        if type(agent) is Bus:
+            return 0
+        elif type(agent) is Car or type(agent) is CarEngine:
+            return 1
+        return 2
+
+    def snapshot_key(self, agent):
+        if type(agent) is Car:
+            return "cars"
+        elif type(agent) is Bus:
+            return "metrobuses"
+        elif type(agent) is Pedestrians:
+            return "pedestrians"
+        return "trafficlights"
+
+    def agent_entry(self, value):
+        x, y = value.pos
+        dic = {}
+        if type(value) is TrafficLight:
+            dic["id"] = value.unique_id
+            dic["x"] = x
+            dic["y"] = y
+            dic["color"] = value.color
+        elif type(value) is Pedestrians:
+            # dic["direction"] = value.direccion
+            dic["id"] = value.unique_id
+            dic["x"] = x
+            dic["y"] = y
+        else:
+            dic["direction"] = value.direccion
+            dic["id"] = value.unique_id
+            dic["x"] = x
+            dic["y"] = y
+            if type(value) is Bus:
+                dic["passengers"] = value.passengers
+                dic["capacity"] = value.capacity
+        return dic
+
+    def mark_dirty(self, agent):
+        self.dirty.add(agent)
+        self.stale.add(agent)
+
+    def despawn(self, agent):
+        agent.show = False
+        self.despawned.append(agent)
+        self.blocked_cars.discard(agent)
+        key = self.snapshot_key(agent)
+        self.arrivals[key] += 1
+        self.trip_steps[key] += self.step_count - agent.start_step
+        if not (self.car_engine and type(agent) is Car):
+            self.retire(agent)
+        if self.demand:
+            self.release(agent)
+
+    def retire(self, agent):
+        # A finished agent leaves the schedule and the grid, it keeps its last
+        # position for the snapshots
+        pos = agent.pos
+        self.schedule.remove(agent)
+        self.grid.remove_agent(agent)
+        agent.pos = pos
+        self.occupancy.remove(LAYERS[type(agent)], pos)
+        self.schedule.cell_freed(pos)
+
+    def place(self, agent, pos):
+        # A retired agent back in the grid, like a pedestrian off a bus
+        agent.pos = pos
+        self.grid.place_agent(agent, pos)
+        self.occupancy.add(LAYERS[type(agent)], pos)
+        self.schedule.add(agent)
+        self.mark_dirty(agent)
+
+    def teleport(self, agent):
+        # A car of a gridlock arrives at its destination from where it is
+        old = agent.pos
+        self.occupancy.move(LAYERS[type(agent)], old, agent.destiny, self.step_count)
+        self.grid.move_agent(agent, agent.destiny)
+        self.schedule.cell_freed(old)
+        self.mark_dirty(agent)
+        agent.cursor = len(agent.route)
+        self.despawn(agent)
+
+    def car_at(self, pos):
+        return self.occupancy.cars[pos] > 0
+
+    def move_agent(self, agent, pos):
+        old = agent.pos
+        self.occupancy.move(LAYERS[type(agent)], old, pos, self.step_count)
+        self.grid.move_agent(agent, pos)
+        self.schedule.cell_freed(old)
+        self.mark_dirty(agent)
+        self.moves[self.snapshot_key(agent)] += 1
+
+    def add_agent(self, agent, pos, registry):
+        agent.start_step = self.step_count
+        registry[agent.unique_id] = agent
+        self.mark_dirty(agent)
+        self.occupancy.add(LAYERS[type(agent)], pos)
+        if self.car_engine and type(agent) is Car:
+            # The engine keeps the position, the car is not in the grid
+            self.car_engine.add(agent)
+            return
+        self.grid.place_agent(agent, pos)
+        self.schedule.add(agent)
+        if type(agent) is Car or type(agent) is Pedestrians:
+            if self.metrics:
+                start = perf_counter()
+                agent.get_path()
+                self.metrics.time("get_path", perf_counter() - start)
+            else:
+                agent.get_path()
+
+    def spawn(self, cls, ini, dest, registry):
+        # New agent for a trip, an arrived one from the pool if there is any
+        agent = self.pool.acquire(cls, self.current_id, self, ini, dest)
+        self.current_id += 1
+        agent.pos = ini
+        self.add_agent(agent, ini, registry)
+        return agent
+
+    def release(self, agent):
+        # The arrived agent stops being listed and waits in the pool
+        self.registry(agent).pop(agent.unique_id, None)
+        self.entries.pop(agent, None)
+        self.stale.discard(agent)
+        self.pool.release(agent)
+
+    def registry(self, agent):
+        return {"cars": self.cars, "metrobuses": self.buses,
+                "pedestrians": self.pedestrians}[self.snapshot_key(agent)]
+
+    def spawn_trips(self):
+        if self.trips is None:
+            self.trips = self.demand.trips(self)
+            self.next_trip = next(self.trips, None)
+        while self.next_trip and self.next_trip[0] <= self.step_count:
+            step, kind, origin, destiny = self.next_trip
+            if kind == "cars":
+                self.spawn(Car, origin, destiny, self.cars)
+            else:
+                self.spawn(Pedestrians, origin, destiny, self.pedestrians)
+            self.next_trip = next(self.trips, None)
 
-    def create_crosswalk(self, splw):
-        for i in splw:
-            crosswalk = Crosswalk(i, self)
-            self.grid.place_agent(crosswalk, (i))
-            
     def create_p(self):
-        # pini = (5, 4)
-        # pdest = (12, 15)
         for i in range(self.number_p):
-            pini = self.directions[randint(0, len(self.directions)-1)]
-            pdest = self.directions[randint(0, len(self.directions)-1)]
+            pini = self.directions[self.random.randint(0, len(self.directions)-1)]
+            pdest = self.directions[self.random.randint(0, len(self.directions)-1)]
             
             while pini == pdest:
-                pdest = self.directions[randint(0, len(self.directions)-1)]
+                pdest = self.directions[self.random.randint(0, len(self.directions)-1)]
                 
-            x, y = pini
-            pAg = Pedestrians(self.current_id, self, pini, pdest)
-            self.current_id += 1
-            pAg.pos = pini
-            self.grid.place_agent(pAg, pini)
-            self.schedule.add(pAg)
-            pAg.get_path()
+            self.spawn(Pedestrians, pini, pdest, self.pedestrians)
 
     def create_cars_in_lots(self):
-        pini = (2, 2)
-        pdest = (31, 30)
+        if self.car_engine:
+            self.schedule.add(self.car_engine)
         for i in range(self.number_cars):
-            ini = self.parking_lots[randint(0, len(self.parking_lots)-1)]
-            dest = self.parking_lots[randint(0, len(self.parking_lots)-1)]
+            ini = self.parking_lots[self.random.randint(0, len(self.parking_lots)-1)]
+            dest = self.parking_lots[self.random.randint(0, len(self.parking_lots)-1)]
             while ini == dest:
-                dest = self.parking_lots[randint(0, len(self.parking_lots)-1)]
-            x, y = ini
-
-            carAg = Car(self.current_id, self, ini, dest)
+                dest = self.parking_lots[self.random.randint(0, len(self.parking_lots)-1)]
             #print(f"{ini=} -> {dest=}")
-            self.current_id += 1
-            carAg.pos = ini
-            # carAg.direccion = self.get_direction(ini)
-            #print(f" direccion inicial {carAg.direccion}")
-            self.grid.place_agent(carAg, ini)
-            self.schedule.add(carAg)
-            carAg.get_path()
+            self.spawn(Car, ini, dest, self.cars)
 
-    def create_buses(self, lst_buses):
-        for i in lst_buses:
-            x, y = i
+    def create_buses(self):
+        for i in self.bus_line.starts(self.number_buses, self.lst_buses):
             busAg = Bus(self.current_id, self, i)
             self.current_id += 1
             busAg.pos = i
-            self.grid.place_agent(busAg, i)
-            self.schedule.add(busAg)
-            # self.schedule.add(busAg)
-
-    def create_streetbus(self, cell, last_cell, direccion):
-        actual_cell = (0, 0)
-        initial_x, initial_y = cell
-
-        while actual_cell != last_cell:
-            actual_cell = cell
-            x, y = cell
-            last_x, last_y = last_cell
-
-            if (y <= last_y and x <= last_x):
-                street = StreetBus((actual_cell), self)
-                street.direccion = direccion
-                self.grid.place_agent(street, (actual_cell))
-                cell = (x, y + 1)
-            else:
-                cell = (x + 1, initial_y)
-    
-    # def delate_street(self, cell, last_cell):
-    #     street = Street((actual_cell), self)
-    #     street.direccion = direccion
-    #             self.grid.place_agent(street, (actual_cell))
-    #             cell = (x, y + 1)
-
-    def create_street(self, cell, last_cell, direccion):
-        actual_cell = (0, 0)
-        initial_x, initial_y = cell
-
-        while actual_cell != last_cell:
-            actual_cell = cell
-            x, y = cell
-            last_x, last_y = last_cell
-
-            if (y <= last_y and x <= last_x):
-                street = Street((actual_cell), self)
-                street.direccion = direccion
-                self.grid.place_agent(street, (actual_cell))
-                cell = (x, y + 1)
-            else:
-                cell = (x + 1, initial_y)
-
-    def create_sidewalk(self, cell, last_cell):
-        actual_cell = (0, 0)
-        initial_x, initial_y = cell
-
-        while actual_cell != last_cell:
-            actual_cell = cell
-            x, y = cell
-            last_x, last_y = last_cell
-            temp = True
-            if (y <= last_y and x <= last_x):
-                cell_content = self.grid.get_cell_list_contents((x, y))
-                for value in cell_content:
-                    if type(value) is Building or type(value) is Street or type(value) is Parking:
-                        temp = False
-                if temp:
-                    sidewalk = Sidewalk((actual_cell), self)
-                    self.grid.place_agent(sidewalk, (actual_cell))
-                cell = (x, y + 1)
-            else:
-                cell = (x + 1, initial_y)
-
-    def create_building(self, cell, last_cell, parking_list):
-        # This function creates a new building, well I think so
-        actual_cell = (0, 0)
-        initial_x, initial_y = cell
-
-        while actual_cell != last_cell:
-            actual_cell = cell
-            x, y = cell
-            last_x, last_y = last_cell
-            # check_cell = self.model.grid.get_cell_list_contents(actual_cell)
-
-            if (y <= last_y and x <= last_x):
-                building = Building((actual_cell), self)
-                self.grid.place_agent(building, (actual_cell))
-                cell = (x, y + 1)
-            else:
-                cell = (x + 1, initial_y)
-
-        for i in parking_list:
-            check_cell = self.grid.get_cell_list_contents(i)
-            for value in check_cell:
-                if type(value) is Building:
-                    # self.parking_lots.append(i)
-                    self.grid.remove_agent(value)
-                    parking = Parking(i, self)
-                    self.grid.place_agent(parking, i)
-
-    def create_traffic(self, loc):
-        for i in loc:
-            for j in i:
-                check_cell = self.grid.get_cell_list_contents(j)
-                traffic = TrafficLight(i, self)
-                self.grid.place_agent(traffic, (j))
-
-    def manage_traffic(self, loc, num_steps, color):
-        for i in loc:
-            for j in i:
-                check_cell = self.grid.get_cell_list_contents(j)
-                for value in check_cell:
-                    if type(value) is TrafficLight:
-                        if color == 0:
-                            value.color = color
-                        elif color == 1:
-                            value.color = color
-                        elif color == 2:
-                            value.color = color
-                        else:
-                            value.color = color
+            self.add_agent(busAg, i, self.buses)
+            self.bus_line.add(busAg)
+        self.bus_line.link()
 
     def step(self):
-        self.steps += 1
-
-        if self.steps <= 10:
-            self.manage_traffic(self.lol1, self.steps, 0)
-            self.manage_traffic(self.lol2, self.steps, 2)
-        elif self.steps < 15 and self.steps > 10:
-            self.manage_traffic(self.lol1, self.steps, 1)
-            self.manage_traffic(self.lol2, self.steps, 2)
-        elif self.steps >= 15 and self.steps <= 25:
-            self.manage_traffic(self.lol1, self.steps, 2)
-            self.manage_traffic(self.lol2, self.steps, 0)
-        elif self.steps > 25 and self.steps <= 30:
-            self.manage_traffic(self.lol1, self.steps, 2)
-            self.manage_traffic(self.lol2, self.steps, 1)
-        else:
-            self.manage_traffic(self.lol1, self.steps, 0)
-            self.manage_traffic(self.lol2, self.steps, 2)
-            self.steps = 0
+        self.dirty = set()
+        self.despawned = []
+        self.step_count += 1
+        metrics = self.metrics
+        if metrics:
+            metrics.start()
+        self.signals.step(self.step_count)
+        if metrics:
+            metrics.lap("signals")
+        if self.demand:
+            self.spawn_trips()
+            if metrics:
+                metrics.lap("spawn")
         # print(self.parking_lots)
-        self.ubication((0, 0), (36, 36))
         self.schedule.step()
+        if metrics:
+            metrics.lap("schedule")
+        if self.rerouter or self.gridlock.policy != "off":
+            # The stuck cars are found once, the Rerouter takes out the ones
+            # it gave a detour and Gridlock gets the rest
+            blocked = stuck_cars(self)
+            if self.rerouter:
+                blocked = self.rerouter.step(blocked)
+                if metrics:
+                    metrics.lap("reroute")
+            if self.gridlock.policy != "off":
+                self.gridlock.step(blocked)
+                if metrics:
+                    metrics.lap("gridlock")
+        if self.recorder:
+            self.recorder.record(self)
+            if metrics:
+                metrics.lap("record")
+        if metrics:
+            metrics.end_step(self.step_count)
 
 
 if __name__ == "__main__":
-    model = MapModel(37, 37, 10, 1)
+    model = MapModel(37, 37, 10, 1, 10)
     while model.running:
         model.step()
@@ -1,114 +1,105 @@
 from ModeloV1 import *
+from Terrain import BUILDING, PARKING, SIDEWALK, STREET, CROSSWALK, STREETBUS, BUSSTOP
 from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
 
 
-def agent_portrayal(agent):
-    portrayal = {}
-    if type(agent) is Building:
-        portrayal = {
+def terrain_portrayal(kind):
+    portrayals = []
+    if kind & BUILDING:
+        portrayals.append({
             "Shape": "rect",
             "Filled": "true",
             "Layer": 2,
             "Color": "Blue",
             "w": 1,
             "h": 1,
-        }
-    if type(agent) is Parking:
-        portrayal = {
+        })
+    if kind & PARKING:
+        portrayals.append({
             "Shape": "rect",
             "Filled": "true",
             "Layer": 2,
             "Color": "black",
             "w": 1,
             "h": 1,
-        }
-    if type(agent) is TrafficLight:
-        portrayal = {
-            "Shape": "circle",
-            "Filled": "true",
-            "Layer": 4,
-            "Color": "red",
-            "r": 0.8
-
-        }
-        if agent.color == 1:
-            portrayal["Color"] = "yellow"
-        elif agent.color == 0:
-            portrayal["Color"] = "green"
-        elif agent.color == 2:
-            portrayal["Color"] = "red"
-    
-    if type(agent) is Street:
-        portrayal = {
+        })
+    if kind & STREET:
+        portrayals.append({
             "Shape": "rect",
             "Filled": "true",
             "Layer": 1,
+            "Color": "gray",
             "w": 1,
             "h": 1,
-        }
-        # 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda
-        if agent.direccion == 0:
-            # portrayal["Color"] = "brown"
-            portrayal["Color"] = "gray"
-        if agent.direccion == 1:
-            portrayal["Color"] = "gray"
-        if agent.direccion == 2:
-            # portrayal["Color"] = "red"
-            portrayal["Color"] = "gray"
-        if agent.direccion == 3:
-            # portrayal["Color"] = "magenta"
-            portrayal["Color"] = "gray"
-        if agent.direccion == 4:
-            # portrayal["Color"] = "purple"
-            portrayal["Color"] = "gray"
-            #portrayal["Color"] = (128,128,128)
-    if type(agent) is Car:
-        portrayal = {
-            "Shape": "circle",
-            "Filled": "true",
-            "Layer": 3,
-            "Color": "brown",
-            "r": 0.8
-        }
-        if not agent.show:
-            portrayal["Color"] = "gray"
-    
-    if type(agent) is Sidewalk:
-        portrayal = {
+        })
+    if kind & SIDEWALK:
+        portrayals.append({
             "Shape": "rect",
             "Filled": "true",
             "Color": "black",
             "Layer": 2,
             "w": 1,
             "h": 1,
-        }
-    if type(agent) is Crosswalk:
-        portrayal = {
+        })
+    if kind & CROSSWALK:
+        portrayals.append({
             "Shape": "circle",
             "Filled": "true",
             "Layer": 3,
             "Color": "white",
             "r": 1
-        }
-    if type(agent) is StreetBus:
-        portrayal = {
+        })
+    if kind & STREETBUS:
+        portrayals.append({
             "Shape": "rect",
             "Filled": "true",
             "Color": "purple",
             "Layer": 1,
             "w": 1,
             "h": 1,
-        }
-    if type(agent) is BusStop:
-        portrayal = {
+        })
+    if kind & BUSSTOP:
+        portrayals.append({
             "Shape": "rect",
             "Filled": "true",
             "Color": "pink",
             "Layer": 1,
             "w": 1,
             "h": 1,
+        })
+    return portrayals
+
+
+def agent_portrayal(agent):
+    portrayal = {}
+    if type(agent) is TrafficLight:
+        portrayal = {
+            "Shape": "circle",
+            "Filled": "true",
+            "Layer": 4,
+            "Color": "red",
+            "r": 0.8
+
         }
+        if agent.color == 1:
+            portrayal["Color"] = "yellow"
+        elif agent.color == 0:
+            portrayal["Color"] = "green"
+        elif agent.color == 2:
+            portrayal["Color"] = "red"
+    
+    if type(agent) is Car:
+        portrayal = {
+            "Shape": "circle",
+            "Filled": "true",
+            "Layer": 3,
+            "Color": "brown",
+            "r": 0.8
+        }
+        if not agent.show:
+            portrayal["Color"] = "gray"
+    
     if type(agent) is Bus:
         portrayal = {
             "Shape": "circle",
@@ -131,11 +122,29 @@ def agent_portrayal(agent):
 
 
 
+class CityGrid(CanvasGrid):
+    # The map is not made of agents anymore, draw it from the terrain arrays
+    def render(self, model):
+        grid_state = super().render(model)
+        terrain = model.terrain
+        for x in range(terrain.width):
+            for y in range(terrain.height):
+                for portrayal in terrain_portrayal(terrain.kind[x, y]):
+                    portrayal["x"] = x
+                    portrayal["y"] = y
+                    grid_state[portrayal["Layer"]].append(portrayal)
+        for light in model.traffic_lights:
+            portrayal = agent_portrayal(light)
+            portrayal["x"], portrayal["y"] = light.pos
+            grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
+
 var = 34
 num_cars = 40 
-num_buses = 1
+num_buses = 8
 num_pedestrians = 20
-grid = CanvasGrid(agent_portrayal, 37, 37)
+grid = CityGrid(agent_portrayal, 37, 37)
 
 server = ModularServer(
     MapModel,
@@ -0,0 +1,55 @@
+import numpy as np
+from Terrain import PARKING
+
+# Layers of Occupancy.counts
+CAR = 0
+BUS = 1
+PEDESTRIAN = 2
+
+
+class Occupancy:
+    # Mobile agents per cell and class, kept up to date by MapModel on every
+    # move, so a blocking check is a few array reads instead of a scan of
+    # the grid cell. Every class sees every other the same way:
+    #   a car or a bus can't enter a cell with a vehicle or a pedestrian,
+    #     except a car into a parking, where cars stack
+    #   a pedestrian can't enter a cell with a vehicle, pedestrians share
+    # On top of that `claimed` is the reservation table of the step: the
+    # last step a vehicle claimed the cell by moving into it. Vehicles can't
+    # enter a cell claimed in the same step by someone else, so at most one
+    # gets into a cell per step even when the moves of a step are applied
+    # at once, like the CarEngine does.
+    def __init__(self, terrain):
+        self.terrain = terrain
+        width, height = terrain.width, terrain.height
+        self.counts = np.zeros((3, width, height), dtype=np.int32)
+        self.cars = self.counts[CAR]
+        self.buses = self.counts[BUS]
+        self.pedestrians = self.counts[PEDESTRIAN]
+        self.claimed = np.full((width, height), -1, dtype=np.int64)
+
+    def add(self, layer, pos):
+        self.counts[layer][pos] += 1
+
+    def remove(self, layer, pos):
+        self.counts[layer][pos] -= 1
+
+    def move(self, layer, old, new, step):
+        counts = self.counts[layer]
+        counts[old] -= 1
+        counts[new] += 1
+        # Pedestrians and cars going into a parking share the cell, the rest
+        # claim it for the step
+        if layer == BUS or (layer == CAR and not self.terrain.kind[new] & PARKING):
+            self.claimed[new] = step
+
+    def vehicle_blocked(self, layer, pos, step):
+        # Whether a car (CAR) or a bus (BUS) can't move into `pos` now
+        if self.pedestrians[pos] or self.buses[pos] or self.claimed[pos] == step:
+            return True
+        if self.cars[pos]:
+            return layer != CAR or not self.terrain.kind[pos] & PARKING
+        return False
+
+    def pedestrian_blocked(self, pos):
+        return bool(self.cars[pos] or self.buses[pos])
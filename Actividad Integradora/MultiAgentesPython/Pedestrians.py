@@ -1,10 +1,9 @@
 from mesa import Agent 
 from abc import abstractmethod
-from queue import Queue
-from TrafficLight import TrafficLight
-from Crosswalk import Crosswalk
-from Sidewalk import Sidewalk
-import Car
+from Terrain import SIDEWALK
+
+# Steps a pedestrian takes to walk one cell
+PACE = 4
 
 class Pedestrians(Agent):
     def __init__(self, unique_id, model, position, destiny) -> None:
@@ -12,125 +11,70 @@ class Pedestrians(Agent):
         self.show = True 
         self.position = position
         self.destiny = destiny
-        self.path = Queue()
+        # Shared route from the WalkRouter and the index of the next cell in it
+        self.route = ()
+        self.cursor = 0
         self.pasito_a_pasito = 0
+        # (board, alight) stops of BusStops when part of the trip is by bus,
+        # until it gets off
+        self.leg = model.bus_stops.leg(position, destiny)
     
     
-    def prune_neighbors(self, possible_steps):
-        width = self.model.grid.width
-        heigth = self.model.grid.height
-        valid_steps = [(px, py) for px,py in possible_steps
-                       if px >= 0 and  px < width and
-                       py >= 0 and py < heigth]
-        street_steps = []
-        for position in valid_steps:
-            cell = self.model.grid.get_cell_list_contents(position)
-            for value in cell:
-                if type(value) is Sidewalk or type(value) is Crosswalk:
-                    street_steps.append((position))
-                    break
-        return tuple(street_steps)
-                
-    def get_neighbors(self, pos):
-        curr_cel = self.model.grid.get_cell_list_contents(pos)
-        curr_street_dir = None
-        for elem in curr_cel:
-            if type(elem) is Sidewalk:
-                curr_street_dir = elem.direccion
-            if type(elem) is Crosswalk:
-                curr_street_dir = elem.direccion
-        x,y = pos
-        possible_steps = []       
-        # 4 == any direction
-        
-        possible_steps.append((x, y+1))    
-        possible_steps.append((x, y-1))
-        possible_steps.append((x+1, y))    
-        possible_steps.append((x-1, y))
-    
-        return self.prune_neighbors(possible_steps)
-
-    def restore_path(self, path) -> None:
-        x, y = self.destiny
-        restored_path = [(x, y)]
-
-        while path[x][y] != (-1, -1):
-            x, y = path[x][y]
-            restored_path.append((x, y))
-
-        path_steps = restored_path[::-1]
-        #print(f"{path_steps=}")
-        for step in path_steps:
-            self.path.put(step)
-
-    
     def move(self) -> None:
     
-        if not self.path.empty():
-            if self.position == self.path.queue[0]:
-                self.path.get()
-            new_position = self.path.queue[0]
+        terrain = self.model.terrain
+        if self.cursor < len(self.route) and terrain.index(self.position) == self.route[self.cursor]:
+            self.cursor += 1
+        # Standing on the last cell is arriving, there is no next one
+        if self.cursor < len(self.route):
+            cursor = self.cursor
+            new_position = terrain.cell(self.route[cursor])
 
             #print(f"{new_position}")
-            # print(f"{self.path.queue[1]}")
-            next_cell = self.model.grid.get_cell_list_contents(new_position)
-            trafficLight = None
-            crosswalk = None
-            banquetita = None
-            CarNext = None
+            light = terrain.light[new_position]
+            trafficLight = self.model.traffic_lights[light] if light >= 0 else None
+            if terrain.has(new_position, SIDEWALK):
+                self.direccion = 4
+            if self.model.metrics:
+                self.model.metrics.count("cell_lookups")
+            blocked = self.model.occupancy.pedestrian_blocked(new_position)
 
-            for elem in next_cell:
-                if type(elem) is TrafficLight:
-                    trafficLight = elem
-                if type(elem) is Crosswalk:
-                    crosswalk = elem
-                if type(elem) is Sidewalk:
-                    banquetita = elem
-                    self.direccion = elem.direccion
-                if type(elem) is Car.Car:
-                    CarNext = elem
-                    
             if trafficLight:
                 # 0 = verde | 1 = amarillo | 2 = Rojo
-                if trafficLight.color == 1 or trafficLight.color == 2:
-                    self.model.grid.move_agent(self, new_position)
-                    self.path.get()
+                if (trafficLight.color == 1 or trafficLight.color == 2) and not blocked:
+                    self.model.move_agent(self, new_position)
+                    self.cursor += 1
 
             # elif banquetita:
-            #     self.model.grid.move_agent(self, new_position)
-            #     self.path.get()
-            elif CarNext is None:
-                self.model.grid.move_agent(self, new_position)
-                self.path.get()
-        else:
-            self.show = False
+            #     self.model.move_agent(self, new_position)
+            #     self.cursor += 1
+            elif not blocked:
+                self.model.move_agent(self, new_position)
+                self.cursor += 1
+            if self.model.metrics and self.cursor == cursor:
+                self.model.metrics.count("blocked_moves")
+        elif self.leg:
+            self.model.bus_stops.join(self)
+        elif self.show:
+            self.model.despawn(self)
 
     def get_path(self) -> None:
-        width = self.model.grid.width
-        heigth = self.model.grid.height
-        visited = [[False for _ in range(heigth)] for _ in range(width)]
-        path = [[(-1,-1) for _ in range(heigth)] for _ in range(width)]
-        q = Queue()
-        q.put(self.position)
-        x,y = self.position
-        visited[x][y] = True
-        while not q.empty():
-            x, y= q.get()
-            possible_steps = self.get_neighbors((x, y))
-            for to_x, to_y in possible_steps:
-                if not visited[to_x][to_y]:
-                    path[to_x][to_y] = (x,y)
-                    visited[to_x][to_y] = True
-                    q.put((to_x, to_y))
-
-        self.restore_path(path)
+        # With a bus leg, the walk to the first stop
+        stops = self.model.bus_stops
+        target = stops.platforms[self.leg[0]] if self.leg else self.destiny
+        self.route = self.model.walk_router.get_route(self.position, target)
+        self.cursor = 0
         
     def step(self) -> None:
-        if self.pasito_a_pasito >= 3: 
+        if self.pasito_a_pasito >= PACE - 1: 
             self.move()
             self.pasito_a_pasito = 0
         else:
             self.pasito_a_pasito += 1
+        if self.show:
+            # The steps in between only count, sleep through them
+            self.model.schedule.sleep(self, self.model.step_count + PACE - self.pasito_a_pasito)
+            self.pasito_a_pasito = PACE - 1
 
     def advance(self) -> None:
         print("", end="")
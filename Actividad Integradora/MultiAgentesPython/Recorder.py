@@ -0,0 +1,335 @@
+import json
+import mmap
+import os
+import struct
+from itertools import chain
+from operator import attrgetter
+import numpy as np
+from Car import Car
+from Bus import Bus
+from Pedestrians import Pedestrians
+from BusStops import CAPACITY
+
+# Recordings made through the server, one folder each
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+FORMAT = 6
+# Delta rows between full frames, a seek replays at most this many and the
+# rows of a write. Counted in rows, not steps: once the trips end a step has
+# a few rows, and a keyframe every so many steps would be most of the file
+KEYFRAME_ROWS = 1 << 13
+# Steps kept in memory before writing them, fewer if their rows reach
+# FLUSH_BYTES. A live Recording is at most this many steps behind the model
+FLUSH_EVERY = 64
+FLUSH_BYTES = 1 << 16
+# Rows a column file has room for at first, it doubles when full
+GROW = 1 << 12
+
+KINDS = {Car: 0, Bus: 1, Pedestrians: 2}
+SHOWN = attrgetter("show")
+NAMES = ("cars", "metrobuses", "pedestrians")
+# One file per column, <table>_<column>.bin. Rows are packed little-endian
+# records while in memory and split into the columns when written.
+# rows: every agent that appeared, moved or turned (state 0) or that
+# despawned (state 1, without position), by step; passengers of a
+# metrobus, 0 for the rest
+ROW = np.dtype([("step", "<i8"), ("id", "<i8"), ("kind", "u1"), ("x", "<i2"), ("y", "<i2"), ("direction", "i1"),
+                ("state", "u1"), ("passengers", "<u2")])
+PACK_ROW = struct.Struct("<qqBhhbBH")
+# frames: rows of every visible agent at a keyframe
+# steps: the ridership of BusStops (boarded, alighted, waiting), at the
+# first step and every step where it changed
+# lights: SignalController.colors as it is, the color of every light and
+# the red of no light at the end, at the first step and every step where a
+# light changed
+RIDERSHIP = ("boarded", "alighted", "waiting")
+STEP = np.dtype([("step", "<i8"), ("ridership", "<i8", (len(RIDERSHIP),))])
+PACK_STEP = struct.Struct("<qqqq")
+PACK_LIGHTS = struct.Struct("<q")
+TABLES = ("rows", "frames", "steps", "lights")
+# flushes.bin: a record per write, appended after the columns: the last
+# step written and how many rows of each table there are up to it. The
+# column files are longer, the room left for the next writes is zeros
+FLUSH = np.dtype([("step", "<i8")] + [(table, "<i8") for table in TABLES])
+PACK_FLUSH = struct.Struct("<q" + "q" * len(TABLES))
+
+
+def column_path(path, table, name):
+    return os.path.join(path, "%s_%s.bin" % (table, name))
+
+
+def dtypes(lights):
+    # The dtype of every table, the lights one has a column per light
+    return {"rows": ROW, "frames": ROW, "steps": STEP,
+            "lights": np.dtype([("step", "<i8"), ("colors", "i1", (lights + 1,))])}
+
+
+def fields(dtype):
+    # Column name and the dtype of one of its rows
+    return [(name, dtype.fields[name][0]) for name in dtype.names]
+
+
+class Recorder:
+    # Appends what changes every step (the fields of MapModel.ubication) to
+    # a folder of column files. A row is packed straight from the agent and
+    # kept in memory, a step where nothing changed adds nothing. Every
+    # flush_every steps, or sooner once flush_bytes of rows are pending, a
+    # table is viewed as a record array and copied column by column into
+    # the files, which are memory-mapped: no system call but the one for
+    # flushes.bin, and what is copied is on disk even if the process dies.
+    def __init__(self, path, model, keyframe_rows=KEYFRAME_ROWS, flush_every=FLUSH_EVERY,
+                 flush_bytes=FLUSH_BYTES):
+        os.makedirs(path)
+        self.path = path
+        self.keyframe_rows = keyframe_rows
+        self.flush_every = flush_every
+        self.flush_rows = max(1, flush_bytes // ROW.itemsize)
+        self.columns = {table: None for table in TABLES}
+        self.counts = dict.fromkeys(TABLES, 0)
+        self.pending = {table: [] for table in TABLES}
+        self.rows = self.pending["rows"]
+        self.dtypes = dtypes(len(model.traffic_lights))
+        meta = {"format": FORMAT, "first_step": model.step_count, "keyframe_rows": keyframe_rows,
+                "capacity": CAPACITY, "gridSize": model.grid_size,
+                "lights": [{"id": light.unique_id, "x": light.pos[0], "y": light.pos[1]}
+                           for light in model.traffic_lights]}
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(meta, file)
+        for table in TABLES:
+            self.grow(table, GROW)
+        self.flushes = os.open(os.path.join(path, "flushes.bin"), os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        self.step = model.step_count
+        self.next_flush = model.step_count + flush_every
+        # The first step has every agent, as if they all just appeared, and
+        # is the first keyframe. It is written right away, so the recording
+        # can be read from the start.
+        self.pack(model.step_count, chain(model.cars.values(), model.buses.values(), model.pedestrians.values()),
+                  self.rows)
+        stops = model.bus_stops
+        self.pending["steps"].append(PACK_STEP.pack(model.step_count, stops.boarded, stops.alighted, stops.waiting))
+        self.pending["lights"].append(PACK_LIGHTS.pack(model.step_count) + model.signals.colors.tobytes())
+        self.keyframe(model)
+        self.flush()
+
+    def grow(self, table, size):
+        # Makes the column files of table `size` rows long and maps them again
+        columns = {}
+        for name, field in fields(self.dtypes[table]):
+            with open(column_path(self.path, table, name), "r+b" if self.columns[table] else "w+b") as file:
+                file.truncate(size * field.itemsize)
+                # Plain arrays over the map, a copy into np.memmap costs
+                # three times as much
+                data = mmap.mmap(file.fileno(), size * field.itemsize)
+            columns[name] = np.frombuffer(data, dtype=field.base).reshape((size,) + field.shape)
+        self.columns[table] = columns
+
+    def pack(self, step, agents, packed):
+        # Appends a row per agent to packed. Agents of other types (the
+        # traffic lights) and hidden ones are left out; pedestrians have no
+        # direction
+        pack = PACK_ROW.pack
+        add = packed.append
+        for agent in agents:
+            cls = type(agent)
+            if cls is Car:
+                if agent.show:
+                    x, y = agent.pos
+                    direction = agent.direccion
+                    add(pack(step, agent.unique_id, 0, x, y, -1 if direction is None else direction, 0, 0))
+            elif cls is Bus:
+                if agent.show:
+                    x, y = agent.pos
+                    direction = agent.direccion
+                    add(pack(step, agent.unique_id, 1, x, y, -1 if direction is None else direction, 0,
+                             agent.passengers))
+            elif cls is Pedestrians:
+                if agent.show:
+                    x, y = agent.pos
+                    add(pack(step, agent.unique_id, 2, x, y, -1, 0, 0))
+
+    def record(self, model):
+        step = self.step = model.step_count
+        rows = self.rows
+        self.pack(step, model.dirty, rows)
+        if model.despawned:
+            pack = PACK_ROW.pack
+            for agent in model.despawned:
+                # Only the agent is read back from a despawn
+                rows.append(pack(step, agent.unique_id, KINDS[type(agent)], 0, 0, -1, 1, 0))
+        if model.signals.changed:
+            self.pending["lights"].append(PACK_LIGHTS.pack(step) + model.signals.colors.tobytes())
+        if model.bus_stops.changed == step:
+            stops = model.bus_stops
+            self.pending["steps"].append(PACK_STEP.pack(step, stops.boarded, stops.alighted, stops.waiting))
+        if step >= self.next_flush or len(rows) >= self.flush_rows:
+            if self.counts["rows"] + len(rows) - self.key_row >= self.keyframe_rows:
+                self.keyframe(model)
+            self.flush()
+
+    def keyframe(self, model):
+        # Only the visible agents get to pack(): once the trips end, most of
+        # the registries are hidden
+        self.pack(model.step_count, filter(SHOWN, chain(model.cars.values(), model.buses.values(),
+                                                        model.pedestrians.values())), self.pending["frames"])
+        self.key_row = self.counts["rows"] + len(self.rows)
+
+    def flush(self):
+        # The columns of every table first, then the record in flushes.bin
+        # that lets a reader see them
+        for table in TABLES:
+            packed = self.pending[table]
+            if not packed:
+                continue
+            batch = np.frombuffer(b"".join(packed), dtype=self.dtypes[table])
+            packed.clear()
+            start = self.counts[table]
+            end = start + len(batch)
+            size = len(self.columns[table]["step"])
+            if end > size:
+                self.grow(table, max(end, 2 * size))
+            for name, column in self.columns[table].items():
+                column[start:end] = batch[name]
+            self.counts[table] = end
+        os.write(self.flushes, PACK_FLUSH.pack(self.step, *(self.counts[table] for table in TABLES)))
+        self.next_flush = self.step + self.flush_every
+
+    def close(self):
+        if self.flushes is None:
+            return
+        self.flush()
+        os.close(self.flushes)
+        self.flushes = None
+        # A finished recording has no room left at the end of its columns
+        self.columns = {}
+        for table in TABLES:
+            for name, field in fields(self.dtypes[table]):
+                os.truncate(column_path(self.path, table, name), self.counts[table] * field.itemsize)
+
+
+class Recording:
+    # Read side of a Recorder folder, with the column files memory-mapped.
+    # Frames are rebuilt from the last keyframe plus the deltas after it,
+    # without a model.
+    def __init__(self, path):
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            raise FileNotFoundError(path)
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta["format"] != FORMAT:
+            raise ValueError("Recording format %r, this version reads %d" % (meta["format"], FORMAT))
+        self.first_step = meta["first_step"]
+        self.lights = meta["lights"]
+        self.dtypes = dtypes(len(self.lights))
+        self.capacity = meta["capacity"]
+        self.grid_size = tuple(meta["gridSize"])
+        self.size = None
+        self.refresh()
+
+    def columns(self, table, count):
+        # The first `count` rows of the columns of a table
+        columns = {}
+        for name, field in fields(self.dtypes[table]):
+            if count == 0:
+                columns[name] = np.zeros((0,) + field.shape, dtype=field.base)
+            else:
+                columns[name] = np.memmap(column_path(self.path, table, name), dtype=field.base, mode="r",
+                                          shape=(count,) + field.shape)
+        return columns
+
+    def refresh(self):
+        # Maps the files again if the recorder wrote more steps
+        path = os.path.join(self.path, "flushes.bin")
+        size = os.path.getsize(path) // FLUSH.itemsize
+        if size == self.size:
+            return
+        self.size = size
+        last = dict.fromkeys(FLUSH.names, 0)
+        last["step"] = self.first_step - 1
+        if size:
+            with open(path, "rb") as file:
+                file.seek((size - 1) * FLUSH.itemsize)
+                last = dict(zip(FLUSH.names, PACK_FLUSH.unpack(file.read(FLUSH.itemsize))))
+        self.last_step = last["step"]
+        self.rows = self.columns("rows", last["rows"])
+        self.key_rows = self.columns("frames", last["frames"])
+        self.states = self.columns("steps", last["steps"])
+        self.signals = self.columns("lights", last["lights"])
+
+    def rows_of(self, first, last):
+        # Delta rows of the steps first..last, both included
+        steps = self.rows["step"]
+        start = np.searchsorted(steps, first, side="left")
+        end = np.searchsorted(steps, last, side="right")
+        return {name: column[start:end] for name, column in self.rows.items()}
+
+    def frame(self, step):
+        # Snapshot of `step` in the format of MapModel.ubication(visible_only=True)
+        self.refresh()
+        if not self.first_step <= step <= self.last_step:
+            raise IndexError("Step %d not recorded (%d to %d)" % (step, self.first_step, self.last_step))
+        key_steps = self.key_rows["step"]
+        key_end = int(np.searchsorted(key_steps, step, side="right"))
+        # A keyframe without rows is skipped, the one before it replays more
+        key = int(key_steps[key_end - 1]) if key_end else self.first_step - 1
+        key_start = int(np.searchsorted(key_steps, key, side="left"))
+        later = self.rows_of(key + 1, step) if step > key else None
+        rows = {}
+        for name, column in self.key_rows.items():
+            rows[name] = column[key_start:key_end]
+            if later is not None:
+                rows[name] = np.concatenate((rows[name], later[name]))
+        # The last row of every agent wins. Agents are listed by id, the
+        # order of the registries: ids only grow and a pooled agent gets a
+        # new one
+        agent = rows["kind"].astype(np.int64) << 56 | rows["id"]
+        last = len(agent) - 1 - np.unique(agent[::-1], return_index=True)[1]
+        keep = last[rows["state"][last] == 0]
+        data = {"gridSize": self.grid_size, "step": step}
+        data.update(self.entries({name: column[keep] for name, column in rows.items()}))
+        state = self.state_of(step)
+        data["trafficlights"] = self.light_entries(self.colors(step))
+        data["ridership"] = dict(zip(RIDERSHIP, self.states["ridership"][state].tolist()))
+        data["ridership"]["riding"] = data["ridership"]["boarded"] - data["ridership"]["alighted"]
+        return data
+
+    def entries(self, rows):
+        lists = {name: [] for name in NAMES}
+        for unique_id, kind, x, y, direction, passengers in zip(rows["id"].tolist(), rows["kind"].tolist(),
+                                                                rows["x"].tolist(), rows["y"].tolist(),
+                                                                rows["direction"].tolist(),
+                                                                rows["passengers"].tolist()):
+            if kind == 2:
+                lists[NAMES[kind]].append({"id": unique_id, "x": x, "y": y})
+            else:
+                entry = {"direction": None if direction < 0 else direction, "id": unique_id, "x": x, "y": y}
+                if kind == 1:
+                    entry["passengers"] = passengers
+                    entry["capacity"] = self.capacity
+                lists[NAMES[kind]].append(entry)
+        return lists
+
+    def state_of(self, step):
+        # Row of steps in effect at `step`
+        return int(np.searchsorted(self.states["step"], step, side="right")) - 1
+
+    def colors(self, step):
+        # SignalController.colors at `step`: the last change up to it
+        return self.signals["colors"][int(np.searchsorted(self.signals["step"], step, side="right")) - 1]
+
+    def light_entries(self, colors, previous=None):
+        return [{"id": light["id"], "x": light["x"], "y": light["y"], "color": int(color)}
+                for i, (light, color) in enumerate(zip(self.lights, colors.tolist()))
+                if previous is None or previous[i] != color]
+
+    def delta(self, step):
+        # Same as MapModel.delta for `step`
+        self.refresh()
+        rows = self.rows_of(step, step)
+        despawned = rows["state"] == 1
+        data = {"step": step}
+        data.update(self.entries({name: column[~despawned] for name, column in rows.items()}))
+        previous = self.colors(step - 1) if step > self.first_step else None
+        data["trafficlights"] = self.light_entries(self.colors(step), previous)
+        data["despawned"] = {name: rows["id"][despawned & (rows["kind"] == kind)].tolist()
+                             for kind, name in enumerate(NAMES)}
+        return data
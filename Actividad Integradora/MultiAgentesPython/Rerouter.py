@@ -0,0 +1,181 @@
+import heapq
+from array import array
+import numpy as np
+from Terrain import PARKING
+
+# Steps a car waits blocked before it looks for a way around
+PATIENCE = 5
+# Cars that can look for a way around in a step, 0 turns rerouting off
+REPLANS = 16
+# Cells a search takes from its queue before giving up
+HORIZON = 256
+# Extra cost of a cell with an agent in it, about what it takes to clear
+JAM = 8
+
+
+class Rerouter:
+    # Detours for cars stuck behind a jam. Routes come from the next-hop
+    # tables of the Router, shared by every car with the same trip, so a car
+    # is not routed again from scratch: a search with the live costs of the
+    # street cells (agents in them, red lights) goes from where the car is
+    # to the first cell of its route past the blocked one, and only that
+    # part of the route changes. The way through the blocked cell is one of
+    # the paths searched, so the route only changes when going around is
+    # cheaper. It runs after the schedule in MapModel.step, so both engines
+    # see the same state, and at most `budget` cars a step search, taking
+    # turns by id.
+    def __init__(self, model, budget=REPLANS, patience=PATIENCE, horizon=HORIZON):
+        self.model = model
+        self.budget = budget
+        self.patience = patience
+        self.horizon = horizon
+        # Last car id that searched, the next step starts after it
+        self.last = -1
+        self.successors = {}
+        self.version = None
+
+    def step(self, blocked):
+        # `blocked` is stuck_cars of the step. It comes back without the cars
+        # that got a detour, they are not stuck anymore.
+        candidates = [entry for entry in blocked if entry[2] >= self.patience]
+        if not candidates:
+            return blocked
+        # Taking turns by id, from the one after the last that searched
+        start = 0
+        while start < len(candidates) and candidates[start][0] <= self.last:
+            start += 1
+        chosen = (candidates[start:] + candidates[:start])[:self.budget]
+        self.last = chosen[-1][0]
+        rerouted = set()
+        for unique_id, car, steps in chosen:
+            position, route = remaining(self.model, car)
+            detour = self.detour(position, route, steps)
+            if detour is not None:
+                set_route(self.model, car, detour)
+                rerouted.add(unique_id)
+                if self.model.metrics:
+                    self.model.metrics.count("detours")
+        if not rerouted:
+            return blocked
+        return [entry for entry in blocked if entry[0] not in rerouted]
+
+    def get_successors(self, index):
+        router = self.model.router
+        if self.version != router.version:
+            self.successors = {}
+            self.version = router.version
+        successors = self.successors.get(index)
+        if successors is None:
+            terrain = self.model.terrain
+            successors = tuple(terrain.index(step) for step in router.get_successors(terrain.cell(index)))
+            self.successors[index] = successors
+        return successors
+
+    def cost(self, index):
+        # Steps to go through a cell as it is now
+        terrain = self.model.terrain
+        occupancy = self.model.occupancy
+        pos = terrain.cell(index)
+        cost = 1
+        if occupancy.pedestrians[pos] or occupancy.buses[pos]:
+            cost += JAM
+        elif occupancy.cars[pos] and not terrain.kind[pos] & PARKING:
+            cost += JAM
+        light = terrain.light[pos]
+        if light >= 0 and self.model.signals.colors[light] != 0:
+            step = self.model.step_count
+            wake = self.model.signals.next_green(self.model.traffic_lights[light], step)
+            cost += self.model.signals.cycle if wake is None else wake - step
+        return cost
+
+    def detour(self, position, route, blocked):
+        # New route from `position`, which it starts with, or None when going
+        # through route[0], the blocked cell, is still the cheapest. The car
+        # already waited `blocked` steps there, that is added to its cost;
+        # with inf that way is left out.
+        rejoin = {}
+        for i in range(1, len(route)):
+            rejoin.setdefault(route[i], i)
+        rejoin.pop(position, None)
+        ahead = route[0]
+        best = {position: 0}
+        previous = {}
+        queue = [(0, position)]
+        taken = 0
+        found = None
+        while queue and taken < self.horizon:
+            cost, index = heapq.heappop(queue)
+            if cost > best[index]:
+                continue
+            if index in rejoin:
+                found = index
+                break
+            taken += 1
+            for successor in self.get_successors(index):
+                step = self.cost(successor)
+                if successor == ahead and index == position:
+                    step += blocked
+                total = cost + step
+                if total < best.get(successor, total + 1):
+                    best[successor] = total
+                    previous[successor] = index
+                    heapq.heappush(queue, (total, successor))
+        if self.model.metrics:
+            self.model.metrics.count("bfs_nodes", taken)
+        if found is None:
+            return None
+        path = [found]
+        while path[-1] != position:
+            path.append(previous[path[-1]])
+        path.reverse()
+        if path[1] == ahead:
+            return None
+        return array("i", path) + array("i", route[rejoin[found] + 1:])
+
+
+# The cars of both engines seen the same way. A car of the CarEngine is its
+# index in the arrays of the engine.
+
+def stuck_cars(model, least=1):
+    # (id, car, steps blocked) of the cars whose last `least` or more tries
+    # to move failed, by id
+    engine = model.car_engine
+    if engine:
+        if engine.built != len(engine.agents):
+            engine.build()
+        stuck = np.flatnonzero(engine.show & (engine.cursor != engine.end) & (engine.wait >= least))
+        return sorted(zip(engine.ids[stuck].tolist(), stuck.tolist(), engine.wait[stuck].tolist()))
+    step = model.step_count
+    result = []
+    for car in model.blocked_cars:
+        if not car.show or car.cursor >= len(car.route):
+            continue
+        # A sleeping car counts the steps since it went to sleep
+        blocked = car.wait if car.slept is None else car.wait + step - car.slept
+        if blocked >= least:
+            result.append((car.unique_id, car, blocked))
+    result.sort(key=lambda entry: entry[0])
+    return result
+
+
+def remaining(model, car):
+    # Where the car is and the rest of its route, from the next cell, as
+    # Terrain.index values
+    if model.car_engine:
+        return model.car_engine.remaining(car)
+    return model.terrain.index(car.pos), car.route[car.cursor:]
+
+
+def set_route(model, car, route):
+    # A new route starting where the car is. It gets its own `patience`
+    # steps before it counts as stuck again.
+    if model.car_engine:
+        model.car_engine.set_route(car, route)
+        return
+    car.route = route
+    car.cursor = 1
+    car.wait = 0
+    model.blocked_cars.discard(car)
+    car.slept = None
+    # It slept on the old next cell or light
+    model.schedule.awaken(car)
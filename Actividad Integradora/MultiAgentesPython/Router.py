@@ -0,0 +1,139 @@
+from array import array
+from collections import deque
+import numpy as np
+from Terrain import ROAD, PARKING
+
+
+class Router:
+    # Next-hop tables for cars: one table per parking lot, built once per road
+    # network and shared by every car of the model.
+    def __init__(self, model, destinations):
+        self.model = model
+        self.destinations = list(destinations)
+        self.version = 0
+        self.built_version = -1
+        self.successors = {}
+        self.next_hop = None
+        self.rows = {}
+        self.routes = {}
+
+    def invalidate(self):
+        # The map changed, the tables are rebuilt on the next lookup
+        self.version += 1
+
+    def is_road(self, cell):
+        return self.model.terrain.contains(cell) and self.model.terrain.has(cell, ROAD)
+
+    def get_successors(self, pos):
+        terrain = self.model.terrain
+        curr_street_dir = terrain.direction[pos]
+        parking = terrain.has(pos, PARKING)
+        x, y = pos
+        possible_steps = []
+        # 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda | 4 = any
+        if parking or curr_street_dir == 4:
+            possible_steps.append((x, y+1))
+            possible_steps.append((x, y-1))
+            possible_steps.append((x+1, y))
+            possible_steps.append((x-1, y))
+        elif curr_street_dir == 0:
+            possible_steps.append((x, y+1))
+            possible_steps.append((x+1, y))
+            possible_steps.append((x-1, y))
+        elif curr_street_dir == 1:
+            possible_steps.append((x, y-1))
+            possible_steps.append((x+1, y))
+            possible_steps.append((x-1, y))
+        elif curr_street_dir == 2:
+            possible_steps.append((x+1, y))
+            possible_steps.append((x, y-1))
+            possible_steps.append((x, y+1))
+        else:
+            possible_steps.append((x-1, y))
+            possible_steps.append((x, y-1))
+            possible_steps.append((x, y+1))
+
+        return tuple(step for step in possible_steps if self.is_road(step))
+
+    def build(self):
+        terrain = self.model.terrain
+        self.successors = {}
+        predecessors = {}
+        for x, y in zip(*(terrain.kind & ROAD).nonzero()):
+            cell = (int(x), int(y))
+            self.successors[cell] = self.get_successors(cell)
+            predecessors[cell] = []
+        for cell, steps in self.successors.items():
+            for step in steps:
+                predecessors[step].append(cell)
+
+        # Reverse BFS from every destination, the next hop of a cell is its
+        # first successor that is one step closer to the destination. One row
+        # per destination, indexed by Terrain.index: -1 = can't get there
+        next_hop = np.full((len(self.destinations), terrain.width * terrain.height), -1, dtype=np.int32)
+        nodes = 0
+        for row, dest in enumerate(self.destinations):
+            dist = {dest: 0}
+            q = deque([dest])
+            while q:
+                cell = q.popleft()
+                nodes += 1
+                for prev in predecessors.get(cell, ()):
+                    if prev not in dist:
+                        dist[prev] = dist[cell] + 1
+                        q.append(prev)
+            table = next_hop[row]
+            table[terrain.index(dest)] = terrain.index(dest)
+            for cell, d in dist.items():
+                if d == 0:
+                    continue
+                for step in self.successors[cell]:
+                    if dist.get(step) == d - 1:
+                        table[terrain.index(cell)] = terrain.index(step)
+                        break
+        # The model of a CityMap being compiled has no metrics
+        metrics = getattr(self.model, "metrics", None)
+        if metrics:
+            metrics.count("bfs_nodes", nodes)
+        self.load(next_hop)
+
+    def load(self, next_hop, routes=None):
+        # Tables built before, like the ones of a compiled CityMap, and the
+        # routes already read from them
+        self.next_hop = next_hop
+        self.rows = {dest: row for row, dest in enumerate(self.destinations)}
+        self.routes = {} if routes is None else routes
+        self.built_version = self.version
+
+    def table(self, destiny):
+        if self.built_version != self.version:
+            self.build()
+        row = self.rows.get(destiny)
+        return None if row is None else self.next_hop[row]
+
+    def reachable(self, origin, destiny):
+        table = self.table(destiny)
+        if origin == destiny:
+            return True
+        return table is not None and table[self.model.terrain.index(origin)] >= 0
+
+    def get_route(self, origin, destiny):
+        # Cells from origin to destiny, both included, as Terrain.index
+        # values. Every car with the same trip gets the same array, so it
+        # must not be modified.
+        table = self.table(destiny)
+        key = (origin, destiny)
+        route = self.routes.get(key)
+        if route is None:
+            terrain = self.model.terrain
+            cell, end = terrain.index(origin), terrain.index(destiny)
+            if table is None or (cell != end and table[cell] < 0):
+                # Same fallback as the old per-car BFS: only the destination
+                route = array("i", [end])
+            else:
+                route = array("i", [cell])
+                while cell != end:
+                    cell = int(table[cell])
+                    route.append(cell)
+            self.routes[key] = route
+        return route
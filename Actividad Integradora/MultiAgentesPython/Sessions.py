@@ -0,0 +1,296 @@
+import multiprocessing
+import os
+import time
+import uuid
+from threading import Lock
+from Stepper import Stepper, LOOKAHEAD
+
+MAX_SESSIONS = 32
+# Seconds without requests before a session is dropped
+IDLE_TIMEOUT = 600
+
+
+class SessionError(Exception):
+    pass
+
+
+class SessionLimitError(SessionError):
+    pass
+
+
+class UnknownSessionError(SessionError):
+    pass
+
+
+class WorkerLostError(SessionError):
+    # The worker process of a session exited, its sessions are gone with it
+    pass
+
+
+class SessionWorker:
+    # Runs inside a worker process and owns the models of its sessions.
+    # Requests come through a pipe as (command, session, args); between
+    # requests the worker steps its sessions ahead into their frame rings.
+    def __init__(self, conn, metrics=False):
+        self.conn = conn
+        self.steppers = {}
+        # Passed on to the models; the totals of closed sessions are kept
+        # so the counters of /metrics never go down
+        self.metrics = metrics
+        self.closed = None
+
+    def run(self):
+        # The model code and the city every model of this worker shares, ready
+        # before the first init
+        import ModeloV1
+        from CityMap import CityMap
+        CityMap.template()
+        while True:
+            if not self.conn.poll(0) and self.step_ahead():
+                continue
+            try:
+                command, session, args = self.conn.recv()
+            except EOFError:
+                return
+            try:
+                result = getattr(self, "handle_" + command)(session, *args)
+                self.conn.send((True, result))
+            except Exception as e:
+                self.conn.send((False, e))
+
+    def step_ahead(self):
+        # Advance the session that is furthest behind its lookahead
+        waiting = [stepper for stepper in self.steppers.values() if stepper.has_room()]
+        if not waiting:
+            return False
+        min(waiting, key=lambda stepper: stepper.newest - stepper.consumed).advance()
+        return True
+
+    def stepper(self, session):
+        if session not in self.steppers:
+            raise UnknownSessionError(session)
+        return self.steppers[session]
+
+    def handle_init(self, session, width, height, cars, buses, pedestrians, lookahead=LOOKAHEAD, engine="agents",
+                    demand=0.0, record=None, binary=False, gridlock="yield"):
+        from ModeloV1 import MapModel
+        from Demand import Demand
+        model = MapModel(width, height, cars, buses, pedestrians, engine=engine,
+                         demand=Demand(demand, demand) if demand else None, metrics=self.metrics,
+                         gridlock=gridlock)
+        if record:
+            # Every step the session computes goes to recordings/<record>
+            from Recorder import Recorder, RECORDINGS
+            model.recorder = Recorder(os.path.join(RECORDINGS, record), model)
+        # A binary client gets its frames packed as they are computed
+        self.steppers[session] = Stepper(model, lookahead, binary=binary)
+        if binary:
+            import Wire
+            return Wire.pack(model)
+        return model.ubication(visible_only=True)
+
+    def handle_restore(self, session, data, lookahead=LOOKAHEAD):
+        import Checkpoint
+        model = Checkpoint.load(data, metrics=self.metrics)
+        self.steppers[session] = Stepper(model, lookahead)
+        return model.ubication(visible_only=True)
+
+    def handle_checkpoint(self, session):
+        # The model is ahead of the client by up to lookahead steps, the
+        # checkpoint is of the newest step computed
+        import Checkpoint
+        model = self.stepper(session).model
+        return model.step_count, Checkpoint.save(model)
+
+    def handle_close(self, session):
+        stepper = self.steppers.pop(session, None)
+        if stepper and stepper.model.recorder:
+            stepper.model.recorder.close()
+        if stepper and stepper.model.metrics:
+            from Metrics import Metrics
+            if self.closed is None:
+                self.closed = Metrics()
+            self.closed.add(stepper.model.metrics)
+
+    def handle_metrics(self, session):
+        # Totals of every session this worker had
+        from Metrics import total
+        models = [stepper.model.metrics for stepper in self.steppers.values() if stepper.model.metrics]
+        return total(models + ([self.closed] if self.closed else []))
+
+    def handle_gridlocks(self, session):
+        # Latest gridlocks found, oldest first
+        return list(self.stepper(session).model.gridlock.events)
+
+    def handle_data(self, session, step=0, binary=False):
+        step, snapshot, delta, packed = self.stepper(session).frame(step)
+        if binary:
+            # Sessions opened for JSON clients pack it from the snapshot
+            import Wire
+            return packed if packed is not None else Wire.pack_snapshot(snapshot)
+        return snapshot
+
+    def handle_frame(self, session, step, keyframe):
+        step, snapshot, delta, packed = self.stepper(session).frame(step)
+        return snapshot if keyframe else delta
+
+
+def worker_main(conn, metrics=False):
+    SessionWorker(conn, metrics).run()
+
+
+class WorkerHandle:
+    # Parent side of a worker process, one request at a time
+    def __init__(self, context, metrics=False):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child, metrics), daemon=True)
+        self.process.start()
+        child.close()
+        self.lock = Lock()
+        self.sessions = 0
+        self.alive = True
+
+    def request(self, command, session, *args):
+        with self.lock:
+            if not self.alive:
+                raise WorkerLostError("Worker %d exited" % self.process.pid)
+            try:
+                self.conn.send((command, session, args))
+                ok, result = self.conn.recv()
+            except (EOFError, OSError) as e:
+                self.alive = False
+                self.conn.close()
+                raise WorkerLostError("Worker %d exited" % self.process.pid) from e
+        if not ok:
+            raise result
+        return result
+
+
+class Session:
+    def __init__(self, session_id, worker):
+        self.id = session_id
+        self.worker = worker
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    # Keeps one isolated MapModel per session. The models live in a pool of
+    # worker processes so sessions on different workers step in parallel.
+    def __init__(self, workers=None, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT, metrics=False):
+        self.number_workers = workers or os.cpu_count() or 1
+        # Models time their phases, see Metrics
+        self.metrics = metrics
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.sessions = {}
+        self.lock = Lock()
+
+    def start_workers(self):
+        # Also replaces the workers dropped by drop_worker
+        while len(self.workers) < self.number_workers:
+            self.workers.append(WorkerHandle(self.context, self.metrics))
+
+    def drop_worker(self, worker):
+        # A worker that exited leaves the pool with its sessions
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            for session in [session for session in self.sessions.values() if session.worker is worker]:
+                del self.sessions[session.id]
+            worker.sessions = 0
+
+    def request(self, worker, command, session_id, *args):
+        try:
+            return worker.request(command, session_id, *args)
+        except WorkerLostError:
+            self.drop_worker(worker)
+            raise
+
+    def create(self, *model_args):
+        return self.open("init", *model_args)
+
+    def restore(self, data, lookahead=LOOKAHEAD):
+        # New session from a checkpoint, it may come from another worker
+        return self.open("restore", data, lookahead)
+
+    def fork(self, session_id, lookahead=LOOKAHEAD):
+        step, data = self.call(session_id, "checkpoint")
+        return self.restore(data, lookahead)
+
+    def open(self, command, *args):
+        self.evict_idle()
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionLimitError("Too many sessions (%d)" % self.max_sessions)
+            self.start_workers()
+            worker = min(self.workers, key=lambda w: w.sessions)
+            session = Session(uuid.uuid4().hex, worker)
+            worker.sessions += 1
+            self.sessions[session.id] = session
+        try:
+            data = self.request(worker, command, session.id, *args)
+        except WorkerLostError:
+            raise
+        except Exception:
+            self.close(session.id)
+            raise
+        return session.id, data
+
+    def get(self, session_id):
+        self.evict_idle()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise UnknownSessionError(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def call(self, session_id, command, *args):
+        session = self.get(session_id)
+        return self.request(session.worker, command, session.id, *args)
+
+    def close(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return False
+            session.worker.sessions -= 1
+        self.end(session)
+        return True
+
+    def end(self, session):
+        # Closes the model of a session already out of self.sessions; a
+        # worker that is gone has nothing to close
+        if not session.worker.alive:
+            return
+        try:
+            self.request(session.worker, "close", session.id)
+        except WorkerLostError:
+            pass
+
+    def collect_metrics(self):
+        # One Metrics with the totals of all the workers
+        from Metrics import total
+        with self.lock:
+            workers = list(self.workers)
+        totals = []
+        for worker in workers:
+            # The totals of a worker that exited are lost with it
+            try:
+                totals.append(self.request(worker, "metrics", None))
+            except WorkerLostError:
+                pass
+        return total(totals)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            idle = [session for session in self.sessions.values()
+                    if now - session.last_used > self.idle_timeout]
+            for session in idle:
+                del self.sessions[session.id]
+                session.worker.sessions -= 1
+        for session in idle:
+            self.end(session)
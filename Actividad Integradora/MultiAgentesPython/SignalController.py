@@ -0,0 +1,100 @@
+import heapq
+import numpy as np
+
+# Steps of a full signal cycle
+CYCLE = 31
+# Phase plans: (first step of the phase in the cycle, color)
+# 0 = verde | 1 = amarillo | 2 = Rojo
+PLAN_MAIN = ((0, 0), (11, 1), (15, 2))
+PLAN_CROSS = ((0, 2), (15, 0), (26, 1))
+
+
+class SignalGroup:
+    # Lights of one intersection that always show the same color
+    def __init__(self, name, lights, plan, offset=0):
+        self.name = name
+        self.lights = list(lights)
+        self.plan = tuple(sorted(plan))
+        self.offset = offset
+
+    def color_at(self, step, cycle=CYCLE):
+        phase = (step + self.offset) % cycle
+        color = self.plan[-1][1]
+        for start, phase_color in self.plan:
+            if start <= phase:
+                color = phase_color
+        return color
+
+    def next_color(self, step, color, cycle=CYCLE):
+        # First step after `step` that shows `color`, None if it never does
+        for later in range(step + 1, step + cycle + 1):
+            if self.color_at(later, cycle) == color:
+                return later
+        return None
+
+    def next_change(self, step, cycle=CYCLE):
+        # First step after `step` where a phase starts
+        phase = (step + self.offset) % cycle
+        waits = [(start - phase) % cycle or cycle for start, color in self.plan]
+        return step + min(waits)
+
+
+class SignalController:
+    # Switches the traffic lights from the phase plans of their groups. Only
+    # the groups with a phase starting in the current step are visited; the
+    # lights that changed are kept in `changed` until the next step and their
+    # colors in `colors`, indexed like MapModel.traffic_lights.
+    def __init__(self, model, cycle=CYCLE):
+        self.model = model
+        self.cycle = cycle
+        self.groups = {}
+        self.events = []
+        self.changed = []
+        self.index = {}
+        self.group_of = {}
+        # The extra red at the end is what light -1 (no traffic light) reads
+        self.colors = np.full(1, 2, dtype=np.int8)
+
+    def add_group(self, name, lights, plan, offset=0):
+        group = SignalGroup(name, lights, plan, offset)
+        self.groups[name] = group
+        for light in group.lights:
+            self.index[light] = int(self.model.terrain.light[light.pos])
+            self.group_of[light] = group
+        self.colors = np.full(len(self.model.traffic_lights) + 1, 2, dtype=np.int8)
+        for light, i in self.index.items():
+            self.colors[i] = light.color
+        # The first step puts every group in its phase
+        heapq.heappush(self.events, (self.model.step_count + 1, name))
+        return group
+
+    def next_green(self, light, step):
+        return self.group_of[light].next_color(step, 0, self.cycle)
+
+    def step(self, step):
+        self.changed = []
+        while self.events and self.events[0][0] <= step:
+            when, name = heapq.heappop(self.events)
+            group = self.groups[name]
+            color = group.color_at(step, self.cycle)
+            for light in group.lights:
+                if light.color != color:
+                    light.color = color
+                    self.colors[self.index[light]] = color
+                    self.changed.append(light)
+                    self.model.mark_dirty(light)
+            heapq.heappush(self.events, (group.next_change(step, self.cycle), name))
+
+    def checkpoint(self):
+        names = list(self.groups)
+        return {"colors": np.array([light.color for light in self.model.traffic_lights], dtype=np.int8),
+                "events": np.array([(when, names.index(name)) for when, name in self.events],
+                                   dtype=np.int64).reshape(-1, 2)}
+
+    def restore(self, state):
+        names = list(self.groups)
+        for light, color in zip(self.model.traffic_lights, state["colors"]):
+            light.color = int(color)
+            self.colors[self.index[light]] = light.color
+        self.events = [(int(when), names[group]) for when, group in state["events"]]
+        self.changed = []
@@ -0,0 +1,64 @@
+from collections import deque
+import Wire
+
+# Steps computed ahead of the last frame a client asked for
+LOOKAHEAD = 8
+# Most lookahead a client can ask for
+MAX_LOOKAHEAD = 256
+# Frames kept after they were delivered, a client can ask for them again
+HISTORY = 8
+
+
+class FrameExpiredError(Exception):
+    pass
+
+
+class FrameAheadError(Exception):
+    pass
+
+
+class Stepper:
+    # Steps a model ahead of its client into a ring of frames. Every frame
+    # keeps the snapshot and the delta of one step, so /data and /stream are
+    # served from the ring instead of waiting for MapModel.step. With binary
+    # it also keeps the snapshot packed by Wire.pack.
+    def __init__(self, model, lookahead=LOOKAHEAD, history=HISTORY, binary=False):
+        self.model = model
+        self.binary = binary
+        self.lookahead = lookahead
+        self.frames = deque(maxlen=lookahead + history + 1)
+        self.consumed = model.step_count
+        self.frames.append(self.make_frame())
+
+    def make_frame(self):
+        return (self.model.step_count, self.model.ubication(visible_only=True), self.model.delta(),
+                Wire.pack(self.model) if self.binary else None)
+
+    @property
+    def newest(self):
+        return self.frames[-1][0]
+
+    def has_room(self):
+        # Backpressure: stop stepping when the client is lookahead steps behind
+        return self.newest - self.consumed < self.lookahead
+
+    def advance(self):
+        self.model.step()
+        self.frames.append(self.make_frame())
+
+    def frame(self, step=0):
+        # step 0 = the frame after the last one delivered
+        if step == 0:
+            step = self.consumed + 1
+        # Stepping is synchronous and blocks the worker, only as far as the
+        # lookahead would have gone (the next frame always can be)
+        if step > max(self.newest + self.lookahead, self.consumed + 1):
+            raise FrameAheadError("Step %d is more than %d steps past the newest, %d"
+                                  % (step, self.lookahead, self.newest))
+        while self.newest < step:
+            self.advance()
+        oldest = self.frames[0][0]
+        if step < oldest:
+            raise FrameExpiredError("Step %d is no longer buffered (oldest %d)" % (step, oldest))
+        self.consumed = max(self.consumed, step)
+        return self.frames[step - oldest]
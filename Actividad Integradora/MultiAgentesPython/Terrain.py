@@ -0,0 +1,57 @@
+import numpy as np
+
+# Bits of Terrain.kind, a cell can have more than one (a street with a crosswalk)
+BUILDING = 1
+PARKING = 2
+SIDEWALK = 4
+STREET = 8
+CROSSWALK = 16
+STREETBUS = 32
+BUSSTOP = 64
+
+ROAD = STREET | PARKING | CROSSWALK
+WALKABLE = SIDEWALK | CROSSWALK
+
+
+class Terrain:
+    # Static layer of the city. The map never moves, so instead of one agent
+    # per cell it is kept in arrays indexed by [x, y]; only the mobile agents
+    # live in the MultiGrid. The arrays may be the read-only ones of a
+    # CityMap shared with other models; writable() copies one before the
+    # first change.
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.kind = np.zeros((width, height), dtype=np.uint8)
+        # 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda | 4 = any | -1 = none
+        self.direction = np.full((width, height), -1, dtype=np.int8)
+        self.bus_direction = np.full((width, height), -1, dtype=np.int8)
+        # Index in MapModel.traffic_lights, -1 = no traffic light
+        self.light = np.full((width, height), -1, dtype=np.int16)
+
+    def contains(self, pos):
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    # Routes keep cells as one int, x * height + y
+    def index(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def cell(self, index):
+        return divmod(index, self.height)
+
+    def has(self, pos, mask):
+        return bool(self.kind[pos] & mask)
+
+    def writable(self, name):
+        array = getattr(self, name)
+        if not array.flags.writeable:
+            array = np.array(array)
+            setattr(self, name, array)
+        return array
+
+    def add(self, pos, mask):
+        self.writable("kind")[pos] |= mask
+
+    def clear(self, pos, mask):
+        self.writable("kind")[pos] &= ~mask & 0xFF
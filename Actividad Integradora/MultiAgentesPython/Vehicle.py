@@ -1,13 +1,7 @@
 from mesa import Agent 
 from abc import abstractmethod
-from queue import Queue
-from Parking import Parking
-from Street import Street
-from TrafficLight import TrafficLight
-import Car
-import Parking
-from Crosswalk import Crosswalk
-from Pedestrians import Pedestrians
+from Terrain import STREET
+from Occupancy import CAR
 
 class Vehicle(Agent):
     def __init__(self, unique_id, model, position, destiny) -> None:
@@ -16,13 +10,13 @@ class Vehicle(Agent):
         self.position = position
         self.destiny = destiny
         self.direccion = None
-        self.path = Queue() 
+        # Shared route from the Router and the index of the next cell in it
+        self.route = ()
+        self.cursor = 0
         self.wait = 0
+        # Step when the car went to sleep blocked, see doze
+        self.slept = None
     
-    @abstractmethod
-    def prune_neighbors(self, possible_steps):
-        ...
-
     @classmethod
     def get_direction(self, prev_pos, new_pos):
         #print(f"{prev_pos=}")
@@ -50,135 +44,69 @@ class Vehicle(Agent):
         possible_steps.append((x, y-1))
         possible_steps.append((x+1, y))    
         possible_steps.append((x-1, y))
+        terrain = self.model.terrain
         for step in possible_steps:
-            cell = self.model.grid.get_cell_list_contents(step)
-            for value in cell:
-                if type(value) is Street:
-                    # print(f"{self.get_direction(position, step)}")
-                    return self.get_direction(position, step)
+            if terrain.contains(step) and terrain.has(step, STREET):
+                return self.get_direction(position, step)
                 
                 
                 
-    def get_neighbors(self, pos):
-        curr_cel = self.model.grid.get_cell_list_contents(pos)
-        curr_street_dir = None
-        parking = False
-        for elem in curr_cel:
-            if type(elem) is Street:
-                curr_street_dir = elem.direccion
-            if type(elem) is Parking.Parking:
-                parking = True
-        x,y = pos
-        possible_steps = []        
-        # 0 = arriba | 1 = abajo | 2 = derecha | 3 = izquierda
-        if parking or curr_street_dir == 4:
-            #print("adentro del if")
-            possible_steps.append((x, y+1))    
-            possible_steps.append((x, y-1))
-            possible_steps.append((x+1, y))    
-            possible_steps.append((x-1, y))
-        elif curr_street_dir == 0:
-            possible_steps.append((x, y+1))    
-            possible_steps.append((x+1, y))    
-            possible_steps.append((x-1, y))    
-        elif curr_street_dir == 1:
-            possible_steps.append((x, y-1))    
-            possible_steps.append((x+1, y))    
-            possible_steps.append((x-1, y))    
-        elif curr_street_dir == 2:
-            possible_steps.append((x+1, y))    
-            possible_steps.append((x, y-1))    
-            possible_steps.append((x, y+1))    
-        else:
-            possible_steps.append((x-1, y))    
-            possible_steps.append((x, y-1))    
-            possible_steps.append((x, y+1))    
-  
-            
-        #print(f"get_neigh {possible_steps=}")
-
-        return self.prune_neighbors(possible_steps)
-
-    def restore_path(self, path) -> None:
-        x, y = self.destiny
-        restored_path = [(x, y)]
-
-        while path[x][y] != (-1, -1):
-            x, y = path[x][y]
-            restored_path.append((x, y))
-
-        path_steps = restored_path[::-1]
-        #print(f"{path_steps=}")
-        for step in path_steps:
-            self.path.put(step)
-
-    
     def move(self) -> None:
-        wait = 0
-        if not self.path.empty():
-            if self.position == self.path.queue[0]:
-                self.path.get()
-            new_position = self.path.queue[0]
+        if self.slept is not None:
+            self.wait += self.model.step_count - self.slept - 1
+            self.slept = None
+        terrain = self.model.terrain
+        if self.cursor == 0 and self.route and terrain.index(self.position) == self.route[0]:
+            self.cursor += 1
+        # A route of one cell ends where the car is, like the CarEngine it
+        # arrives
+        if self.cursor < len(self.route):
+            cursor = self.cursor
+            new_position = terrain.cell(self.route[cursor])
             #print(f"{new_position}")
-            # print(f"{self.path.queue[1]}")
-            next_cell = self.model.grid.get_cell_list_contents(new_position)
-            #print(f"{next_cell}")
-            trafficLight = None
-            carNext = None
-            parkingNext = None
-            crosswalk = None
-            pedestrians = None
-            for elem in next_cell:
-                if type(elem) is TrafficLight:
-                    trafficLight = elem
-                if type(elem) is Parking.Parking:
-                    parkingNext = elem
-                if type(elem) is Car.Car:
-                    carNext = elem
-                if type(elem) is Crosswalk:
-                    crosswalk = elem
-                if type(elem) is Street:
-                    self.direccion = self.get_direction(self.position, new_position)
-                if type(elem) is Pedestrians:
-                    pedestrians = elem
+            kind = terrain.kind[new_position]
+            light = terrain.light[new_position]
+            trafficLight = self.model.traffic_lights[light] if light >= 0 else None
+            if kind & STREET:
+                direccion = self.get_direction(self.position, new_position)
+                if direccion != self.direccion:
+                    self.direccion = direccion
+                    self.model.mark_dirty(self)
+            metrics = self.model.metrics
+            if metrics:
+                metrics.count("cell_lookups")
 
+            # 0 = verde | 1 = amarillo | 2 = Rojo
+            red = trafficLight is not None and trafficLight.color != 0
+            if not red and not self.model.occupancy.vehicle_blocked(CAR, new_position, self.model.step_count):
+                self.model.move_agent(self, new_position)
+                self.cursor += 1
+            if self.cursor == cursor:
+                if metrics:
+                    metrics.count("blocked_moves")
+                self.wait += 1
+                self.model.blocked_cars.add(self)
+                self.doze(trafficLight if red else None, new_position)
+            elif self.wait:
+                self.wait = 0
+                self.model.blocked_cars.discard(self)
+        elif self.show:
+            self.model.despawn(self)
 
-            if trafficLight:
-                # 0 = verde | 1 = amarillo | 2 = Rojo
-                #print(f"{trafficLight.color=}")
-                if trafficLight.color == 0:
-                    self.model.grid.move_agent(self, new_position)
-                    self.path.get()
-            elif carNext is None and pedestrians is None:
-                self.model.grid.move_agent(self, new_position)
-                self.path.get()
-            elif carNext and parkingNext:
-                self.model.grid.move_agent(self, new_position)
-                self.path.get()
-            elif crosswalk:
-                ...
+    def doze(self, trafficLight, new_position):
+        # A blocked car does nothing until its red light turns green or
+        # someone leaves the cell ahead, so it sleeps until then
+        if trafficLight:
+            wake = self.model.signals.next_green(trafficLight, self.model.step_count)
+            if wake is None:
+                return
+            self.model.schedule.sleep(self, wake)
         else:
-            self.show = False
+            self.model.schedule.wait_for(self, new_position)
+        self.slept = self.model.step_count
 
     def get_path(self) -> None:
-        width = self.model.grid.width
-        heigth = self.model.grid.height
-        visited = [[False for _ in range(heigth)] for _ in range(width)]
-        path = [[(-1,-1) for _ in range(heigth)] for _ in range(width)]
-        q = Queue()
-        q.put(self.position)
-        x,y = self.position
-        visited[x][y] = True
-        while not q.empty():
-            x, y= q.get()
-            possible_steps = self.get_neighbors((x, y))
-            #print(f"{x=}, {y=}, {possible_steps=}")
-            for to_x, to_y in possible_steps:
-                if not visited[to_x][to_y]:
-                    path[to_x][to_y] = (x,y)
-                    visited[to_x][to_y] = True
-                    q.put((to_x, to_y))
-
-        self.restore_path(path)
+        self.route = self.model.router.get_route(self.position, self.destiny)
+        self.cursor = 0
 
     
\ No newline at end of file
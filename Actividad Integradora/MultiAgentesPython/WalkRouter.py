@@ -0,0 +1,182 @@
+from array import array
+from collections import deque
+import numpy as np
+from Terrain import SIDEWALK, CROSSWALK, WALKABLE
+
+
+class WalkRouter:
+    # Navigation graph for pedestrians. Connected sidewalk cells form a
+    # segment (node) and connected crosswalk cells a crossing (edge) between
+    # the segments it touches, with the traffic lights that govern it.
+    # Pedestrians only start and end at a few entrances, so the BFS runs once
+    # per origin and every path is read from its tree.
+    def __init__(self, model, entrances):
+        self.model = model
+        self.entrances = list(entrances)
+        self.version = 0
+        self.built_version = -1
+        self.segment = None
+        self.crossing = None
+        self.crossings = []
+        self.links = {}
+        self.trees = {}
+        self.routes = {}
+
+    def invalidate(self):
+        # The sidewalks changed, the graph is rebuilt on the next lookup
+        self.version += 1
+
+    def get_neighbors(self, pos):
+        terrain = self.model.terrain
+        x, y = pos
+        # Same order as the old Pedestrians.get_neighbors, so the BFS picks
+        # the same path among the ones of equal length
+        possible_steps = ((x, y+1), (x, y-1), (x+1, y), (x-1, y))
+        return tuple(step for step in possible_steps
+                     if terrain.contains(step) and terrain.has(step, WALKABLE))
+
+    def label(self, mask):
+        # Connected components of the cells that are only `mask` walkable
+        terrain = self.model.terrain
+        walkable = terrain.kind & WALKABLE
+        labels = np.full(terrain.kind.shape, -1, dtype=np.int16)
+        count = 0
+        nodes = 0
+        for x, y in zip(*(walkable == mask).nonzero()):
+            start = (int(x), int(y))
+            if labels[start] >= 0:
+                continue
+            labels[start] = count
+            q = deque([start])
+            while q:
+                cell = q.popleft()
+                nodes += 1
+                for step in self.get_neighbors(cell):
+                    if labels[step] < 0 and walkable[step] == mask:
+                        labels[step] = count
+                        q.append(step)
+            count += 1
+        self.count_nodes(nodes)
+        return labels, count
+
+    def count_nodes(self, nodes):
+        # The model of a CityMap being compiled has no metrics
+        metrics = getattr(self.model, "metrics", None)
+        if metrics:
+            metrics.count("bfs_nodes", nodes)
+
+    def build(self):
+        segment, segments = self.label(SIDEWALK)
+        crossing, crossings = self.label(CROSSWALK)
+        found = [{"lights": set(), "segments": set()} for i in range(crossings)]
+        light = self.model.terrain.light
+        for x, y in zip(*(crossing >= 0).nonzero()):
+            cell = (int(x), int(y))
+            number = crossing[cell]
+            if light[cell] >= 0:
+                found[number]["lights"].add(int(light[cell]))
+            for step in self.get_neighbors(cell):
+                if segment[step] >= 0:
+                    found[number]["segments"].add(int(segment[step]))
+        self.load(segment, crossing, found)
+
+    def load(self, segment, crossing, crossings, trees=None, routes=None):
+        # A graph built before, like the one of a compiled CityMap. `trees`
+        # are the parents of tree() for some origins and `routes` the routes
+        # already read from them
+        self.segment = segment
+        self.crossing = crossing
+        self.crossings = [{"lights": set(c["lights"]), "segments": set(c["segments"])} for c in crossings]
+        self.links = {i: set() for i in range(int(segment.max()) + 1)}
+        for number, crossing in enumerate(self.crossings):
+            for a in crossing["segments"]:
+                for b in crossing["segments"]:
+                    if a != b:
+                        self.links[a].add((b, number))
+        self.trees = {} if trees is None else trees
+        self.routes = {} if routes is None else routes
+        self.built_version = self.version
+
+    def node(self, pos):
+        # Segment of a cell, or the first segment touched by its crossing
+        if self.segment[pos] >= 0:
+            return int(self.segment[pos])
+        if self.crossing[pos] >= 0:
+            segments = self.crossings[self.crossing[pos]]["segments"]
+            return min(segments) if segments else None
+        return None
+
+    def reachable(self, origin, destiny):
+        # Search over segments, far smaller than the cells
+        if self.built_version != self.version:
+            self.build()
+        start, end = self.node(origin), self.node(destiny)
+        if start is None or end is None:
+            return False
+        seen = {start}
+        q = deque([start])
+        while q:
+            segment = q.popleft()
+            if segment == end:
+                return True
+            for step, crossing in self.links[segment]:
+                if step not in seen:
+                    seen.add(step)
+                    q.append(step)
+        return False
+
+    def tree(self, origin):
+        # BFS parents from one origin, shared by all its destinations, indexed
+        # by Terrain.index: the origin is its own parent, -1 = not reached
+        tree = self.trees.get(origin)
+        if tree is None:
+            terrain = self.model.terrain
+            tree = np.full(terrain.width * terrain.height, -1, dtype=np.int32)
+            tree[terrain.index(origin)] = terrain.index(origin)
+            q = deque([origin])
+            nodes = 0
+            while q:
+                cell = q.popleft()
+                nodes += 1
+                for step in self.get_neighbors(cell):
+                    if tree[terrain.index(step)] < 0:
+                        tree[terrain.index(step)] = terrain.index(cell)
+                        q.append(step)
+            self.count_nodes(nodes)
+            self.trees[origin] = tree
+        return tree
+
+    def get_route(self, origin, destiny):
+        # Cells from origin to destiny as Terrain.index values, shared by every
+        # pedestrian with the same trip, so it must not be modified
+        if self.built_version != self.version:
+            self.build()
+        key = (origin, destiny)
+        route = self.routes.get(key)
+        if route is None:
+            tree = self.tree(origin)
+            cell = self.model.terrain.index(destiny)
+            if tree[cell] < 0:
+                # Same fallback as the old per-pedestrian BFS: only the destination
+                route = array("i", [cell])
+            else:
+                route = array("i", [cell])
+                while tree[cell] != cell:
+                    cell = int(tree[cell])
+                    route.append(cell)
+                route.reverse()
+            self.routes[key] = route
+        return route
+
+    def lights_on(self, origin, destiny):
+        # Traffic lights a pedestrian meets on the way, in order
+        route = self.get_route(origin, destiny)
+        lights = []
+        seen = set()
+        for index in route:
+            crossing = self.crossing[self.model.terrain.cell(index)]
+            if crossing >= 0 and crossing not in seen:
+                seen.add(crossing)
+                lights.extend(sorted(self.crossings[crossing]["lights"]))
+        return lights
+
@@ -0,0 +1,146 @@
+import struct
+from array import array
+import numpy as np
+
+# Binary frames of /init and /data, asked for with ?format=binary or an
+# Accept header with MIMETYPE. All little-endian:
+#   header  magic "TRF1", step uint32, the gridSize of the JSON frames
+#           (last column and row) uint16 x2, then the number of cars,
+#           metrobuses, pedestrians and lights uint32
+#   agents  for cars, metrobuses and pedestrians in that order, as columns:
+#           id int32[n], x int16[n], y int16[n], direction int8[n]
+#           (-1 = none, pedestrians have none); the metrobuses then have
+#           passengers uint16[n] and capacity uint16[n]
+#   lights  x int16[n], y int16[n], color uint8[n], in the order of the
+#           trafficlights of the JSON frames, whose ids they don't repeat
+#   ridership  boarded, alighted, waiting and riding uint32, as in the
+#           ridership of the JSON frames
+# TRF1 frames were the same without the passengers, capacity and ridership
+MIMETYPE = "application/x-trans-frame"
+MAGIC = b"TRF2"
+HEADER = struct.Struct("<4sIHHIIII")
+KEYS = ("cars", "metrobuses", "pedestrians")
+RIDERSHIP = struct.Struct("<IIII")
+RIDERSHIP_KEYS = ("boarded", "alighted", "waiting", "riding")
+
+
+def wants_binary(request):
+    # ?format= wins over the Accept header, JSON stays the default
+    format = request.args.get("format")
+    if format is not None:
+        return format == "binary"
+    return request.accept_mimetypes.best_match(["application/json", MIMETYPE]) == MIMETYPE
+
+
+def agents(registry, visible_only, directions=True):
+    ids, xs, ys, direction = array("i"), array("h"), array("h"), array("b")
+    for agent in registry.values():
+        if visible_only and not agent.show:
+            continue
+        ids.append(agent.unique_id)
+        x, y = agent.pos
+        xs.append(x)
+        ys.append(y)
+        if directions:
+            direction.append(-1 if agent.direccion is None else agent.direccion)
+    if not directions:
+        direction = array("b", [-1]) * len(ids)
+    return ids, xs, ys, direction
+
+
+def bus_load(registry, visible_only):
+    # Passengers and capacity of the metrobuses listed by agents()
+    passengers, capacity = array("H"), array("H")
+    for bus in registry.values():
+        if visible_only and not bus.show:
+            continue
+        passengers.append(bus.passengers)
+        capacity.append(bus.capacity)
+    return passengers, capacity
+
+
+def engine_cars(engine):
+    # Visible cars of a CarEngine straight from its arrays
+    if engine.built != len(engine.agents):
+        engine.build()
+    shown = np.flatnonzero(engine.show)
+    position = engine.position[shown]
+    return (engine.ids[shown], (position // engine.height).astype("<i2"), (position % engine.height).astype("<i2"),
+            engine.direction[shown])
+
+
+def pack(model, visible_only=True):
+    # Same content as MapModel.ubication, without building its dicts
+    if model.car_engine and visible_only:
+        cars = engine_cars(model.car_engine)
+    else:
+        cars = agents(model.cars, visible_only)
+    groups = (cars, agents(model.buses, visible_only), agents(model.pedestrians, visible_only, False))
+    lights = model.traffic_lights
+    ridership = model.bus_stops.ridership()
+    return frame(model.step_count, model.grid_size, groups, bus_load(model.buses, visible_only),
+                 (array("h", [light.pos[0] for light in lights]), array("h", [light.pos[1] for light in lights]),
+                  bytes(model.signals.colors[:len(lights)].astype(np.uint8))),
+                 [ridership[key] for key in RIDERSHIP_KEYS])
+
+
+def pack_snapshot(data):
+    # A frame from the dict of MapModel.ubication, for sessions that keep
+    # their frames as JSON
+    groups = []
+    for key in KEYS:
+        entries = data[key]
+        groups.append((array("i", [entry["id"] for entry in entries]), array("h", [entry["x"] for entry in entries]),
+                       array("h", [entry["y"] for entry in entries]),
+                       array("b", [-1 if entry.get("direction") is None else entry["direction"]
+                                   for entry in entries])))
+    buses = data["metrobuses"]
+    lights = data["trafficlights"]
+    return frame(data["step"], data["gridSize"], groups,
+                 (array("H", [entry["passengers"] for entry in buses]),
+                  array("H", [entry["capacity"] for entry in buses])),
+                 (array("h", [light["x"] for light in lights]), array("h", [light["y"] for light in lights]),
+                  bytes(light["color"] for light in lights)),
+                 [data["ridership"][key] for key in RIDERSHIP_KEYS])
+
+
+def frame(step, grid_size, groups, buses, lights, ridership):
+    parts = [HEADER.pack(MAGIC, step, *grid_size, *(len(group[0]) for group in groups), len(lights[0]))]
+    for key, (ids, xs, ys, directions) in zip(KEYS, groups):
+        parts += [column_bytes(ids, "<i4"), column_bytes(xs, "<i2"), column_bytes(ys, "<i2"),
+                  column_bytes(directions, "i1")]
+        if key == "metrobuses":
+            parts += [column_bytes(buses[0], "<u2"), column_bytes(buses[1], "<u2")]
+    parts += [column_bytes(lights[0], "<i2"), column_bytes(lights[1], "<i2"), bytes(lights[2]),
+              RIDERSHIP.pack(*ridership)]
+    return b"".join(parts)
+
+
+def column_bytes(column, dtype):
+    return np.asarray(column).astype(dtype, copy=False).tobytes() if len(column) else b""
+
+
+def unpack(data):
+    # The columns of a frame by snapshot key, for tests and Python clients
+    magic, step, width, height, *counts = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary frame")
+    offset = HEADER.size
+    result = {"step": step, "gridSize": (width, height)}
+
+    def read(dtype, count):
+        nonlocal offset
+        column = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += column.nbytes
+        return column
+
+    for key, count in zip(KEYS, counts):
+        result[key] = {"id": read("<i4", count), "x": read("<i2", count), "y": read("<i2", count),
+                       "direction": read("i1", count)}
+        if key == "metrobuses":
+            result[key]["passengers"] = read("<u2", count)
+            result[key]["capacity"] = read("<u2", count)
+    result["trafficlights"] = {"x": read("<i2", counts[3]), "y": read("<i2", counts[3]),
+                               "color": read("u1", counts[3])}
+    result["ridership"] = dict(zip(RIDERSHIP_KEYS, RIDERSHIP.unpack_from(data, offset)))
+    return result
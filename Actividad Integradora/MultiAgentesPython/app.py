@@ -1,47 +1,305 @@
-from flask import Flask, jsonify
-from ModeloV1 import *
+from flask import Flask, jsonify, request, Response
+from Sessions import SessionManager, SessionLimitError, UnknownSessionError, WorkerLostError
+from Stepper import FrameExpiredError, FrameAheadError, LOOKAHEAD, MAX_LOOKAHEAD
+from Checkpoint import CheckpointError
+from Recorder import Recording, RECORDINGS
+from Metrics import Metrics, prometheus, SERVER_PHASES, SERVER_COUNTERS
+from Gridlock import POLICIES
+from Demand import MAX_DEMAND
+from CityMap import CityMap
+import Wire
+from time import perf_counter
 import json
+import os
+import re
+import time
 
 app = Flask(__name__)
-model = None
-class AgentData():
-    def __init__(self, id, direction, x, y):
-        self.id = id
-        self.direction = direction
-        self.x = x
-        self.y = y
-    
-
-model = None
-data_hist = []
-g_step = 0
+
+# Phase timers in every model, read on /metrics. Off unless TRANS_METRICS=1:
+# they time every step and every new route
+METRICS = os.environ.get("TRANS_METRICS", "0") == "1"
+sessions = SessionManager(metrics=METRICS)
+# Timers and counters of this process: encoding the frames
+server = Metrics()
+# Clients that don't send ?session= (the Unity scene) use the last one created
+last_session = None
+# Steps between full snapshots on /stream, so a client can resync
+KEYFRAME_EVERY = 50
+RECORDING_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def session_id():
+    return request.args.get("session") or last_session
+
+
+def lookahead_arg():
+    # ?lookahead=, None when out of range
+    lookahead = request.args.get("lookahead", LOOKAHEAD, type=int)
+    return lookahead if 0 <= lookahead <= MAX_LOOKAHEAD else None
+
+
+def bad_lookahead():
+    return jsonify({"error": "lookahead must be between 0 and %d" % MAX_LOOKAHEAD}), 400
+
+
+def demand_arg():
+    # ?demand=, None when out of range; nan and inf are out of every range
+    demand = request.args.get("demand", 0.0, type=float)
+    return demand if 0 <= demand <= MAX_DEMAND else None
+
+
+@app.errorhandler(UnknownSessionError)
+def unknown_session(e):
+    return jsonify({"error": "unknown session"}), 404
+
+
+@app.errorhandler(FrameExpiredError)
+def frame_expired(e):
+    return jsonify({"error": str(e)}), 410
+
+
+@app.errorhandler(FrameAheadError)
+def frame_ahead(e):
+    return jsonify({"error": str(e)}), 416
+
+
+@app.errorhandler(SessionLimitError)
+def too_many_sessions(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@app.errorhandler(WorkerLostError)
+def worker_lost(e):
+    # The sessions of the worker are gone, a new one takes its place
+    return jsonify({"error": str(e)}), 503
+
+
+@app.errorhandler(CheckpointError)
+def bad_checkpoint(e):
+    return jsonify({"error": str(e)}), 400
+
 
 @app.get("/init/<int:cars>/<int:pedestrians>")
 def init_cars(cars=1, pedestrians=1):
-    global model
-    global data_hist 
-    global g_step 
-    data = []
-    model = None
-    g_step = 1
-    model = MapModel(37,37,cars, 1, pedestrians)
-    data = model.ubication((0,0),(36,36))
-#    data_hist.append(data)
-
-    return jsonify(data)
+    global last_session
+    lookahead = lookahead_arg()
+    if lookahead is None:
+        return bad_lookahead()
+    # ?engine=vector moves the cars with the vectorized CarEngine
+    engine = request.args.get("engine", "agents")
+    if engine not in ("agents", "vector"):
+        return jsonify({"error": "unknown engine " + engine}), 400
+    # ?demand=0.1 keeps spawning about 0.1 cars and 0.1 pedestrians per step
+    demand = demand_arg()
+    if demand is None:
+        return jsonify({"error": "demand must be between 0 and %g" % MAX_DEMAND}), 400
+    # ?record=name saves the run to recordings/name, see /replay
+    record = request.args.get("record")
+    # ?format=binary or Accept: application/x-trans-frame, see Wire.py
+    binary = Wire.wants_binary(request)
+    # ?gridlock=teleport, what is done with cars stuck waiting for each other
+    gridlock = request.args.get("gridlock", "yield")
+    if gridlock not in POLICIES:
+        return jsonify({"error": "unknown gridlock policy " + gridlock}), 400
+    # ?buses=20, metrobuses spread evenly over the loops, one per start by default
+    city = CityMap.template()
+    buses = request.args.get("buses", len(city.bus_starts), type=int)
+    if not 0 <= buses <= sum(city.bus_loops):
+        return jsonify({"error": "between 0 and %d buses fit" % sum(city.bus_loops)}), 400
+    if record is not None and not RECORDING_NAME.fullmatch(record):
+        return jsonify({"error": "recording names are letters, digits, - and _"}), 400
+    try:
+        session, data = sessions.create(city.width, city.height, cars, buses, pedestrians, lookahead, engine, demand,
+                                        record, binary, gridlock)
+    except FileExistsError:
+        return jsonify({"error": "recording %s already exists" % record}), 409
+    last_session = session
+    if binary:
+        return binary_frame(data, {"X-Session": session})
+    data["session"] = session
+    return snapshot(data)
 
 @app.get("/data/<int:step>")
 def get_data(step):
-    global model
-    global data_hist
-    global g_step 
+    # step 0 = the next frame, older clients always ask for 0
+    binary = Wire.wants_binary(request)
+    data = sessions.call(session_id(), "data", step, binary)
+    return binary_frame(data) if binary else snapshot(data)
+
+
+@app.get("/session/<session>/checkpoint")
+def checkpoint(session):
+    # Binary checkpoint of the newest step of the session, see Checkpoint.py
+    step, data = sessions.call(session, "checkpoint")
+    return Response(data, mimetype="application/octet-stream",
+                    headers={"X-Step": str(step),
+                             "Content-Disposition": "attachment; filename=checkpoint-%d.npz" % step})
+
+
+@app.post("/restore")
+def restore():
+    # New session from a checkpoint sent as the request body
+    global last_session
+    lookahead = lookahead_arg()
+    if lookahead is None:
+        return bad_lookahead()
+    session, data = sessions.restore(request.get_data(), lookahead)
+    last_session = session
+    data["session"] = session
+    return snapshot(data)
 
-    model.step()
-    data = model.ubication((0,0), (36, 36))
-    return jsonify(data)
 
+@app.post("/session/<session>/fork")
+def fork(session):
+    # Copy of the session from its newest step on, both go on independently
+    lookahead = lookahead_arg()
+    if lookahead is None:
+        return bad_lookahead()
+    forked, data = sessions.fork(session, lookahead)
+    data["session"] = forked
+    return snapshot(data)
 
 
+@app.get("/session/<session>/gridlocks")
+def gridlocks(session):
+    # Cycles of cars waiting for each other found lately, with the cars, the
+    # cells and whether the policy of the session got them moving
+    return jsonify({"gridlocks": sessions.call(session, "gridlocks")})
+
+
+@app.delete("/session/<session>")
+def close_session(session):
+    if not sessions.close(session):
+        raise UnknownSessionError(session)
+    return jsonify({"closed": session})
+
+
+def snapshot(data):
+    # jsonify of a frame, timed and counted for /metrics
+    start = perf_counter()
+    response = jsonify(data)
+    server.time("jsonify", perf_counter() - start)
+    server.count("snapshot_bytes", response.content_length)
+    return response
+
+
+def binary_frame(data, headers=None):
+    server.count("snapshot_bytes", len(data))
+    response = Response(data, mimetype=Wire.MIMETYPE, headers=headers)
+    response.vary.add("Accept")
+    return response
+
+
+def sse_event(event, data):
+    start = perf_counter()
+    message = "event: " + event + "\ndata: " + json.dumps(data, separators=(",", ":")) + "\n\n"
+    server.time("jsonify", perf_counter() - start)
+    server.count("snapshot_bytes", len(message))
+    return message
+
+
+@app.get("/stream")
+def stream():
+    # Server-Sent Events: a keyframe with the full state, then one delta per
+    # step with the agents that changed and the ones that despawned
+    keyframe_every = request.args.get("keyframe", KEYFRAME_EVERY, type=int)
+    if keyframe_every < 1:
+        return jsonify({"error": "keyframe must be at least 1"}), 400
+    interval = request.args.get("interval", 0.0, type=float)
+    session = session_id()
+    data = sessions.call(session, "data")
+
+    def frames():
+        yield sse_event("keyframe", data)
+        step = data["step"]
+        sent = 0
+        while True:
+            step += 1
+            sent += 1
+            keyframe = sent % keyframe_every == 0
+            try:
+                frame = sessions.call(session, "frame", step, keyframe)
+            except (UnknownSessionError, FrameExpiredError, WorkerLostError):
+                return
+            yield sse_event("keyframe" if keyframe else "delta", frame)
+            if interval:
+                time.sleep(interval)
+
+    return Response(frames(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
+def recording(name):
+    if not RECORDING_NAME.fullmatch(name):
+        return None
+    try:
+        return Recording(os.path.join(RECORDINGS, name))
+    except FileNotFoundError:
+        return None
+
+
+@app.get("/replay/<name>/<int:step>")
+def replay_frame(name, step):
+    # Snapshot of a recorded step, read from disk without a model
+    replay = recording(name)
+    if replay is None:
+        return jsonify({"error": "unknown recording"}), 404
+    try:
+        return snapshot(replay.frame(step))
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 416
+
+
+@app.get("/replay/<name>")
+def replay(name):
+    # Same events as /stream, from a recording: ?from= and ?to= pick the
+    # steps, the default is all of them (as far as they are recorded)
+    replay = recording(name)
+    if replay is None:
+        return jsonify({"error": "unknown recording"}), 404
+    keyframe_every = request.args.get("keyframe", KEYFRAME_EVERY, type=int)
+    if keyframe_every < 1:
+        return jsonify({"error": "keyframe must be at least 1"}), 400
+    interval = request.args.get("interval", 0.0, type=float)
+    first = request.args.get("from", replay.first_step, type=int)
+    last = request.args.get("to", type=int)
+    try:
+        data = replay.frame(first)
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 416
+
+    def frames():
+        yield sse_event("keyframe", data)
+        step = first
+        while last is None or step < last:
+            step += 1
+            replay.refresh()
+            if step > replay.last_step:
+                return
+            keyframe = (step - first) % keyframe_every == 0
+            yield sse_event("keyframe" if keyframe else "delta",
+                            replay.frame(step) if keyframe else replay.delta(step))
+            if interval:
+                time.sleep(interval)
+
+    return Response(frames(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus text format: the totals of every session plus this process,
+    # only the ones of this process when the models are not timed
+    gauges = {"sessions": ("Open sessions", len(sessions.sessions)),
+              "workers": ("Worker processes running", len(sessions.workers))}
+    if not METRICS:
+        return Response(prometheus(server, gauges, phases=SERVER_PHASES, counters=SERVER_COUNTERS),
+                        mimetype="text/plain; version=0.0.4")
+    totals = sessions.collect_metrics()
+    totals.add(server)
+    return Response(prometheus(totals, gauges), mimetype="text/plain; version=0.0.4")
+
 
 @app.route("/initialize")
 def initialize():
@@ -49,8 +307,3 @@ def initialize():
 
 if __name__ == "__main__":
     app.run(debug=True)
-    
-
-    
-
-    
@@ -0,0 +1,90 @@
+from ActivityScheduler import ActivityScheduler
+
+
+class Clock:
+    # The part of MapModel the scheduler reads
+    def __init__(self):
+        self.step_count = 0
+
+
+class Agent:
+    def __init__(self, unique_id, stepped, action=None, rank=0):
+        self.unique_id = unique_id
+        self.stepped = stepped
+        self.action = action
+        self.rank = rank
+
+    def step(self):
+        self.stepped.append(self.unique_id)
+        if self.action:
+            self.action(self)
+
+
+def schedule(agents, rank=None):
+    model = Clock()
+    scheduler = ActivityScheduler(model, rank)
+    for agent in agents:
+        scheduler.add(agent)
+    return model, scheduler
+
+
+def step(model, scheduler, stepped):
+    model.step_count += 1
+    stepped.clear()
+    scheduler.step()
+    return list(stepped)
+
+
+def test_order_of_addition_and_rank():
+    stepped = []
+    agents = [Agent(i, stepped, rank=rank) for i, rank in enumerate((1, 0, 1, 0))]
+    model, scheduler = schedule(agents)
+    assert step(model, scheduler, stepped) == [0, 1, 2, 3]
+    model, scheduler = schedule(agents, rank=lambda agent: agent.rank)
+    assert step(model, scheduler, stepped) == [1, 3, 0, 2]
+
+
+def test_sleep_until_a_step():
+    stepped = []
+    sleeper = Agent(1, stepped)
+    model, scheduler = schedule([Agent(0, stepped), sleeper, Agent(2, stepped)])
+    step(model, scheduler, stepped)
+    scheduler.sleep(sleeper, model.step_count + 3)
+    assert scheduler.active_count == 2
+    assert step(model, scheduler, stepped) == [0, 2]
+    assert step(model, scheduler, stepped) == [0, 2]
+    # Back at its alarm, in its place
+    assert step(model, scheduler, stepped) == [0, 1, 2]
+
+
+def test_a_freed_cell_wakes_the_waiting():
+    stepped = []
+    cell = (3, 4)
+    first = Agent(0, stepped)
+    last = Agent(3, stepped)
+    mover = Agent(1, stepped, action=lambda agent: scheduler.cell_freed(cell))
+    model, scheduler = schedule([first, mover, Agent(2, stepped), last])
+    step(model, scheduler, stepped)
+    scheduler.wait_for(first, cell)
+    scheduler.wait_for(last, cell)
+    # The agent after the mover steps in the same step, the one before it
+    # had its turn already and steps in the next one
+    assert step(model, scheduler, stepped) == [1, 2, 3]
+    mover.action = None
+    assert step(model, scheduler, stepped) == [0, 1, 2, 3]
+
+
+def test_stale_alarm_and_removed_agents():
+    stepped = []
+    sleeper = Agent(0, stepped)
+    gone = Agent(1, stepped)
+    model, scheduler = schedule([sleeper, gone, Agent(2, stepped)])
+    scheduler.sleep(sleeper, 10)
+    scheduler.wait_for(sleeper, (0, 0))
+    scheduler.cell_freed((0, 0))
+    scheduler.remove(gone)
+    assert step(model, scheduler, stepped) == [0, 2]
+    # Sleeping again until later, the first alarm no longer wakes it
+    scheduler.sleep(sleeper, 20)
+    model.step_count = 10
+    assert step(model, scheduler, stepped) == [2]
@@ -0,0 +1,57 @@
+import csv
+import json
+from ModeloV1 import MapModel
+from Demand import Demand
+from BatchRunner import run, CsvSink, COLUMNS
+
+# The columns that depend on the machine and not on the model
+TIMINGS = {"init_seconds", "run_seconds", "steps_per_second"}
+
+
+def outcome(row):
+    return {name: value for name, value in row.items() if name not in TIMINGS}
+
+
+def test_a_seed_repeats_its_run():
+    scenario = ("agents", 20, 20, 2, 4, "yield", 4, 120)
+    row = run(scenario)
+    assert list(row) == COLUMNS
+    assert outcome(run(scenario)) == outcome(row)
+    assert row["cars_arrived"] > 0 and row["car_moves"] > 0
+
+
+def test_rows_go_to_csv(tmp_path):
+    path = str(tmp_path / "results.csv")
+    sink = CsvSink(path)
+    rows = [run(("vector", 5, 5, 1, 4, "yield", seed, 20)) for seed in (0, 1)]
+    for row in rows:
+        sink.write(row)
+    sink.close()
+    with open(path, newline="") as file:
+        written = list(csv.DictReader(file))
+    assert [int(row["seed"]) for row in written] == [0, 1]
+    assert [int(row["car_moves"]) for row in written] == [row["car_moves"] for row in rows]
+
+
+def test_step_stats_keep_the_steps_column():
+    scenario = ("agents", 5, 5, 1, 4, "yield", 0, 20)
+    row = run(scenario, step_stats=True)
+    assert row["steps"] == 20
+    # Step 0 is the setup of the model
+    records = row.pop("step_records")
+    assert [record["step"] for record in records] == list(range(21))
+    # Merged over the scenario they must not hide any of its columns
+    assert not any(set(record) & set(COLUMNS[:7]) for record in records)
+    assert list(row) == COLUMNS
+
+
+def test_models_of_one_process_draw_from_their_own_seed():
+    # Two models stepped in turns, as the sessions of a worker are, go on
+    # like each one alone
+    first, second = (MapModel(37, 37, 10, 2, 10, seed=7, demand=Demand(0.3, 0.3)) for i in range(2))
+    MapModel(37, 37, 10, 2, 10, seed=8)
+    for i in range(100):
+        first.step()
+        second.step()
+        assert json.dumps(first.ubication(), default=int) == json.dumps(second.ubication(), default=int), i
+    assert first.random is not second.random
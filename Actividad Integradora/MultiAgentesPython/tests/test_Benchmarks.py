@@ -0,0 +1,34 @@
+import json
+from Benchmarks import bench_model, compare, TIMINGS
+from CityMap import CityMap, CITY, tile_city
+from ModeloV1 import MapModel
+
+
+def test_tiled_copies_reach_each_other(tmp_path):
+    with open(CITY) as file:
+        document = json.load(file)
+    path = tmp_path / "city-2x2.json"
+    path.write_text(json.dumps(tile_city(document, 2, 2)))
+    city = CityMap.load(str(path))
+    assert (city.width, city.height) == (2 * document["width"], 2 * document["height"])
+    assert len(city.parking_lots) == 4 * len(document["parking_lots"])
+    model = MapModel(city.width, city.height, 0, 0, 0, city=str(path))
+    for destiny in model.parking_lots:
+        assert all(model.router.reachable(origin, destiny) for origin in model.parking_lots)
+    for destiny in model.directions:
+        assert all(model.walk_router.reachable(origin, destiny) for origin in model.directions)
+
+
+def test_a_scenario_has_every_timing():
+    result = bench_model(CITY, 10, "vector", 0, 5, 1)
+    assert set(TIMINGS) - set(result) == {"data_round_trip_seconds"}
+    assert all(result[name] > 0 for name in TIMINGS if name in result)
+
+
+def test_slower_timings_are_regressions(capsys):
+    baseline = {"results": [{"scenario": "stock/tiny/agents", "step_seconds": 1.0, "init_seconds": 1.0},
+                            {"scenario": "gone", "step_seconds": 1.0}]}
+    results = [{"scenario": "stock/tiny/agents", "step_seconds": 1.2, "init_seconds": 1.3},
+               {"scenario": "new", "step_seconds": 9.0}]
+    assert compare(results, baseline, 0.25) == [("stock/tiny/agents", "init_seconds", 1.3)]
+    assert "REGRESSION" in capsys.readouterr().out
@@ -0,0 +1,55 @@
+import json
+import pytest
+from BusLine import STEPS, DWELL
+from CityMap import CityMap, CityMapError, CITY
+from ModeloV1 import MapModel
+from Terrain import STREETBUS
+
+
+def test_loops_follow_the_lanes():
+    model = MapModel(37, 37, 0, 0, 0)
+    terrain = model.terrain
+    assert model.bus_line.loops
+    for loop in model.bus_line.loops:
+        cells = [terrain.cell(int(index)) for index in loop]
+        for cell, following in zip(cells, cells[1:] + cells[:1]):
+            assert terrain.has(cell, STREETBUS)
+            dx, dy = STEPS[int(terrain.bus_direction[cell])]
+            assert following == (cell[0] + dx, cell[1] + dy)
+
+
+def test_a_lane_that_does_not_loop_is_refused(tmp_path):
+    with open(CITY) as file:
+        document = json.load(file)
+    x, y = document["bus_starts"][0]
+    rows = document["layers"]["bus_direction"]
+    row = document["height"] - 1 - y
+    rows[row] = rows[row][:x] + "." + rows[row][x + 1:]
+    path = tmp_path / "city.json"
+    path.write_text(json.dumps(document))
+    with pytest.raises(CityMapError):
+        CityMap.load(str(path))
+
+
+def test_fleets_keep_their_order():
+    model = MapModel(37, 37, 0, 20, 0, seed=1)
+    line = model.bus_line
+    assert len(model.buses) == 20
+    with pytest.raises(ValueError):
+        line.starts(sum(map(len, line.loops)) + 1, model.lst_buses)
+    dwelt = 0
+    for i in range(200):
+        stopped = {bus: line.at_stop(bus) and bus.wait4passengers for bus in model.buses.values()}
+        model.step()
+        assert len({bus.pos for bus in model.buses.values()}) == 20
+        for fleet, loop in zip(line.fleets, line.loops):
+            assert sum(line.gap(bus, bus.ahead) for bus in fleet) == (len(loop) if fleet else 0)
+            for bus in fleet:
+                assert bus.ahead.behind is bus
+                assert model.terrain.index(bus.pos) == loop[bus.offset]
+        # A bus at a stop stays there while it dwells
+        for bus, dwelling in stopped.items():
+            if dwelling:
+                assert line.at_stop(bus)
+                dwelt += 1
+    assert dwelt >= DWELL
@@ -0,0 +1,49 @@
+from ModeloV1 import MapModel
+from Pedestrians import Pedestrians
+
+
+def at_stop(model, bus, stop):
+    bus.offset = model.bus_line.offset_of[model.bus_stops.cells[stop]]
+
+
+def test_queue_boards_first_come_first_served():
+    model = MapModel(37, 37, 0, 2, 0, seed=1)
+    stops = model.bus_stops
+    bus = next(iter(model.buses.values()))
+    board, alight = stops.on_loop[bus.loop][:2]
+    bus.capacity = 2
+    waiting = []
+    for i in range(3):
+        pedestrian = model.spawn(Pedestrians, stops.platforms[board], stops.platforms[alight], model.pedestrians)
+        pedestrian.leg = (board, alight)
+        stops.join(pedestrian)
+        waiting.append(pedestrian)
+    assert stops.waiting == 3
+    at_stop(model, bus, board)
+    stops.exchange(bus)
+    # The first two get on, the third waits for the next bus
+    assert bus.riders == {alight: waiting[:2]}
+    assert list(stops.queues[board]) == waiting[2:]
+    assert bus.passengers == 2
+    assert not any(pedestrian.show for pedestrian in waiting[:2])
+    assert stops.ridership() == {"boarded": 2, "alighted": 0, "waiting": 1, "riding": 2}
+    at_stop(model, bus, alight)
+    stops.exchange(bus)
+    # Off at the platform of their stop, walking the rest
+    assert bus.riders == {} and bus.passengers == 0
+    for pedestrian in waiting[:2]:
+        assert pedestrian.show and pedestrian.pos == stops.platforms[alight]
+        assert pedestrian.leg is None
+    assert stops.ridership() == {"boarded": 2, "alighted": 2, "waiting": 1, "riding": 0}
+
+
+def test_ridership_adds_up():
+    model = MapModel(37, 37, 20, 8, 120, seed=3)
+    stops = model.bus_stops
+    for i in range(400):
+        model.step()
+        buses = model.buses.values()
+        assert stops.waiting == sum(len(queue) for queue in stops.queues)
+        assert stops.boarded - stops.alighted == sum(bus.passengers for bus in buses)
+        assert all(bus.passengers == sum(map(len, bus.riders.values())) <= bus.capacity for bus in buses)
+    assert stops.boarded > 0 and stops.alighted > 0
@@ -0,0 +1,32 @@
+import json
+import pytest
+from ModeloV1 import MapModel
+from Demand import Demand
+
+
+def snapshot(model):
+    # The engines list their cars in different orders
+    data = model.ubication()
+    return {key: sorted(json.dumps(entry, sort_keys=True, default=int) for entry in value)
+            for key, value in data.items() if isinstance(value, list)}
+
+
+def run(engine, cars, seed, demand):
+    options = {"demand": Demand(*demand)} if demand else {}
+    model = MapModel(37, 37, cars, 8, 40, seed=seed, engine=engine, **options)
+    snapshots = [snapshot(model)]
+    for i in range(150):
+        model.step()
+        snapshots.append(snapshot(model))
+    return model, snapshots
+
+
+@pytest.mark.parametrize("cars, seed, demand", [(40, 1, None), (300, 2, None), (10, 3, (0.3, 0.3))],
+                         ids=["few", "jammed", "demand"])
+def test_vector_moves_the_cars_like_the_agents(cars, seed, demand):
+    agents, expected = run("agents", cars, seed, demand)
+    vector, snapshots = run("vector", cars, seed, demand)
+    for step, (got, want) in enumerate(zip(snapshots, expected)):
+        assert got == want, step
+    assert vector.arrivals == agents.arrivals
+    assert vector.moves == agents.moves
@@ -0,0 +1,114 @@
+import io
+import json
+import numpy as np
+import pytest
+import Checkpoint
+from Checkpoint import CheckpointError
+from ModeloV1 import MapModel
+from Demand import Demand
+
+# Steps before the checkpoint and after it
+BEFORE = 120
+AFTER = 200
+
+
+def normal(frame):
+    # The frame as text; agents of a delta come from a set, so every list
+    # is sorted
+    def entries(value):
+        if isinstance(value, list):
+            return sorted(json.dumps(entry, sort_keys=True, default=int) for entry in value)
+        if isinstance(value, dict):
+            return {key: entries(entry) for key, entry in value.items()}
+        return value
+
+    return json.dumps(entries(frame), sort_keys=True, default=int)
+
+
+def run(model, steps):
+    frames = []
+    for i in range(steps):
+        model.step()
+        frames.append((normal(model.ubication()), normal(model.delta())))
+    return frames
+
+
+@pytest.mark.parametrize("engine, cars, pedestrians, options", [
+    ("agents", 60, 60, {}),
+    ("vector", 60, 60, {}),
+    ("agents", 300, 20, {"gridlock": "teleport"}),
+    ("vector", 300, 20, {"gridlock": "teleport"}),
+    ("vector", 40, 40, {"demand": Demand(0.3, 0.3)}),
+], ids=["agents", "vector", "teleport", "vector-teleport", "demand"])
+def test_restore_goes_on_like_the_original(engine, cars, pedestrians, options):
+    model = MapModel(37, 37, cars, 8, pedestrians, seed=7, engine=engine, **options)
+    for i in range(BEFORE):
+        model.step()
+    data = Checkpoint.save(model)
+    restored = Checkpoint.load(data)
+    # A fork is a second load of the same checkpoint
+    forked = Checkpoint.load(data)
+    assert restored.step_count == BEFORE
+    assert normal(restored.ubication()) == normal(model.ubication())
+    frames = run(model, AFTER)
+    assert run(restored, AFTER) == frames
+    assert run(forked, AFTER) == frames
+    # Gridlocks found before the checkpoint are neither lost nor found again
+    assert list(restored.gridlock.events) == list(model.gridlock.events)
+    assert restored.gridlock.found_count == model.gridlock.found_count
+    assert restored.gridlock.known == model.gridlock.known
+
+
+def test_checkpoint_of_a_restore_is_the_same():
+    model = MapModel(37, 37, 60, 8, 60, seed=3)
+    for i in range(50):
+        model.step()
+    data = Checkpoint.save(model)
+    archive = np.load(io.BytesIO(Checkpoint.save(Checkpoint.load(data))))
+    original = np.load(io.BytesIO(data))
+    assert sorted(archive.files) == sorted(original.files)
+    for name in original.files:
+        assert np.array_equal(archive[name], original[name]), name
+
+
+def edited(data, edit):
+    # The checkpoint `data` with `edit` applied to its meta
+    archive = np.load(io.BytesIO(data))
+    arrays = {name: archive[name] for name in archive.files}
+    meta = json.loads(arrays["meta"].tobytes())
+    edit(meta)
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def test_other_formats_are_refused():
+    model = MapModel(37, 37, 5, 8, 5, seed=1)
+    data = Checkpoint.save(model)
+    with pytest.raises(CheckpointError):
+        Checkpoint.load(b"not a checkpoint")
+    with pytest.raises(CheckpointError):
+        Checkpoint.load(edited(data, lambda meta: meta.update(format=Checkpoint.FORMAT - 1)))
+
+
+@pytest.mark.parametrize("path", ["../ModeloV1.py", "/etc/passwd", "generated/city.json", "..", "", None])
+def test_maps_outside_maps_are_refused(path):
+    data = Checkpoint.save(MapModel(37, 37, 5, 8, 5, seed=1))
+    with pytest.raises(CheckpointError):
+        Checkpoint.load(edited(data, lambda meta: meta["city"].update(path=path)))
+
+
+@pytest.mark.parametrize("key", ["number_cars", "random", "city", "signals"])
+def test_missing_fields_are_refused(key):
+    data = Checkpoint.save(MapModel(37, 37, 5, 8, 5, seed=1))
+    with pytest.raises(CheckpointError):
+        Checkpoint.load(edited(data, lambda meta: meta.pop(key)))
+
+
+def test_a_broken_map_is_refused(tmp_path, monkeypatch):
+    data = Checkpoint.save(MapModel(37, 37, 5, 8, 5, seed=1))
+    (tmp_path / "city.json").write_text(json.dumps({"name": "city", "width": 37}))
+    monkeypatch.setattr(Checkpoint, "CITY", str(tmp_path / "city.json"))
+    with pytest.raises(CheckpointError):
+        Checkpoint.load(data)
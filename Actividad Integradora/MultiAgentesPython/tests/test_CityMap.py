@@ -0,0 +1,78 @@
+import json
+import shutil
+import numpy as np
+import pytest
+import CityMap as city_map
+from CityMap import CityMap, CityMapError, CITY, ARRAYS
+from ModeloV1 import MapModel
+from Terrain import BUSSTOP
+
+
+def document():
+    with open(CITY) as file:
+        return json.load(file)
+
+
+def write(tmp_path, data):
+    path = tmp_path / "city.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def test_a_warm_start_reads_the_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "city.json")
+    shutil.copy(CITY, path)
+    cold = CityMap.load(path)
+    assert (tmp_path / ".cache").is_dir()
+
+    def compile_city(*args):
+        raise AssertionError("compiled again")
+
+    monkeypatch.setattr(city_map, "compile_city", compile_city)
+    warm = CityMap.load(path)
+    for name in ARRAYS:
+        assert np.array_equal(getattr(warm, name), getattr(cold, name)), name
+    assert not warm.kind.flags.writeable
+
+
+def test_models_share_one_template(tmp_path):
+    path = str(tmp_path / "city.json")
+    shutil.copy(CITY, path)
+    template = CityMap.template(path)
+    first = MapModel(37, 37, 0, 0, 0, city=path)
+    second = MapModel(37, 37, 0, 0, 0, city=path)
+    assert first.city is second.city is template
+    assert first.terrain.kind is template.kind
+    # A model that edits the map gets its own copy
+    before = template.kind.copy()
+    first.terrain.add((0, 0), BUSSTOP)
+    assert first.terrain.kind is not template.kind
+    assert np.array_equal(template.kind, before) and second.terrain.kind is template.kind
+    # A changed file is loaded again
+    with open(path, "a") as file:
+        file.write("\n")
+    assert CityMap.template(path) is not template
+
+
+def test_the_model_is_built_from_the_map():
+    city = CityMap.load()
+    model = MapModel(city.width, city.height, 0, 0, 0)
+    assert model.parking_lots == city.parking_lots
+    assert len(model.traffic_lights) == sum(len(signal["cells"]) for signal in city.signals)
+    with pytest.raises(CityMapError):
+        MapModel(city.width + 1, city.height, 0, 0, 0)
+
+
+@pytest.mark.parametrize("change", [
+    lambda data: data.pop("cycle"),
+    lambda data: data["layers"]["kind"].pop(),
+    lambda data: data["layers"].__setitem__("direction", ["?" * data["width"]] * data["height"]),
+    lambda data: data["parking_lots"].append([0, 0]),
+    lambda data: data["signals"].append(dict(data["signals"][0])),
+    lambda data: data["plans"].__setitem__("broken", [[0, 3]]),
+], ids=["field", "rows", "arrow", "parking", "signal", "plan"])
+def test_broken_maps_are_refused(tmp_path, change):
+    data = document()
+    change(data)
+    with pytest.raises(CityMapError):
+        CityMap.load(write(tmp_path, data))
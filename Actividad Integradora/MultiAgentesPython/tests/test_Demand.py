@@ -0,0 +1,49 @@
+import random
+from types import SimpleNamespace
+from Demand import Demand, TripStream
+from ModeloV1 import MapModel
+
+PLACES = ["a", "b", "c"]
+
+
+def trips(demand, kind, steps, seed=1):
+    model = SimpleNamespace(parking_lots=PLACES, directions=PLACES, step_count=0, random=random.Random(seed))
+    stream = TripStream(demand, model)
+    taken = []
+    trip = stream.arrival(kind)
+    while trip and trip[0] <= steps:
+        taken.append(trip)
+        trip = stream.arrival(kind)
+    return taken
+
+
+def test_arrivals_follow_the_rate():
+    flat = Demand(0.5, 0.0, profile=(1.0,))
+    taken = trips(flat, "cars", 20000)
+    assert 0.97 * 10000 < len(taken) < 1.03 * 10000
+    assert [trip[0] for trip in taken] == sorted(trip[0] for trip in taken)
+    assert all(origin != destiny for step, kind, origin, destiny in taken)
+    assert trips(flat, "pedestrians", 20000) == []
+    # Twice the rate in the second half of the day
+    day = Demand(0.5, 0.0, profile=(1.0, 2.0), day=200)
+    halves = [0, 0]
+    for step, kind, origin, destiny in trips(day, "cars", 20000):
+        halves[(step - 1) % 200 // 100] += 1
+    assert 1.8 < halves[1] / halves[0] < 2.2
+
+
+def test_the_table_weighs_the_trips():
+    table = {pair: 0.0 for pair in [("a", "b"), ("a", "c"), ("b", "a"), ("c", "a"), ("c", "b")]}
+    demand = Demand(0.5, 0.0, car_table=table)
+    assert {(origin, destiny) for step, kind, origin, destiny in trips(demand, "cars", 1000)} == {("b", "c")}
+
+
+def test_arrived_agents_are_reused():
+    model = MapModel(37, 37, 10, 2, 10, seed=1, demand=Demand(0.2, 0.2))
+    for i in range(600):
+        model.step()
+        registries = (model.cars, model.buses, model.pedestrians)
+        assert all(agent.show and agent.unique_id == unique_id
+                   for registry in registries for unique_id, agent in registry.items())
+        assert len(model.schedule.agents) == sum(map(len, registries))
+    assert model.pool.reused > 0 and model.arrivals["cars"] > 10 and model.arrivals["pedestrians"] > 10
@@ -0,0 +1,59 @@
+import pytest
+from ModeloV1 import MapModel
+from Gridlock import POLICIES
+
+STEPS = 300
+
+
+def run(policy, engine="agents"):
+    # Enough cars for gridlocks, and no Rerouter to get them out first
+    model = MapModel(37, 37, 300, 8, 20, seed=2, engine=engine, replans=0, gridlock=policy)
+    for i in range(STEPS):
+        model.step()
+    return model
+
+
+def is_cycle(model, cells):
+    # Every car waits for the cell of the next one, the last for the first
+    cells = [tuple(cell) for cell in cells]
+    return all(b in model.router.get_successors(a) for a, b in zip(cells, cells[1:] + cells[:1]))
+
+
+@pytest.fixture(scope="module")
+def detected():
+    return run("detect")
+
+
+def test_off_finds_nothing():
+    assert run("off").gridlock.found_count == 0
+
+
+def test_detect_only_reports(detected):
+    assert detected.gridlock.found_count > 0
+    for event in detected.gridlock.events:
+        assert event["policy"] == "detect" and not event["resolved"]
+        assert len(event["cars"]) == len(event["cells"]) >= 2
+        assert is_cycle(detected, event["cells"])
+    assert detected.arrivals["cars"] == run("off").arrivals["cars"]
+
+
+@pytest.mark.parametrize("policy", ["yield", "reroute", "teleport"])
+def test_policies_get_cars_moving(policy, detected):
+    model = run(policy)
+    events = list(model.gridlock.events)
+    assert model.gridlock.found_count > 0
+    assert any(event["resolved"] for event in events)
+    assert all(is_cycle(model, event["cells"]) for event in events)
+    assert model.arrivals["cars"] > detected.arrivals["cars"]
+    if policy == "teleport":
+        assert all(event["resolved"] for event in events)
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_engines_find_the_same_gridlocks(policy):
+    assert list(run(policy, "vector").gridlock.events) == list(run(policy).gridlock.events)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        MapModel(37, 37, 1, 1, 1, gridlock="wait")
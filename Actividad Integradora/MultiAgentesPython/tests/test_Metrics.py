@@ -0,0 +1,58 @@
+import json
+import pytest
+from Metrics import Metrics, PHASES, COUNTERS, total, prometheus
+from ModeloV1 import MapModel
+
+STEPS = 60
+
+
+def run(metrics, engine="agents"):
+    model = MapModel(37, 37, 60, 4, 60, seed=2, engine=engine, metrics=metrics)
+    frames = []
+    for i in range(STEPS):
+        model.step()
+        frames.append(json.dumps(model.ubication(), sort_keys=True, default=int))
+    return model, frames
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_metrics_do_not_change_the_model(engine):
+    timed, frames = run("steps", engine)
+    assert run(False, engine)[1] == frames
+    metrics = timed.metrics
+    assert metrics.calls["signals"] == metrics.calls["schedule"] == STEPS
+    assert metrics.counters["cell_lookups"] > 0 and metrics.counters["blocked_moves"] > 0
+    assert metrics.calls["cars"] > 0 and metrics.calls["pedestrians"] > 0
+
+
+def test_step_records_add_up():
+    model, frames = run("steps")
+    metrics = model.metrics
+    assert [record["step"] for record in metrics.steps] == list(range(STEPS + 1))
+    # Step 0 is the build of the model
+    assert "get_path_seconds" in metrics.steps[0]
+    for name in COUNTERS:
+        assert sum(record[name] for record in metrics.steps) == metrics.counters[name]
+    for phase in ("signals", "schedule"):
+        seconds = sum(record.get(phase + "_seconds", 0.0) for record in metrics.steps)
+        assert seconds == pytest.approx(metrics.seconds[phase])
+
+
+def test_prometheus_text():
+    first, second = Metrics(), Metrics()
+    first.time("ubication", 0.5)
+    second.time("ubication", 0.25)
+    second.count("snapshot_bytes", 100)
+    summed = total([first, second])
+    assert summed.calls["ubication"] == 2 and summed.seconds["ubication"] == 0.75
+    lines = prometheus(summed, {"sessions": ("Open sessions", 3)}).splitlines()
+    assert 'trans_phase_seconds_total{phase="ubication"} 0.75' in lines
+    assert 'trans_phase_calls_total{phase="ubication"} 2' in lines
+    assert "trans_snapshot_bytes_total 100" in lines
+    assert "trans_sessions 3" in lines
+    samples = [line for line in lines if not line.startswith("#")]
+    assert len(samples) == 2 * len(PHASES) + len(COUNTERS) + 1
+    # Every metric has its HELP and TYPE lines
+    names = {line.split("{")[0].split()[0] for line in samples}
+    for kind in ("HELP", "TYPE"):
+        assert {line.split()[2] for line in lines if line.startswith("# " + kind)} == names
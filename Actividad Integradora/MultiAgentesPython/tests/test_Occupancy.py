@@ -0,0 +1,61 @@
+import numpy as np
+from Occupancy import Occupancy, CAR, BUS, PEDESTRIAN
+from Terrain import Terrain, PARKING
+from ModeloV1 import MapModel, LAYERS
+
+LOT = (1, 1)
+
+
+def occupancy():
+    terrain = Terrain(4, 4)
+    terrain.add(LOT, PARKING)
+    return Occupancy(terrain)
+
+
+def test_vehicles_and_pedestrians_block_each_other():
+    cells = occupancy()
+    cells.add(PEDESTRIAN, (0, 0))
+    cells.add(CAR, (2, 2))
+    assert cells.vehicle_blocked(CAR, (0, 0), 1)
+    assert cells.vehicle_blocked(BUS, (0, 0), 1)
+    assert cells.vehicle_blocked(CAR, (2, 2), 1)
+    assert cells.pedestrian_blocked((2, 2))
+    assert not cells.pedestrian_blocked((0, 0))
+    cells.move(PEDESTRIAN, (0, 0), (0, 1), 1)
+    assert not cells.vehicle_blocked(CAR, (0, 0), 1)
+    assert cells.vehicle_blocked(CAR, (0, 1), 1)
+
+
+def test_cars_stack_in_a_parking():
+    cells = occupancy()
+    cells.add(CAR, (1, 0))
+    cells.move(CAR, (1, 0), LOT, 5)
+    assert not cells.vehicle_blocked(CAR, LOT, 5)
+    assert cells.vehicle_blocked(BUS, LOT, 5)
+
+
+def test_a_claimed_cell_is_free_the_next_step():
+    # One vehicle per cell and step, even if the one that got in has
+    # already left it
+    cells = occupancy()
+    cells.add(CAR, (2, 0))
+    cells.move(CAR, (2, 0), (2, 1), 7)
+    cells.move(CAR, (2, 1), (2, 2), 7)
+    assert cells.cars[2, 1] == 0
+    assert cells.vehicle_blocked(CAR, (2, 1), 7)
+    assert cells.vehicle_blocked(BUS, (2, 1), 7)
+    assert not cells.vehicle_blocked(CAR, (2, 1), 8)
+
+
+def test_counts_follow_the_grid():
+    model = MapModel(37, 37, 80, 8, 60, seed=4)
+    for i in range(150):
+        model.step()
+        expected = np.zeros_like(model.occupancy.counts)
+        for agent in model.schedule.agents:
+            if type(agent) in LAYERS:
+                expected[(LAYERS[type(agent)],) + agent.pos] += 1
+        assert np.array_equal(model.occupancy.counts, expected)
+        vehicles = model.occupancy.cars + model.occupancy.buses
+        outside = model.terrain.kind & PARKING == 0
+        assert vehicles[outside].max() <= 1
@@ -0,0 +1,51 @@
+import math
+import pytest
+from Car import Car
+from ModeloV1 import MapModel
+from Rerouter import remaining, stuck_cars
+
+
+def connected(model, route):
+    return all(b in model.rerouter.get_successors(a) for a, b in zip(route, route[1:]))
+
+
+def test_a_blocked_way_gets_a_detour_that_rejoins_the_route():
+    model = MapModel(37, 37, 0, 0, 0, seed=1)
+    car = model.spawn(Car, model.parking_lots[0], model.parking_lots[-1], model.cars)
+    route = car.route
+    # The first cell of the route where the car could go around the next one
+    for i in range(len(route) - 2):
+        position, rest = route[i], route[i + 1:]
+        detour = model.rerouter.detour(position, rest, math.inf)
+        if detour is not None:
+            break
+    assert detour is not None
+    assert detour[0] == position and detour[1] != rest[0]
+    assert detour[-1] == rest[-1]
+    assert connected(model, detour)
+    # Nothing in the way: going on is the cheapest
+    assert model.rerouter.detour(position, rest, 0) is None
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_stuck_cars_get_valid_routes_within_the_budget(engine):
+    model = MapModel(37, 37, 300, 8, 20, seed=2, engine=engine, metrics=True, replans=4, gridlock="off")
+    detours = 0
+    for i in range(150):
+        model.step()
+        step_detours = model.metrics.counters["detours"] - detours
+        detours += step_detours
+        assert step_detours <= 4
+    assert detours > 0
+    for unique_id, car, steps in stuck_cars(model):
+        position, route = remaining(model, car)
+        assert connected(model, [position] + list(route))
+
+
+def test_blocked_cars_are_every_car_that_waits():
+    model = MapModel(37, 37, 300, 8, 20, seed=2, gridlock="yield")
+    for i in range(150):
+        model.step()
+        waiting = {car for car in model.cars.values() if car.show and car.wait}
+        assert {car for car in model.blocked_cars if car.show and car.wait} == waiting
+        assert {entry[1] for entry in stuck_cars(model)} <= waiting
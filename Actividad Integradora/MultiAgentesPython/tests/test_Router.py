@@ -0,0 +1,38 @@
+from collections import deque
+from ModeloV1 import MapModel
+
+
+def distances(router, origin):
+    # Steps from origin to every cell, a BFS over the street graph
+    dist = {origin: 0}
+    queue = deque([origin])
+    while queue:
+        cell = queue.popleft()
+        for step in router.get_successors(cell):
+            if step not in dist:
+                dist[step] = dist[cell] + 1
+                queue.append(step)
+    return dist
+
+
+def test_routes_are_shortest_paths_between_lots():
+    model = MapModel(37, 37, 0, 0, 0)
+    router = model.router
+    for origin in model.parking_lots:
+        dist = distances(router, origin)
+        for destiny in model.parking_lots:
+            route = [model.terrain.cell(index) for index in router.get_route(origin, destiny)]
+            assert route[0] == origin and route[-1] == destiny
+            assert len(route) == dist[destiny] + 1
+            assert all(b in router.get_successors(a) for a, b in zip(route, route[1:]))
+
+
+def test_routes_are_shared_until_the_map_changes():
+    model = MapModel(37, 37, 0, 0, 0)
+    router = model.router
+    origin, destiny = model.parking_lots[0], model.parking_lots[-1]
+    route = router.get_route(origin, destiny)
+    assert router.get_route(origin, destiny) is route
+    router.invalidate()
+    assert router.get_route(origin, destiny) is not route
+    assert router.get_route(origin, destiny) == route
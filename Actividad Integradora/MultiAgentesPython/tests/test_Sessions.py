@@ -0,0 +1,77 @@
+import pytest
+import Checkpoint
+import Wire
+from ModeloV1 import MapModel
+from Sessions import SessionWorker, SessionManager, SessionLimitError, UnknownSessionError, WorkerLostError
+
+
+def test_sessions_step_their_own_models():
+    manager = SessionManager(workers=2, max_sessions=2)
+    first, data = manager.create(37, 37, 5, 1, 5)
+    second, data = manager.create(37, 37, 5, 1, 5)
+    assert first != second
+    assert {worker.sessions for worker in manager.workers} == {1}
+    assert [manager.call(first, "data")["step"] for i in range(3)] == [1, 2, 3]
+    assert manager.call(second, "data")["step"] == 1
+    with pytest.raises(SessionLimitError):
+        manager.create(37, 37, 5, 1, 5)
+    assert manager.close(first)
+    with pytest.raises(UnknownSessionError):
+        manager.call(first, "data")
+    assert not manager.close(first)
+    # The closed session made room for another
+    third, data = manager.create(37, 37, 5, 1, 5)
+    assert manager.call(third, "data")["step"] == 1
+
+
+def test_idle_sessions_are_evicted():
+    manager = SessionManager(workers=1, idle_timeout=0)
+    session, data = manager.create(37, 37, 5, 1, 5)
+    with pytest.raises(UnknownSessionError):
+        manager.call(session, "data")
+    assert manager.sessions == {} and manager.workers[0].sessions == 0
+
+
+def test_a_fork_goes_on_like_its_session():
+    manager = SessionManager(workers=2)
+    session, data = manager.create(37, 37, 20, 2, 20)
+    for i in range(5):
+        manager.call(session, "data")
+    fork, data = manager.fork(session)
+    assert fork != session and data["step"] == 5
+    for i in range(10):
+        assert manager.call(fork, "data") == manager.call(session, "data")
+
+
+def test_dead_worker_is_replaced():
+    # The worker of a session exits: its sessions are gone and the next
+    # session gets a new worker
+    manager = SessionManager(workers=1)
+    session, data = manager.create(37, 37, 5, 1, 5)
+    dead = manager.workers[0]
+    dead.process.kill()
+    dead.process.join()
+    with pytest.raises(WorkerLostError):
+        manager.create(37, 37, 5, 1, 5)
+    assert manager.workers == []
+    with pytest.raises(UnknownSessionError):
+        manager.call(session, "data")
+    assert not manager.close(session)
+    session, data = manager.create(37, 37, 5, 1, 5)
+    assert manager.workers[0] is not dead
+    assert manager.call(session, "data")["step"] == 1
+    assert manager.close(session)
+
+
+def test_first_frames_leave_out_hidden_agents():
+    # /init, /restore and a fork answer with what the Stepper sends after them
+    worker = SessionWorker(None)
+    model = MapModel(37, 37, 20, 2, 60, seed=1)
+    for i in range(60):
+        model.step()
+    assert not all(agent.show for agent in model.pedestrians.values())
+    data = worker.handle_restore("restored", Checkpoint.save(model))
+    assert data == model.ubication(visible_only=True)
+    assert worker.handle_init("json", 37, 37, 20, 2, 60) == worker.stepper("json").model.ubication(visible_only=True)
+    packed = worker.handle_init("binary", 37, 37, 20, 2, 60, binary=True)
+    assert packed == Wire.pack(worker.stepper("binary").model)
@@ -0,0 +1,44 @@
+from ModeloV1 import MapModel
+from SignalController import SignalGroup, PLAN_MAIN
+
+
+def old_cycle(step):
+    # Colors of lol1 and lol2 from the manage_traffic calls of MapModel.step
+    step = (step - 1) % 31 + 1
+    if step <= 10:
+        return 0, 2
+    if step < 15:
+        return 1, 2
+    if step <= 25:
+        return 2, 0
+    if step <= 30:
+        return 2, 1
+    return 0, 2
+
+
+def test_lights_keep_the_old_cycle():
+    model = MapModel(37, 37, 0, 0, 0)
+    signals = model.signals
+    previous = {light: light.color for light in model.traffic_lights}
+    for i in range(100):
+        model.step()
+        main, cross = old_cycle(model.step_count)
+        for name, group in signals.groups.items():
+            color = main if name.startswith("lol1.") else cross
+            assert all(light.color == color for light in group.lights), (name, model.step_count)
+        colors = [light.color for light in model.traffic_lights]
+        assert signals.colors[:-1].tolist() == colors and signals.colors[-1] == 2
+        changed = [light for light in model.traffic_lights if previous[light] != light.color]
+        assert sorted(map(id, signals.changed)) == sorted(map(id, changed))
+        assert all(light in model.dirty for light in changed)
+        previous = {light: light.color for light in model.traffic_lights}
+
+
+def test_offset_shifts_the_plan():
+    group = SignalGroup("a", [], PLAN_MAIN)
+    shifted = SignalGroup("b", [], PLAN_MAIN, offset=5)
+    for step in range(62):
+        assert shifted.color_at(step) == group.color_at(step + 5)
+        change = group.next_change(step)
+        assert group.color_at(change) != group.color_at(change - 1)
+        assert all(group.color_at(between) == group.color_at(step) for between in range(step, change))
@@ -0,0 +1,50 @@
+import pytest
+from ModeloV1 import MapModel
+from Stepper import Stepper, FrameExpiredError, FrameAheadError
+
+LOOKAHEAD = 4
+HISTORY = 3
+
+
+def stepper():
+    return Stepper(MapModel(37, 37, 10, 2, 10, seed=1), LOOKAHEAD, HISTORY)
+
+
+def test_frames_come_in_order():
+    ring = stepper()
+    for expected in range(1, 6):
+        step, snapshot, delta, packed = ring.frame()
+        assert step == snapshot["step"] == delta["step"] == expected
+    # A delivered frame can be asked for again
+    assert ring.frame(3)[0] == 3
+    assert ring.frame()[0] == 6
+
+
+def test_steps_ahead_until_the_lookahead():
+    ring = stepper()
+    while ring.has_room():
+        ring.advance()
+    assert ring.newest == LOOKAHEAD
+    ring.frame(2)
+    assert ring.has_room()
+
+
+def test_too_far_ahead_is_refused():
+    # 416 on /data: more than lookahead steps past the newest frame
+    ring = stepper()
+    ring.frame(LOOKAHEAD)
+    assert ring.newest == LOOKAHEAD
+    with pytest.raises(FrameAheadError):
+        ring.frame(2 * LOOKAHEAD + 1)
+    assert ring.frame(2 * LOOKAHEAD)[0] == 2 * LOOKAHEAD
+
+
+def test_old_frames_expire():
+    # 410 on /data: the ring keeps lookahead + history + 1 frames
+    ring = stepper()
+    for step in range(1, 21):
+        ring.frame(step)
+    oldest = 20 - (LOOKAHEAD + HISTORY)
+    assert ring.frame(oldest)[0] == oldest
+    with pytest.raises(FrameExpiredError):
+        ring.frame(oldest - 1)
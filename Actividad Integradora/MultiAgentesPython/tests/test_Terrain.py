@@ -0,0 +1,36 @@
+import numpy as np
+from Car import Car
+from Bus import Bus
+from Pedestrians import Pedestrians
+from Terrain import Terrain, STREET, CROSSWALK, PARKING, ROAD
+from ModeloV1 import MapModel
+
+
+def test_kind_bits():
+    terrain = Terrain(3, 2)
+    terrain.add((1, 1), STREET | CROSSWALK)
+    assert terrain.has((1, 1), CROSSWALK) and terrain.has((1, 1), ROAD)
+    terrain.clear((1, 1), CROSSWALK)
+    assert terrain.has((1, 1), STREET) and not terrain.has((1, 1), CROSSWALK)
+    assert not terrain.has((0, 0), ROAD)
+    assert terrain.contains((2, 1)) and not terrain.contains((3, 0))
+
+
+def test_only_moving_agents_in_the_grid():
+    model = MapModel(37, 37, 10, 2, 10)
+    for i in range(20):
+        model.step()
+    for contents, x, y in model.grid.coord_iter():
+        assert all(type(agent) in (Car, Bus, Pedestrians) for agent in contents)
+
+
+def test_the_map_is_in_the_arrays():
+    model = MapModel(37, 37, 0, 0, 0)
+    terrain = model.terrain
+    for pos in model.parking_lots:
+        assert terrain.has(pos, PARKING)
+    streets = terrain.kind & STREET != 0
+    assert np.isin(terrain.direction[streets], [0, 1, 2, 3, 4]).all()
+    for index, light in enumerate(model.traffic_lights):
+        assert terrain.light[light.pos] == index
+    assert (terrain.light >= 0).sum() == len(model.traffic_lights)
@@ -0,0 +1,53 @@
+from collections import deque
+from ModeloV1 import MapModel
+from Terrain import WALKABLE, SIDEWALK, CROSSWALK
+
+
+def distances(router, origin):
+    dist = {origin: 0}
+    queue = deque([origin])
+    while queue:
+        cell = queue.popleft()
+        for step in router.get_neighbors(cell):
+            if step not in dist:
+                dist[step] = dist[cell] + 1
+                queue.append(step)
+    return dist
+
+
+def test_routes_between_entrances_are_shortest_walks():
+    model = MapModel(37, 37, 0, 0, 0)
+    router = model.walk_router
+    terrain = model.terrain
+    for origin in model.directions:
+        dist = distances(router, origin)
+        for destiny in model.directions:
+            assert router.reachable(origin, destiny) and destiny in dist
+            route = [terrain.cell(index) for index in router.get_route(origin, destiny)]
+            assert route[0] == origin and route[-1] == destiny
+            assert len(route) == dist[destiny] + 1
+            assert all(terrain.has(cell, WALKABLE) for cell in route)
+            assert router.get_route(origin, destiny) is router.get_route(origin, destiny)
+
+
+def test_segments_and_crossings():
+    model = MapModel(37, 37, 0, 0, 0)
+    router = model.walk_router
+    router.reachable(model.directions[0], model.directions[1])
+    terrain = model.terrain
+    walkable = terrain.kind & WALKABLE
+    for x in range(terrain.width):
+        for y in range(terrain.height):
+            for step in router.get_neighbors((x, y)):
+                # Neighbours of one kind are in the same segment or crossing
+                if walkable[x, y] == walkable[step] == SIDEWALK:
+                    assert router.segment[x, y] == router.segment[step] >= 0
+                if walkable[x, y] == walkable[step] == CROSSWALK:
+                    assert router.crossing[x, y] == router.crossing[step] >= 0
+    origin, destiny = model.directions[0], model.directions[-1]
+    lights = set()
+    for index in router.get_route(origin, destiny):
+        crossing = router.crossing[terrain.cell(index)]
+        if crossing >= 0:
+            lights |= router.crossings[crossing]["lights"]
+    assert lights and sorted(router.lights_on(origin, destiny)) == sorted(lights)
@@ -0,0 +1,74 @@
+import json
+import pytest
+import Wire
+from ModeloV1 import MapModel
+from Demand import Demand
+from CityMap import CITY, tile_city
+
+STEPS = 80
+
+
+def agents(columns):
+    # (id, x, y, direction) of every agent of a group of unpack; the
+    # CarEngine lists its cars in the order of its arrays
+    return sorted(zip(*(columns[name].tolist() for name in ("id", "x", "y", "direction"))))
+
+
+def entries(snapshot, key):
+    return sorted((entry["id"], entry["x"], entry["y"], -1 if entry.get("direction") is None else entry["direction"])
+                  for entry in snapshot[key])
+
+
+@pytest.mark.parametrize("engine", ["agents", "vector"])
+def test_unpack_has_what_ubication_has(engine):
+    model = MapModel(37, 37, 60, 8, 40, seed=5, engine=engine, demand=Demand(0.2, 0.2))
+    for i in range(STEPS):
+        model.step()
+    frame = Wire.unpack(Wire.pack(model))
+    snapshot = model.ubication(visible_only=True)
+    assert frame["step"] == snapshot["step"] == STEPS
+    assert frame["gridSize"] == tuple(snapshot["gridSize"])
+    for key in Wire.KEYS:
+        assert agents(frame[key]) == entries(snapshot, key), key
+    lights = frame["trafficlights"]
+    assert list(zip(lights["x"].tolist(), lights["y"].tolist(), lights["color"].tolist())) == \
+        [(light["x"], light["y"], light["color"]) for light in snapshot["trafficlights"]]
+    buses = frame["metrobuses"]
+    assert sorted(zip(buses["id"].tolist(), buses["passengers"].tolist(), buses["capacity"].tolist())) == \
+        sorted((entry["id"], entry["passengers"], entry["capacity"]) for entry in snapshot["metrobuses"])
+    assert frame["ridership"] == snapshot["ridership"]
+
+
+def test_snapshot_packs_like_the_model():
+    model = MapModel(37, 37, 60, 8, 120, seed=2)
+    for i in range(STEPS):
+        model.step()
+    assert model.bus_stops.boarded and any(bus.passengers for bus in model.buses.values())
+    assert Wire.pack_snapshot(model.ubication(visible_only=True)) == Wire.pack(model)
+
+
+def test_the_header_has_the_map_size(tmp_path):
+    with open(CITY) as file:
+        document = json.load(file)
+    city = tmp_path / "city-1x2.json"
+    city.write_text(json.dumps(tile_city(document, 1, 2)))
+    model = MapModel(document["width"], 2 * document["height"], 10, 2, 10, seed=1, city=str(city))
+    model.step()
+    snapshot = model.ubication(visible_only=True)
+    assert Wire.unpack(Wire.pack(model))["gridSize"] == (document["width"] - 1, 2 * document["height"] - 1)
+    assert Wire.unpack(Wire.pack_snapshot(snapshot))["gridSize"] == tuple(snapshot["gridSize"])
+
+
+def test_empty_groups():
+    model = MapModel(37, 37, 0, 0, 0, seed=1)
+    frame = Wire.unpack(Wire.pack(model))
+    snapshot = model.ubication(visible_only=True)
+    for key in Wire.KEYS:
+        assert len(frame[key]["id"]) == len(snapshot[key])
+    assert len(frame["cars"]["id"]) == len(frame["pedestrians"]["id"]) == 0
+    assert len(frame["trafficlights"]["x"]) == len(model.traffic_lights)
+
+
+def test_other_data_is_refused():
+    with pytest.raises(ValueError):
+        Wire.unpack(b"JSON" + bytes(Wire.HEADER.size - 4))
@@ -0,0 +1,56 @@
+import pytest
+import app
+from ModeloV1 import MapModel
+from Recorder import Recorder
+from Sessions import SessionManager
+import Checkpoint
+from test_Checkpoint import edited
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("keyframe", [0, -5])
+def test_stream_refuses_keyframes_below_one(client, keyframe):
+    response = client.get("/stream?keyframe=%d" % keyframe)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("lookahead", [-1, 257])
+def test_lookahead_out_of_range(client, lookahead):
+    assert client.get("/init/1/1?lookahead=%d" % lookahead).status_code == 400
+    assert client.post("/restore?lookahead=%d" % lookahead, data=b"").status_code == 400
+
+
+@pytest.mark.parametrize("keyframe", [0, -5])
+def test_replay_refuses_keyframes_below_one(client, tmp_path, monkeypatch, keyframe):
+    monkeypatch.setattr(app, "RECORDINGS", str(tmp_path))
+    model = MapModel(37, 37, 5, 1, 5, seed=1)
+    Recorder(str(tmp_path / "run"), model).close()
+    assert client.get("/replay/run?keyframe=%d" % keyframe).status_code == 400
+    assert client.get("/replay/run").status_code == 200
+
+
+def test_untimed_models_leave_their_phases_out_of_metrics(client, monkeypatch):
+    monkeypatch.setattr(app, "METRICS", False)
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'phase="jsonify"' in text and "trans_snapshot_bytes_total" in text
+    assert 'phase="schedule"' not in text and "trans_bfs_nodes_total" not in text
+    assert "trans_sessions " in text
+
+
+@pytest.mark.parametrize("demand", ["-0.5", "nan", "inf", "1e9"])
+def test_demand_out_of_range(client, demand):
+    assert client.get("/init/1/1?demand=" + demand).status_code == 400
+
+
+@pytest.mark.parametrize("edit", [lambda meta: meta["city"].update(path="../ModeloV1.py"),
+                                  lambda meta: meta.pop("number_cars")], ids=["path", "key"])
+def test_a_bad_checkpoint_is_a_bad_request(client, monkeypatch, edit):
+    monkeypatch.setattr(app, "sessions", SessionManager(workers=1))
+    data = edited(Checkpoint.save(MapModel(37, 37, 5, 1, 5, seed=1)), edit)
+    response = client.post("/restore", data=data)
+    assert response.status_code == 400
+    assert app.sessions.sessions == {}
@@ -0,0 +1,36 @@
+from ModeloV1 import MapModel
+
+KEYS = ("cars", "metrobuses", "pedestrians")
+
+
+def state(snapshot):
+    # What a client keeps: the entries of every group by id
+    return {key: {entry["id"]: entry for entry in snapshot[key]} for key in KEYS}
+
+
+def apply(client, delta):
+    for key in KEYS:
+        for entry in delta[key]:
+            client[key][entry["id"]] = entry
+        for unique_id in delta["despawned"][key]:
+            del client[key][unique_id]
+
+
+def test_deltas_rebuild_the_keyframes():
+    model = MapModel(37, 37, 40, 4, 40)
+    client = state(model.ubication(visible_only=True))
+    lights = {}
+    despawned = 0
+    for i in range(200):
+        model.step()
+        delta = model.delta()
+        assert delta["step"] == model.step_count
+        apply(client, delta)
+        for entry in delta["trafficlights"]:
+            lights[str(entry["id"]), entry["x"], entry["y"]] = entry["color"]
+        despawned += sum(map(len, delta["despawned"].values()))
+        snapshot = model.ubication(visible_only=True)
+        assert client == state(snapshot)
+        for light in snapshot["trafficlights"]:
+            assert lights.get((str(light["id"]), light["x"], light["y"]), light["color"]) == light["color"]
+    assert despawned > 0
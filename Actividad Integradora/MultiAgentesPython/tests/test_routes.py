@@ -0,0 +1,42 @@
+from Car import Car
+from Pedestrians import Pedestrians
+from ModeloV1 import MapModel
+
+
+def test_trips_share_their_route():
+    model = MapModel(37, 37, 40, 4, 40, seed=1)
+    for car in model.cars.values():
+        assert car.route is model.router.get_route(car.position, car.destiny)
+    for pedestrian in model.pedestrians.values():
+        # With a bus leg the walk ends at the platform of the first stop
+        target = model.bus_stops.platforms[pedestrian.leg[0]] if pedestrian.leg else pedestrian.destiny
+        assert pedestrian.route is model.walk_router.get_route(pedestrian.position, target)
+        cells = [model.terrain.cell(index) for index in pedestrian.route]
+        assert cells[0] == pedestrian.position and cells[-1] == target
+        assert all(abs(x1 - x2) + abs(y1 - y2) == 1 for (x1, y1), (x2, y2) in zip(cells, cells[1:]))
+
+
+def test_the_cursor_follows_the_agent():
+    # route[cursor - 1] is where the agent stands, route[cursor] where it
+    # goes next
+    model = MapModel(37, 37, 40, 4, 40, seed=1)
+    terrain = model.terrain
+    for i in range(100):
+        model.step()
+        for registry in (model.cars, model.pedestrians):
+            for agent in registry.values():
+                if agent.show:
+                    assert agent.pos == (terrain.cell(agent.route[agent.cursor - 1]) if agent.cursor else agent.position)
+
+
+def test_an_agent_on_the_last_cell_of_its_route_arrives():
+    model = MapModel(37, 37, 0, 0, 0, seed=1)
+    car = model.spawn(Car, model.parking_lots[0], model.parking_lots[0], model.cars)
+    pedestrian = model.spawn(Pedestrians, model.directions[0], model.directions[0], model.pedestrians)
+    pedestrian.leg = None
+    pedestrian.get_path()
+    assert len(car.route) == len(pedestrian.route) == 1
+    car.move()
+    pedestrian.move()
+    assert not car.show and not pedestrian.show
+    assert model.arrivals["cars"] == model.arrivals["pedestrians"] == 1
@@ -0,0 +1,42 @@
+from Car import Car
+from Bus import Bus
+from Pedestrians import Pedestrians
+from ModeloV1 import MapModel
+
+KEYS = {Car: "cars", Bus: "metrobuses", Pedestrians: "pedestrians"}
+
+
+def scan(model):
+    # The snapshot from the grid cells, the way it was built before the
+    # registries
+    snapshot = {key: [] for key in KEYS.values()}
+    for contents, x, y in model.grid.coord_iter():
+        for agent in contents:
+            entry = {"id": agent.unique_id, "x": x, "y": y}
+            if type(agent) is not Pedestrians:
+                entry["direction"] = agent.direccion
+            snapshot[KEYS[type(agent)]].append(entry)
+    return snapshot
+
+
+def by_id(entries):
+    # What the grid tells, without the passengers of the buses
+    entries = [{key: entry[key] for key in ("id", "x", "y", "direction") if key in entry} for entry in entries]
+    return sorted(entries, key=lambda entry: entry["id"])
+
+
+def test_snapshot_has_what_the_grid_has():
+    model = MapModel(37, 37, 40, 4, 40)
+    for i in range(60):
+        model.step()
+        # Finished agents leave the grid, and so do the pedestrians waiting
+        # at a bus stop
+        snapshot = model.ubication(visible_only=True)
+        waiting = {pedestrian.unique_id for queue in model.bus_stops.queues for pedestrian in queue}
+        snapshot["pedestrians"] = [entry for entry in snapshot["pedestrians"] if entry["id"] not in waiting]
+        expected = scan(model)
+        for key in KEYS.values():
+            assert by_id(snapshot[key]) == by_id(expected[key]), key
+        assert snapshot["trafficlights"] == [
+            {"id": light.unique_id, "x": light.pos[0], "y": light.pos[1], "color": light.color}
+            for light in model.traffic_lights]